@@ -0,0 +1,159 @@
+# admission.py
+#
+# Admission control for POST /. Before an analysis starts, admit() decides:
+#
+#   admit         run it normally
+#   degrade       run it with template prompts only (no Ollama calls), because the
+#                 box is busy: DEGRADE_IN_FLIGHT analyses are already running, or the
+#                 recent p90 of full analyses is above LATENCY_TARGET_SECONDS
+#   overloaded    MAX_IN_FLIGHT analyses are running; answer 503 with Retry-After
+#   rate_limited  the user's token bucket is empty; answer 429 with Retry-After
+#
+# Rejections are cheap and immediate, so the requests that are accepted keep
+# meeting their latency target instead of everything slowing down together until
+# gunicorn times out. Counts, latencies and buckets are kept in SQLite so every
+# gunicorn worker sees the same numbers.
+
+import math
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from deadlines import REQUEST_DEADLINE_SECONDS
+
+# --- Admission Configuration ---
+# Analyses running at once across all workers; 0 disables the in-flight limits
+MAX_IN_FLIGHT = int(os.environ.get('ALCHEMIST_MAX_IN_FLIGHT', '8'))
+DEGRADE_IN_FLIGHT = int(os.environ.get('ALCHEMIST_DEGRADE_IN_FLIGHT', str(max(1, MAX_IN_FLIGHT * 3 // 4))))
+LATENCY_TARGET_SECONDS = float(os.environ.get('ALCHEMIST_LATENCY_TARGET_SECONDS', str(REQUEST_DEADLINE_SECONDS or 8)))
+# Per-user token bucket; 0 disables rate limiting
+USER_RATE_PER_MINUTE = float(os.environ.get('ALCHEMIST_USER_RATE_PER_MINUTE', '6'))
+USER_BURST = int(os.environ.get('ALCHEMIST_USER_BURST', '3'))
+RECENT_WINDOW_SECONDS = 60
+# An admission older than this belongs to a request that died without finishing
+ADMISSION_LEASE_SECONDS = 300
+
+Admission = namedtuple('Admission', ['decision', 'retry_after', 'ticket'])
+
+
+def init_admission_tables(cursor):
+    """
+    Creates the admissions, analysis_latencies and rate_buckets tables. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS admissions (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id INTEGER NOT NULL,
+             pid INTEGER NOT NULL,
+             started_at REAL NOT NULL
+         )
+     ''')
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS analysis_latencies (
+             finished_at REAL NOT NULL,
+             seconds REAL NOT NULL
+         )
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_analysis_latencies_finished ON analysis_latencies (finished_at);
+     ''')
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS rate_buckets (
+             user_id INTEGER PRIMARY KEY,
+             tokens REAL NOT NULL,
+             updated_at REAL NOT NULL
+         )
+     ''')
+
+
+def _connect(database):
+    return sqlite3.connect(database, timeout=30, isolation_level=None)
+
+
+def _take_token(conn, user_id, now):
+    """Returns 0 if a token was taken, otherwise the seconds until one is available."""
+    if not USER_RATE_PER_MINUTE:
+        return 0
+    per_second = USER_RATE_PER_MINUTE / 60.0
+    row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE user_id = ?', (user_id,)).fetchone()
+    tokens = USER_BURST if row is None else min(USER_BURST, row[0] + (now - row[1]) * per_second)
+    if tokens < 1:
+        return (1 - tokens) / per_second
+    conn.execute('INSERT INTO rate_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?) '
+                 'ON CONFLICT(user_id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                 (user_id, tokens - 1, now))
+    return 0
+
+
+def _recent_latency(conn, now, pct):
+    """The pct-th percentile of full analyses finished in the last RECENT_WINDOW_SECONDS, or None."""
+    count = conn.execute('SELECT COUNT(*) FROM analysis_latencies WHERE finished_at >= ?',
+                         (now - RECENT_WINDOW_SECONDS,)).fetchone()[0]
+    if not count:
+        return None
+    return conn.execute('SELECT seconds FROM analysis_latencies WHERE finished_at >= ? ORDER BY seconds '
+                        'LIMIT 1 OFFSET ?', (now - RECENT_WINDOW_SECONDS, int((count - 1) * pct / 100))).fetchone()[0]
+
+
+def admit(database, user_id, check_capacity=True):
+    """
+    Decides what to do with a new analysis; see the module comment. Admitted and
+    degraded requests hold a ticket that must be passed to finish(). With
+    `check_capacity` False (queued analyses) only the rate limit applies.
+    """
+    now = time.time()
+    conn = _connect(database)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM admissions WHERE started_at < ?', (now - ADMISSION_LEASE_SECONDS,))
+            in_flight = conn.execute('SELECT COUNT(*) FROM admissions').fetchone()[0]
+            decision, retry_after = 'admit', None
+            if check_capacity and MAX_IN_FLIGHT:
+                p50 = _recent_latency(conn, now, 50)
+                if in_flight >= MAX_IN_FLIGHT:
+                    # Roughly when the requests ahead of it will have finished
+                    decision, retry_after = 'overloaded', p50 or LATENCY_TARGET_SECONDS
+                elif in_flight >= DEGRADE_IN_FLIGHT or (_recent_latency(conn, now, 90) or 0) > LATENCY_TARGET_SECONDS:
+                    decision = 'degrade'
+            if decision != 'overloaded':
+                wait = _take_token(conn, user_id, now)
+                if wait:
+                    decision, retry_after = 'rate_limited', wait
+
+            ticket = None
+            if decision in ('admit', 'degrade') and check_capacity:
+                ticket = conn.execute('INSERT INTO admissions (user_id, pid, started_at) VALUES (?, ?, ?)',
+                                      (user_id, os.getpid(), now)).lastrowid
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return Admission(decision, None if retry_after is None else max(1, math.ceil(retry_after)), ticket)
+
+
+def finish(database, ticket, seconds=None):
+    """Ends an admission. `seconds` is recorded for full (not degraded) analyses only."""
+    now = time.time()
+    conn = _connect(database)
+    try:
+        conn.execute('DELETE FROM admissions WHERE id = ?', (ticket,))
+        if seconds is not None:
+            conn.execute('INSERT INTO analysis_latencies (finished_at, seconds) VALUES (?, ?)', (now, seconds))
+            conn.execute('DELETE FROM analysis_latencies WHERE finished_at < ?', (now - RECENT_WINDOW_SECONDS,))
+    finally:
+        conn.close()
+
+
+def release_process(database, pid):
+    """Drops the admissions of a process that has exited (gunicorn's child_exit hook)."""
+    conn = _connect(database)
+    try:
+        conn.execute('DELETE FROM admissions WHERE pid = ?', (pid,))
+    except sqlite3.OperationalError:
+        pass  # tables not created yet
+    finally:
+        conn.close()
@@ -0,0 +1,486 @@
+# agitation.py
+#
+# The five agitation prompt types as a table, and the ways of asking the LLM for them:
+#
+#   sequential  one Ollama call per type, one after another (the original behaviour)
+#   concurrent  the same five calls, issued in parallel
+#   structured  a single call returning a JSON object with all five questions; fields
+#               that are missing or unusable fall back to their templates
+#
+#   ALCHEMIST_AGITATION_MODE=structured gunicorn alchemist_core:app
+#
+# `llm` is any callable with generate_llm_prompt's signature, so callers decide how
+# Ollama is reached (and benchmarks can pass a stub). With a deadlines.Deadline, calls
+# still outstanding when it expires are abandoned and their prompts use the template.
+
+import json
+import os
+import random
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from deadlines import budget_deadline
+from metrics import record_agitation_fallback
+
+AGITATION_MODES = ('sequential', 'concurrent', 'structured')
+# Not an LLM mode: every prompt is its template (admission control uses it to shed load)
+TEMPLATE_MODE = 'template'
+AGITATION_MODE = os.environ.get('ALCHEMIST_AGITATION_MODE', 'sequential')
+AGITATION_CONCURRENCY = int(os.environ.get('ALCHEMIST_AGITATION_CONCURRENCY', '5'))
+# One JSON object holding five questions needs more room than a single question
+STRUCTURED_MAX_TOKENS = int(os.environ.get('ALCHEMIST_STRUCTURED_MAX_TOKENS', '600'))
+# Shorter "questions" are treated as missing
+MIN_PROMPT_CHARS = 15
+
+# --- Generation profiles ---
+# How each type is generated. `model` None means OLLAMA_MODEL; `budget_seconds` caps
+# one call, counted from when it gets its LLM slot, within a timed request deadline
+# (queued jobs and pregeneration have none and aren't budgeted). Replies are a single question, so
+# generation stops at the first '?' instead of running on to max_tokens (Ollama
+# leaves the stop string out; _finish_question puts it back). A reply that reached
+# max_tokens instead was cut off mid-question and falls back to the template.
+# Override per type with
+#
+#   ALCHEMIST_AGITATION_PROFILES='{"deconstruct": {"model": "qwen2.5:0.5b", "max_tokens": 40}}'
+FAST_MODEL = os.environ.get('ALCHEMIST_FAST_MODEL') or None
+QUESTION_STOP = ['?', '\n\n']
+GenerationProfile = namedtuple('GenerationProfile', ['model', 'max_tokens', 'temperature', 'stop', 'budget_seconds'])
+
+AGITATION_PROFILES = {
+    # Paradoxical links and cross-domain bridges need the bigger model
+    'link': GenerationProfile(None, 80, 0.8, QUESTION_STOP, 5.0),
+    'cross_pollinate': GenerationProfile(None, 80, 0.9, QUESTION_STOP, 5.0),
+    'perspective': GenerationProfile(FAST_MODEL, 80, 0.9, QUESTION_STOP, 4.0),
+    'deconstruct': GenerationProfile(FAST_MODEL, 60, 0.7, QUESTION_STOP, 3.0),
+    'assumptions': GenerationProfile(FAST_MODEL, 60, 0.7, QUESTION_STOP, 3.0),
+    # One JSON object with every question: no stop sequence, only the request deadline
+    'structured': GenerationProfile(None, STRUCTURED_MAX_TOKENS, 0.7, None, None),
+}
+
+
+def _apply_profile_overrides(profiles, overrides_json):
+    if not overrides_json:
+        return profiles
+    profiles = dict(profiles)
+    for agitation_type, fields in json.loads(overrides_json).items():
+        if agitation_type not in profiles:
+            raise ValueError(f"ALCHEMIST_AGITATION_PROFILES: unknown agitation type '{agitation_type}'.")
+        profiles[agitation_type] = profiles[agitation_type]._replace(**fields)
+    return profiles
+
+
+AGITATION_PROFILES = _apply_profile_overrides(AGITATION_PROFILES, os.environ.get('ALCHEMIST_AGITATION_PROFILES'))
+
+
+def profile_models(default_model):
+    """Every model the profiles use, e.g. to keep them all loaded."""
+    return sorted({profile.model or default_model for profile in AGITATION_PROFILES.values()})
+
+
+def _profile_kwargs(agitation_type):
+    profile = AGITATION_PROFILES[agitation_type]
+    return {'model': profile.model, 'max_tokens': profile.max_tokens, 'temperature': profile.temperature,
+            'stop': profile.stop}
+
+NO_CONCEPTS_MESSAGE = "Please provide more descriptive text to extract concepts for prompt generation."
+
+UNRELATED_DOMAINS = [
+    "the intricate dance of subatomic particles",
+    "the evolutionary strategies of deep-sea organisms",
+    "the composition of classical symphonies",
+    "the logic gates within a quantum computer",
+    "ancient martial arts philosophy",
+    "the principles of surrealist art",
+    "the complex rules of a board game",
+    "the formation of celestial bodies",
+    "the internal mechanisms of a clock",
+    "the growth patterns of fungi"
+]
+
+PERSPECTIVES = [
+    "a time-traveling anthropologist from 3077",
+    "a sentient quantum AI managing a planetary ecosystem",
+    "a deep-sea vent microbiologist observing a new life form",
+    "a minimalist architect designing a space colony",
+    "a performance artist interpreting the concept through dance",
+    "a disillusioned philosopher from the digital dark ages",
+    "a wise elder from a pre-industrial indigenous tribe",
+    "a rogue neuroscientist experimenting with dream states"
+]
+
+
+# --- Prompt construction ---
+# Every call starts with the same system message, which holds the instructions and
+# examples for all five types; only the short request at the end of the user message
+# changes. Ollama keeps the evaluated prompt of a slot around and only processes what
+# differs from it, so after the first call the static prefix costs nothing. Anything
+# that varies per call (terms, domain, perspective, the user's input) must stay out of
+# the system message and the briefs below, or the shared prefix is lost.
+
+# --- Agitation 1: Explore / Challenge Link ---
+_LINK_BRIEF = (
+    "Forge a single, profound, and counter-intuitive question that either reveals an unexpected "
+    "connection between two concepts or challenges a seemingly obvious link, exploring a hidden or "
+    "paradoxical link between them.\n"
+    "Example 1: Concepts 'Internet' and 'Privacy'. "
+    "Question: 'How does the relentless pursuit of digital privacy inadvertently lead to its erosion, creating a surveillance paradox?'\n"
+    "Example 2: Concepts 'Growth' and 'Stagnation'. "
+    "Question: 'In what ways is apparent stagnation a necessary precursor to true, sustainable growth, rather than its antithesis?'"
+)
+
+
+def _link_request(ctx):
+    return f"Concepts '{ctx['main_term']}' and '{ctx['secondary_term']}'."
+
+
+def _link_template(ctx):
+    main_term, secondary_term = ctx['main_term'], ctx['secondary_term']
+    return (f"Consider an unexpected connection between '{main_term}' and '{secondary_term}'. How might "
+            f"'{main_term}' lead to '{secondary_term}' if conventional logic was suspended?")
+
+
+# --- Agitation 2: Deconstruct ---
+_DECONSTRUCT_BRIEF = (
+    "Formulate a single, incisive question that forces the user to dissect the fundamental components, "
+    "assumptions, or boundaries of the concept. What are its essential, indivisible parts? What happens "
+    "if a core component is removed or fundamentally altered? The question should challenge the very "
+    "definition or existence of the concept itself.\n"
+    "Example 1: Concept 'Justice'. "
+    "Question: 'If the outcome of a just system is always subjective, is justice a fixed principle or merely a continuous, unattainable pursuit?'\n"
+    "Example 2: Concept 'Decision'. "
+    "Question: 'If every decision is ultimately influenced by a cascade of prior unconscious biases, can true free will in decision-making ever truly exist?'"
+)
+
+
+def _deconstruct_request(ctx):
+    return f"Concept '{ctx['main_term']}'."
+
+
+def _deconstruct_template(ctx):
+    main_term = ctx['main_term']
+    return (f"Let's deconstruct '{main_term}'. What are its absolute core components? If you removed one "
+            f"essential part, would it still be '{main_term}'? What would it become?")
+
+
+# --- Agitation 3: Cross-pollinate ---
+_CROSS_POLLINATE_BRIEF = (
+    "Generate a single, highly creative and thought-provoking question that bridges the concept with a "
+    "seemingly unrelated domain. What new perspective emerges when applying principles from the domain "
+    "to the concept? The question should reveal unexpected insights or solutions.\n"
+    "Example 1: Concept 'Innovation', Domain 'Fungal Networks'. "
+    "Question: 'If innovation were to mimic the distributed, resilient, and adaptive growth of a fungal network, how would organizations restructure to optimize for pervasive knowledge sharing and emergent solutions?'\n"
+    "Example 2: Concept 'Decision-making', Domain 'Classical Music Composition'. "
+    "Question: 'How might the principles of counterpoint and harmony in classical music composition offer a framework for balancing conflicting priorities in complex decision-making processes?'"
+)
+
+
+def _cross_pollinate_request(ctx):
+    return f"Concept '{ctx['main_term']}', Domain '{ctx['domain']}'."
+
+
+def _cross_pollinate_template(ctx):
+    main_term, domain = ctx['main_term'], ctx['domain']
+    return (f"Imagine '{main_term}' in the context of '{domain}'. How would a key concept from '{domain}' "
+            f"help you see '{main_term}' differently?")
+
+
+# --- Agitation 4: Challenge Assumptions ---
+_ASSUMPTIONS_BRIEF = (
+    "Formulate a single, direct, and unsettling question that forces the user to identify and confront "
+    "the fundamental, often implicit, assumptions underlying their problem or the core concept. What if "
+    "the most foundational assumption were completely false? The question should propose a radical "
+    "counter-factual or alternative reality.\n"
+    "Example 1: Concept 'Education'. "
+    "Question: 'If the primary purpose of education was not knowledge transfer but the cultivation of radical uncertainty, how would learning environments transform?'\n"
+    "Example 2: Concept 'Success'. "
+    "Question: 'What if the very metric by which we define 'success' was inherently designed to perpetuate systemic inequities, making true universal success impossible?'"
+)
+
+
+def _assumptions_request(ctx):
+    # Pregenerated questions (prompt_pool.py) have no problem text
+    if not ctx['input_text']:
+        return f"Concept '{ctx['main_term']}'."
+    return f"Concept '{ctx['main_term']}', Problem '{ctx['input_text']}'."
+
+
+def _assumptions_template(ctx):
+    return (f"What core assumptions are you making about '{ctx['main_term']}' or the overall problem? Try to "
+            f"list them out and then consider what would happen if the opposite of one of those assumptions were true.")
+
+
+# --- Agitation 5: Perspective Shifting ---
+_PERSPECTIVE_BRIEF = (
+    "Generate a single, imaginative question that forces the user to view their problem through the "
+    "highly unique lens of a specific, unconventional perspective: how would it be understood, solved, "
+    "or transformed from there? The question should reveal unexpected values, priorities, or solutions.\n"
+    "Example 1: Problem 'Urban Traffic Congestion', Perspective 'a migratory bird observing from above'. "
+    "Question: 'If urban traffic congestion was viewed through the eyes of a migratory bird, what fundamental, unseen patterns of flow and bottleneck would become apparent, suggesting solutions entirely external to human infrastructure?'\n"
+    "Example 2: Concept 'Data Security', Perspective 'a medieval cryptographer protecting ancient scrolls'. "
+    "Question: 'How might the principles of counterpoint and harmony in classical music composition offer a framework for balancing conflicting priorities in complex decision-making processes?'"
+)
+
+
+def _perspective_request(ctx):
+    return f"Problem '{ctx['input_text']}', Perspective '{ctx['perspective']}'."
+
+
+def _perspective_template(ctx):
+    return (f"How would '{ctx['input_text']}' (your input) be perceived, approached, or solved by "
+            f"{ctx['perspective']}?")
+
+
+# type: metrics label, JSON key and task name in the prompt; brief: static instructions and
+# examples; request: the per-call part; example: one question for the structured call's sample
+AgitationSpec = namedtuple('AgitationSpec', ['type', 'heading', 'brief', 'request', 'template', 'example'])
+
+AGITATION_SPECS = [
+    AgitationSpec(
+        'link', "Explore a New Link", _LINK_BRIEF, _link_request, _link_template,
+        "How does the relentless pursuit of digital privacy inadvertently lead to its erosion, creating a surveillance paradox?"),
+    AgitationSpec(
+        'deconstruct', "Deconstruct This", _DECONSTRUCT_BRIEF, _deconstruct_request, _deconstruct_template,
+        "If the outcome of a just system is always subjective, is justice a fixed principle or merely a continuous, unattainable pursuit?"),
+    AgitationSpec(
+        'cross_pollinate', "Cross-Pollinate Ideas", _CROSS_POLLINATE_BRIEF, _cross_pollinate_request,
+        _cross_pollinate_template,
+        "If innovation were to mimic the distributed, resilient, and adaptive growth of a fungal network, how would organizations restructure?"),
+    AgitationSpec(
+        'assumptions', "Challenge Assumptions", _ASSUMPTIONS_BRIEF, _assumptions_request, _assumptions_template,
+        "If the primary purpose of education was not knowledge transfer but the cultivation of radical uncertainty, how would learning environments transform?"),
+    AgitationSpec(
+        'perspective', "Shift Your Perspective", _PERSPECTIVE_BRIEF, _perspective_request, _perspective_template,
+        "If urban traffic congestion was viewed through the eyes of a migratory bird, what unseen patterns of flow would become apparent?"),
+]
+
+SYSTEM_PROMPT = (
+    "You are a conceptual alchemist and an expert in lateral thinking, radical deconstruction, "
+    "cross-domain ideation, uncovering hidden assumptions and radical reframing. Each request names one "
+    "of the tasks below and gives its inputs. Unless it asks otherwise, answer with a single, profound, "
+    "counter-intuitive question that provokes deep, non-linear thought, and nothing else.\n\n" +
+    "\n\n".join(f"Task '{spec.type}': {spec.brief}" for spec in AGITATION_SPECS)
+)
+
+NO_LINK_PROMPT = (f"<b>{AGITATION_SPECS[0].heading}:</b> Not enough distinct concepts to explore new links. "
+                  f"Consider adding more detail.")
+
+
+def agitation_messages(spec, ctx):
+    """(system, user) for one type: the shared static prefix, then this call's inputs."""
+    return SYSTEM_PROMPT, f"Task '{spec.type}'. {spec.request(ctx)}\nQuestion:"
+
+
+def agitation_context(key_terms_list, original_input_text):
+    return {
+        'main_term': key_terms_list[0] if key_terms_list else "your core idea",
+        'secondary_term': key_terms_list[1] if len(key_terms_list) > 1 else None,
+        'domain': random.choice(UNRELATED_DOMAINS),
+        'perspective': random.choice(PERSPECTIVES),
+        'input_text': original_input_text,
+    }
+
+
+def active_specs(ctx):
+    # The link prompt needs two concepts
+    return [spec for spec in AGITATION_SPECS if spec.type != 'link' or ctx['secondary_term']]
+
+
+def format_prompts(ctx, texts):
+    """Headline each generated question; types without one get their template."""
+    prompts = []
+    for spec in AGITATION_SPECS:
+        if spec.type == 'link' and not ctx['secondary_term']:
+            prompts.append(NO_LINK_PROMPT)
+        elif texts.get(spec.type):
+            prompts.append(f"<b>{spec.heading}:</b> {texts[spec.type]}")
+        else:
+            prompts.append(f"<b>{spec.heading} (Template):</b> {spec.template(ctx)}")
+    return prompts
+
+
+_QUESTION_LABEL = re.compile(r'^\s*(?:question\s*:)?\s*', re.IGNORECASE)
+_QUOTES = '\'"\u201c\u201d'
+
+
+def _finish_question(text):
+    """Drops a 'Question:' label and wrapping quotes, and restores the '?' the stop sequence removed."""
+    text = _QUESTION_LABEL.sub('', text).strip()
+    if text[:1] in _QUOTES:
+        text = text[1:].rstrip(_QUOTES).strip()
+    if text and not text.endswith('?'):
+        text += '?'
+    return text
+
+
+def _usable(text, stats=None):
+    if not text or "Error" in text:
+        return None
+    if stats and stats.get('done_reason') == 'length':
+        # Cut off at max_tokens mid-sentence; a '?' on the end wouldn't make it a question
+        return None
+    text = _finish_question(text)
+    return text if len(text) >= MIN_PROMPT_CHARS else None
+
+
+def _generate_one(spec, ctx, llm, deadline, reasons):
+    profile = AGITATION_PROFILES[spec.type]
+    call_deadline = budget_deadline(deadline, profile.budget_seconds)
+    stats = {}
+    text = _usable(llm(*agitation_messages(spec, ctx), agitation_type=spec.type, deadline=call_deadline,
+                       stats=stats, **_profile_kwargs(spec.type)), stats)
+    if text is None and reasons is not None:
+        if stats.get('done_reason') == 'length':
+            reasons[spec.type] = 'truncated'
+        elif call_deadline is not None and call_deadline.timed_out and (deadline is None or not deadline.expired()):
+            reasons[spec.type] = 'budget'
+    return text
+
+
+def generate_sequential(specs, ctx, llm, deadline=None, reasons=None):
+    texts = {}
+    for spec in specs:
+        if deadline is not None and deadline.expired():
+            break
+        texts[spec.type] = _generate_one(spec, ctx, llm, deadline, reasons)
+    return texts
+
+
+def generate_concurrent(specs, ctx, llm, deadline=None, max_workers=AGITATION_CONCURRENCY, reasons=None):
+    # Each call watches the deadline itself and returns an error once it passes
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(specs)))) as pool:
+        futures = {spec.type: pool.submit(_generate_one, spec, ctx, llm, deadline, reasons) for spec in specs}
+        return {agitation_type: future.result() for agitation_type, future in futures.items()}
+
+
+# --- Structured (single call) mode ---
+def agitation_schema(specs):
+    """JSON schema for the structured reply; also sent to Ollama as `format` to constrain decoding."""
+    return {
+        'type': 'object',
+        'properties': {spec.type: {'type': 'string'} for spec in specs},
+        'required': [spec.type for spec in specs],
+    }
+
+
+def structured_messages(specs, ctx):
+    # Same system prompt as the per-type calls, so the cached prefix serves both modes
+    lines = [f'- "{spec.type}": {spec.request(ctx)}' for spec in specs]
+    example = json.dumps({spec.type: spec.example for spec in specs}, indent=1)
+    user_msg = (
+        f"Do every task below and return the questions as one JSON object with exactly these keys, "
+        f"each value a single question as a plain string. Reply with the JSON object and nothing else.\n"
+        f"Example of the expected shape:\n{example}\n\n" + "\n".join(lines)
+    )
+    return SYSTEM_PROMPT, user_msg
+
+
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$', re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def _load_json_object(raw):
+    """Parses the model's reply, repairing the usual damage: code fences, chatter around the object, trailing commas, truncation."""
+    text = _CODE_FENCE.sub('', raw.strip())
+    start = text.find('{')
+    if start < 0:
+        return None
+    end = text.rfind('}')
+    candidates = []
+    if end > start:
+        candidates.append((text[start:end + 1], False))
+    # Cut off by num_predict: close the open string and object
+    candidates += [(text[start:] + '"}', True), (text[start:] + '}', True)]
+    for candidate, truncated in candidates:
+        for attempt in (candidate, _TRAILING_COMMA.sub(r'\1', candidate)):
+            try:
+                data = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                if truncated and data:
+                    # The last field is the one that was cut off mid-sentence
+                    data.pop(list(data)[-1])
+                return data
+    return None
+
+
+def _field_by_regex(raw, key):
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(key), raw)
+    if not match:
+        return None
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_structured_response(raw, types):
+    """
+    Returns {type: question} for every field that passes validation: a string of at
+    least MIN_PROMPT_CHARS characters. Keys are matched loosely ('Cross-Pollinate' works
+    for cross_pollinate) and single-entry objects like {"question": "..."} are unwrapped.
+    """
+    data = _load_json_object(raw) or {}
+    normalised = {re.sub(r'[\s\-]+', '_', str(k).strip().lower()): v for k, v in data.items()}
+    fields = {}
+    for agitation_type in types:
+        value = normalised.get(agitation_type)
+        if isinstance(value, dict) and len(value) == 1:
+            value = next(iter(value.values()))
+        if value is None:
+            value = _field_by_regex(raw, agitation_type)
+        if isinstance(value, str) and len(value.strip()) >= MIN_PROMPT_CHARS:
+            fields[agitation_type] = value.strip()
+    return fields
+
+
+def generate_structured(specs, ctx, llm, deadline=None):
+    system_msg, user_msg = structured_messages(specs, ctx)
+    raw = llm(system_msg, user_msg, agitation_type="structured", response_format=agitation_schema(specs),
+              deadline=deadline, **_profile_kwargs('structured'))
+    if raw.startswith("Error"):
+        return {}
+    return parse_structured_response(raw, [spec.type for spec in specs])
+
+
+def generate_agitation_prompts(key_terms_list, original_input_text, llm, mode=None, deadline=None, degraded=None,
+                               pregenerated=None):
+    """
+    Returns the five prompts, in AGITATION_SPECS order. If `degraded` is a list, the
+    types that fell back to their template are appended to it. `pregenerated(ctx,
+    specs)` returns ready-made questions by type (see prompt_pool.py); only the types
+    it has nothing for are generated.
+    """
+    if not key_terms_list:
+        return [NO_CONCEPTS_MESSAGE]
+
+    mode = mode or AGITATION_MODE
+    ctx = agitation_context(key_terms_list, original_input_text)
+    specs = active_specs(ctx)
+    if mode not in AGITATION_MODES + (TEMPLATE_MODE,):
+        raise ValueError(f"Unknown agitation mode '{mode}' (expected one of {', '.join(AGITATION_MODES)}).")
+    ready = pregenerated(ctx, specs) if pregenerated is not None else {}
+    live = [spec for spec in specs if spec.type not in ready]
+    # Types whose call ran out of its own budget or was cut off at max_tokens
+    reasons = {}
+    if mode == TEMPLATE_MODE or not live:
+        texts = {}
+    elif mode == 'structured':
+        texts = generate_structured(live, ctx, llm, deadline)
+    elif mode == 'concurrent':
+        texts = generate_concurrent(live, ctx, llm, deadline, reasons=reasons)
+    else:
+        texts = generate_sequential(live, ctx, llm, deadline, reasons=reasons)
+    texts.update(ready)
+
+    if mode == TEMPLATE_MODE:
+        reason = 'shed'
+    else:
+        reason = 'deadline' if deadline is not None and deadline.expired() else 'error'
+    for spec in specs:
+        if not texts.get(spec.type):
+            record_agitation_fallback(spec.type, mode, reasons.get(spec.type, reason))
+            if degraded is not None:
+                degraded.append(spec.type)
+    return format_prompts(ctx, texts)
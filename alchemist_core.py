@@ -1,25 +1,53 @@
 # alchemist_core.py
 
-import torch
+import thread_budget
+
+# Size the BLAS/OpenMP/tokenizers pools before numpy and the encoder are imported
+thread_budget.apply_env_budget()
+
 import networkx as nx
-from sentence_transformers import SentenceTransformer, util
 from flask import Flask, render_template_string, request, redirect, url_for, jsonify, session as flask_session
 import spacy
 import sqlite3
 import json
 from datetime import datetime
-import requests
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Flask, render_template_string, render_template, request, redirect, url_for, jsonify, \
     session as flask_session
 import os
+import time
+from functools import partial, wraps
+from job_queue import init_job_tables, enqueue_job, get_job, queue_stats
+from metrics import (stage_timer, observe_db, observe_agitation, observe_agitation_tokens, observe_ollama_timings,
+                     observe_ollama_call,
+                     record_model_load, record_request_deadline, record_admission, install_request_metrics,
+                     render_metrics, JobQueueCollector, LLMSchedulerCollector)
+from profiler import init_profile_tables, install_profiler, list_profiles, get_profile
+from encoders import load_encoder, ENCODER_BACKEND
+from live_preview import PreviewEngine
+from concept_stream import map_concepts_streaming, is_key_term, STREAMING_THRESHOLD_CHARS
+from concept_graph import ConceptGraph, load_concept_graph, load_graph_data
+from knn_graph import similarity_edges, DEFAULT_SIMILARITY_THRESHOLD, MAX_TOP_K
+from deadlines import init_cancel_tables, cancel_request, cancel_checker, request_deadline, StepDeadline
+import agitation
+import config
+import ollama_client
+from ollama_pool import BackendPool, backend_urls, pooled_generate
+from llm_scheduler import init_scheduler_database, llm_slot
+import admission
+import prompt_pool
+import result_cache
+import session_embeddings
+from model_access import ModelAccess, InferenceBusy
 
 
 # --- Step 0: Load spaCy model ---
 print("Loading spaCy model for advanced concept extraction...")
 try:
+    _load_started = time.perf_counter()
     nlp_spacy = spacy.load("en_core_web_sm")
+    record_model_load("en_core_web_sm", time.perf_counter() - _load_started)
     print("spaCy model loaded successfully.")
 except OSError:
     print("spaCy model 'en_core_web_sm' not found. Please run: python -m spacy download en_core_web_sm")
@@ -27,48 +55,70 @@ except OSError:
     exit()
 
 # --- Step 1: Initialize The Idea Forge's core model ---
-print("Initializing The Idea Forge's core model...")
+print(f"Initializing The Idea Forge's core model ({ENCODER_BACKEND} backend)...")
 model_name = 'all-MiniLM-L6-v2'
-device = "cuda" if torch.cuda.is_available() else "cpu"
-if device == "cuda":
-    print(f"CUDA GPU found: {torch.cuda.get_device_name(0)}. Setting model device to GPU.")
-else:
-    print("No CUDA GPU found or configured. Setting model device to CPU.")
-
-alchemist_model = SentenceTransformer(model_name, device=device)
+_load_started = time.perf_counter()
+alchemist_model = load_encoder(model_name, threads=thread_budget.threads_per_pipeline())
+record_model_load(f"{model_name}-{ENCODER_BACKEND}", time.perf_counter() - _load_started)
+thread_budget.apply_runtime_budget()
+print(thread_budget.format_report())
 print("The Idea Forge's core model ready.\n")
 
-# --- Ollama Configuration ---
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODEL = "phi3:mini"
-
+# Request threads reach spaCy and the encoder only through MODELS (see model_access.py),
+# so the app is safe to run on threaded gunicorn workers
+MODELS = ModelAccess(nlp_spacy, alchemist_model, load_nlp=lambda: spacy.load("en_core_web_sm"),
+                     load_encoder=lambda: load_encoder(model_name, threads=thread_budget.threads_per_pipeline()))
+# Extra inference threads load their model copies now rather than in the middle of a request
+MODELS.start_all()
 
-def generate_llm_prompt(system_message, user_message, max_tokens=150, temperature=0.7):
+# --- Ollama Configuration ---
+OLLAMA_API_URL = os.environ.get('OLLAMA_API_URL', "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', "phi3:mini")
+# One or more backends (OLLAMA_API_URLS, falling back to OLLAMA_API_URL); see ollama_pool.py
+OLLAMA_POOL = BackendPool(backend_urls(OLLAMA_API_URL))
+OLLAMA_POOL.start_health_checks()
+# Load the model while the app starts and ping it every OLLAMA_KEEP_WARM_INTERVAL seconds
+# so it stays resident between requests (0 only loads it once)
+OLLAMA_WARMUP = os.environ.get('ALCHEMIST_OLLAMA_WARMUP', '1') == '1'
+OLLAMA_KEEP_WARM_INTERVAL = float(os.environ.get('ALCHEMIST_OLLAMA_KEEP_WARM_INTERVAL', '240'))
+
+if OLLAMA_WARMUP:
+    # Every model the agitation profiles route to, on every backend
+    for _model in agitation.profile_models(OLLAMA_MODEL):
+        for _backend in OLLAMA_POOL.backends:
+            ollama_client.start_keep_warm(_backend.url, _model, OLLAMA_KEEP_WARM_INTERVAL,
+                                          on_load=lambda seconds, model=_model: record_model_load(f"ollama-{model}",
+                                                                                                   seconds))
+
+
+def generate_llm_prompt(system_message, user_message, max_tokens=150, temperature=0.7, agitation_type="other",
+                        response_format=None, deadline=None, user_id=None, priority='interactive', model=None,
+                        stop=None, stats=None):
     """
-    Sends a request to the local Ollama API to generate a prompt.
+    Sends a request to the local Ollama API to generate a prompt. The call first waits
+    for a slot from the cross-process scheduler (llm_scheduler.py), which is shared
+    fairly between users. `model` defaults to OLLAMA_MODEL. A `stats` dict is filled
+    with what Ollama reported about the generation (see ollama_client.generate).
     """
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "model": OLLAMA_MODEL,
-        "prompt": user_message,
-        "system": system_message,
-        "stream": False,
-        "options": {
-            "temperature": temperature,
-            "num_predict": max_tokens
-        }
-    }
-    try:
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        return result.get("response", "").strip()
-    except requests.exceptions.ConnectionError:
-        return "Error: Ollama server not running or unreachable. Please ensure Ollama is installed and running."
-    except requests.exceptions.RequestException as e:
-        return f"Error interacting with Ollama API: {e}"
-    except json.JSONDecodeError:
-        return "Error: Could not decode JSON response from Ollama."
+    model = model or OLLAMA_MODEL
+    started = time.perf_counter()
+    stats = {} if stats is None else stats
+    with llm_slot(DATABASE, user_id, priority, deadline) as granted:
+        if granted:
+            if isinstance(deadline, StepDeadline):
+                deadline.start()  # a per-call budget counts from the slot grant, not the queue wait
+            result = pooled_generate(OLLAMA_POOL, model, system_message, user_message, max_tokens=max_tokens,
+                                     temperature=temperature, response_format=response_format, stats=stats,
+                                     deadline=deadline, stop=stop)
+        else:
+            result = "Error: no LLM slot became free in time."
+    elapsed = time.perf_counter() - started
+    observe_agitation(agitation_type, elapsed, not result.startswith("Error"))
+    observe_ollama_timings(agitation_type, stats)
+    observe_agitation_tokens(agitation_type, model, stats)
+    if stats:
+        observe_ollama_call(agitation_type, elapsed, ollama_client.is_cold(stats))
+    return result
 
 
 # --- Flask-Login Setup ---
@@ -87,8 +137,9 @@ class User(UserMixin):
     def get(user_id):
         conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
-        cursor.execute('SELECT id, username, password FROM users WHERE id = ?', (user_id,))
-        user_data = cursor.fetchone()
+        with observe_db("get_user"):
+            cursor.execute('SELECT id, username, password FROM users WHERE id = ?', (user_id,))
+            user_data = cursor.fetchone()
         conn.close()
         if user_data:
             return User(user_data[0], user_data[1], user_data[2])
@@ -98,8 +149,9 @@ class User(UserMixin):
     def find_by_username(username):
         conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
-        cursor.execute('SELECT id, username, password FROM users WHERE username = ?', (username,))
-        user_data = cursor.fetchone()
+        with observe_db("get_user_by_name"):
+            cursor.execute('SELECT id, username, password FROM users WHERE username = ?', (username,))
+            user_data = cursor.fetchone()
         conn.close()
         if user_data:
             return User(user_data[0], user_data[1], user_data[2])
@@ -111,8 +163,25 @@ def load_user(user_id):
     return User.get(int(user_id))
 
 
+# Usernames allowed to reach the /admin pages, e.g. ADMIN_USERNAMES="alice,bob"
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.username not in ADMIN_USERNAMES:
+            return "You don't have permission to view this page.", 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
 # --- Step 1.5: Initialize SQLite Database (Simplified) ---
-DATABASE = 'alchemist_sessions.db'
+# ALCHEMIST_DATABASE overrides the path; the gunicorn hooks read it from the same place
+DATABASE = config.DATABASE
+# Earlier analyses of near-identical inputs, see result_cache.py
+RESULT_INDEX = result_cache.ResultIndex(DATABASE)
 
 
 def init_db():
@@ -140,255 +209,127 @@ def init_db():
         cursor.execute('''
              CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions (user_id);
          ''')
+        init_job_tables(cursor)
+        init_profile_tables(cursor)
+        init_cancel_tables(cursor)
+        admission.init_admission_tables(cursor)
+        prompt_pool.init_prompt_pool_tables(cursor)
+        result_cache.init_result_cache_tables(cursor)
+        session_embeddings.init_session_embedding_tables(cursor)
         conn.commit()
+    # The LLM scheduler keeps its tickets in a database of its own (see llm_scheduler.py)
+    init_scheduler_database(DATABASE)
     print(f"SQLite database '{DATABASE}' initialized/updated with user and sessions tables.")
 
 
 # --- Step 2: Define the Conceptual Mapper Function ---
-def map_concepts(text_input):
-    doc = nlp_spacy(text_input)
+def map_concepts(text_input, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, top_k=None):
+    # Long documents are processed in chunks with capped terms/edges, see concept_stream.py
+    if len(text_input) > STREAMING_THRESHOLD_CHARS:
+        return map_concepts_streaming(text_input, MODELS.nlp, MODELS.encoder, similarity_threshold, top_k)
+
+    with stage_timer("spacy"):
+        doc = MODELS.nlp(text_input)
     key_terms = [chunk.text.lower() for chunk in doc.noun_chunks]
-    key_terms = [term for term in key_terms if
-                 len(term.split()) > 0 and len(term) > 2 and term not in ["i", "you", "he", "she", "it", "we", "they",
-                                                                          "me", "him", "her", "us", "them"]]
+    key_terms = [term for term in key_terms if is_key_term(term)]
     key_terms = list(set(key_terms))
     if not key_terms:
-        return nx.Graph(), []
+        return ConceptGraph.empty(), []
 
-    term_embeddings = alchemist_model.encode(key_terms, convert_to_tensor=True)
-    concept_graph = nx.Graph()
-    for term in key_terms:
-        concept_graph.add_node(term)
+    with stage_timer("encode"):
+        # Normalised embeddings make cosine similarity a plain dot product
+        term_embeddings = MODELS.encoder.encode(key_terms, normalize_embeddings=True)
 
-    similarity_threshold = 0.4
-    for i in range(len(key_terms)):
-        for j in range(i + 1, len(key_terms)):
-            term1 = key_terms[i]
-            term2 = key_terms[j]
-            similarity = util.cos_sim(term_embeddings[i], term_embeddings[j]).item()
-            if similarity > similarity_threshold:
-                concept_graph.add_edge(term1, term2, weight=similarity, relation="semantically similar")
-    return concept_graph, key_terms
+    with stage_timer("similarity"):
+        # Large term sets get a sparse top-k graph instead of every pair above the threshold
+        rows, cols, weights = similarity_edges(term_embeddings, similarity_threshold, top_k)
+    # The embeddings are stored with the session so its edges can be recomputed for other thresholds
+    return ConceptGraph(key_terms, rows, cols, weights, embeddings=term_embeddings), key_terms
 
 
-# --- Convert networkx graph to vis.js format ---
+# --- Convert the concept graph to vis.js format ---
 def convert_graph_to_vis_data(concept_graph):
-    nodes = []
-    edges = []
-    node_id_map = {node: i for i, node in enumerate(concept_graph.nodes())}
-
-    for node, data in concept_graph.nodes(data=True):
-        nodes.append({
-            'id': node_id_map[node],
-            'label': node,
-            'title': node,
-            'font': {'size': 16},
-            'shape': 'dot',
-            'color': {
-                'background': '#8d99ae',
-                'border': '#2b2d42',
-                'highlight': {'background': '#edf2f4', 'border': '#ef233c'},
-                'hover': {'background': '#edf2f4', 'border': '#ef233c'}
-            }
-        })
-
-    for u, v, data in concept_graph.edges(data=True):
-        edge_width = max(1, int(data.get('weight', 0) * 4) + 1)
-        edges.append({
-            'from': node_id_map[u],
-            'to': node_id_map[v],
-            'title': f"Similarity: {data.get('weight', 0):.2f}",
-            'width': edge_width,
-            'color': {
-                'color': '#8d99ae',
-                'highlight': '#ef233c',
-                'hover': '#ef233c'
-            }
-        })
-    return {'nodes': nodes, 'edges': edges}
+    if isinstance(concept_graph, nx.Graph):
+        concept_graph = ConceptGraph.from_networkx(concept_graph)
+    return concept_graph.to_vis_data()
 
 
 # --- Step 3: Define the Provocative Prompt Generation Function ---
-def generate_agitation_prompts(concept_graph, key_terms_list, original_input_text):
-    agitation_prompts = []
-    if not key_terms_list:
-        agitation_prompts.append("Please provide more descriptive text to extract concepts for prompt generation.")
-        return agitation_prompts
-
-    main_term = key_terms_list[0] if key_terms_list else "your core idea"
-
-    secondary_term = key_terms_list[1] if len(key_terms_list) > 1 else None
-
-    # Agitation 1: Explore / Challenge Link
-    if secondary_term:
-        system_msg_link = (
-            f"You are a conceptual alchemist and an expert in lateral thinking. "
-            f"Your task is to forge a single, profound, and counter-intuitive question "
-            f"that either reveals an unexpected connection between two concepts or "
-            f"challenges a seemingly obvious link. The question should provoke deep, non-linear thought."
-        )
-        user_msg_link = (
-            f"Given concepts: '{main_term}' and '{secondary_term}'. "
-            f"Formulate a question exploring a hidden or paradoxical link between them.\n\n"
-            f"Example 1: Concepts 'Internet' and 'Privacy'. "
-            f"Question: 'How does the relentless pursuit of digital privacy inadvertently lead to its erosion, creating a surveillance paradox?'\n"
-            f"Example 2: Concepts 'Growth' and 'Stagnation'. "
-            f"Question: 'In what ways is apparent stagnation a necessary precursor to true, sustainable growth, rather than its antithesis?'"
-        )
-        llm_prompt_link = generate_llm_prompt(system_msg_link, user_msg_link)
-        if "Error" not in llm_prompt_link:
-            agitation_prompts.append(f"<b>Explore a New Link:</b> {llm_prompt_link}")
-        else:
-            agitation_prompts.append(
-                f"<b>Explore a New Link (Template):</b> Consider an unexpected connection between '{main_term}' and '{secondary_term}'. How might '{main_term}' lead to '{secondary_term}' if conventional logic was suspended?"
-            )
-    else:
-        agitation_prompts.append(
-            f"<b>Explore a New Link:</b> Not enough distinct concepts to explore new links. Consider adding more detail.")
-
-    # Agitation 2: Deconstruct
-    system_msg_deconstruct = (
-        f"You are a conceptual alchemist specializing in radical deconstruction. "
-        f"Your task is to formulate a single, incisive question that forces the user to dissect "
-        f"the fundamental components, assumptions, or boundaries of a given concept. "
-        f"The question should challenge the very definition or existence of the concept itself."
-    )
-    user_msg_deconstruct = (
-        f"Deconstruct the concept: '{main_term}'. What are its essential, indivisible parts? "
-        f"What happens if a core component is removed or fundamentally altered?\n\n"
-        f"Example 1: Concept 'Justice'. "
-        f"Question: 'If the outcome of a just system is always subjective, is justice a fixed principle or merely a continuous, unattainable pursuit?'\n"
-        f"Example 2: Concept 'Decision'. "
-        f"Question: 'If every decision is ultimately influenced by a cascade of prior unconscious biases, can true free will in decision-making ever truly exist?'"
-    )
-    llm_prompt_deconstruct = generate_llm_prompt(system_msg_deconstruct, user_msg_deconstruct)
-    if "Error" not in llm_prompt_deconstruct:
-        agitation_prompts.append(f"<b>Deconstruct This:</b> {llm_prompt_deconstruct}")
-    else:
-        agitation_prompts.append(
-            f"<b>Deconstruct This (Template):</b> Let's deconstruct '{main_term}'. What are its absolute core components? If you removed one essential part, would it still be '{main_term}'? What would it become?"
-        )
-
-    # Agitation 3: Cross-pollinate
-    unrelated_domains = [
-        "the intricate dance of subatomic particles",
-        "the evolutionary strategies of deep-sea organisms",
-        "the composition of classical symphonies",
-        "the logic gates within a quantum computer",
-        "ancient martial arts philosophy",
-        "the principles of surrealist art",
-        "the complex rules of a board game",
-        "the formation of celestial bodies",
-        "the internal mechanisms of a clock",
-        "the growth patterns of fungi"
-    ]
-    import random
-    random_domain = random.choice(unrelated_domains)
-    system_msg_crosspollinate = (
-        f"You are a conceptual alchemist specializing in radical ideation through cross-domain pollination. "
-        f"Your task is to generate a single, highly creative and thought-provoking question that "
-        f"bridges the concept '{main_term}' with a seemingly unrelated domain: '{random_domain}'. "
-        f"The question should reveal unexpected insights or solutions."
-    )
-    user_msg_crosspollinate = (
-        f"Connect '{main_term}' with '{random_domain}'. What new perspective emerges when applying principles from '{random_domain}' to '{main_term}'?\n\n"
-        f"Example 1: Concept 'Innovation', Domain 'Fungal Networks'. "
-        f"Question: 'If innovation were to mimic the distributed, resilient, and adaptive growth of a fungal network, how would organizations restructure to optimize for pervasive knowledge sharing and emergent solutions?'\n"
-        f"Example 2: Concept 'Decision-making', Domain 'Classical Music Composition'. "
-        f"Question: 'How might the principles of counterpoint and harmony in classical music composition offer a framework for balancing conflicting priorities in complex decision-making processes?'"
-    )
-    llm_prompt_crosspollinate = generate_llm_prompt(system_msg_crosspollinate, user_msg_crosspollinate)
-    if "Error" not in llm_prompt_crosspollinate:
-        agitation_prompts.append(f"<b>Cross-Pollinate Ideas:</b> {llm_prompt_crosspollinate}")
-    else:
-        agitation_prompts.append(
-            f"<b>Cross-Pollinate Ideas (Template):</b> Imagine '{main_term}' in the context of '{random_domain}'. How would a key concept from '{random_domain}' help you see '{main_term}' differently?"
-        )
-
-    # Agitation 4: Challenge Assumptions
-    system_msg_assumptions = (
-        f"You are a conceptual alchemist dedicated to uncovering hidden biases and unquestioned truths. "
-        f"Your task is to formulate a single, direct, and unsettling question that forces the user to "
-        f"identify and confront the fundamental, often implicit, assumptions underlying their input "
-        f"or the core concept. The question should propose a radical counter-factual or alternative reality."
-    )
-    user_msg_assumptions = (
-        f"What are the unstated assumptions behind '{main_term}' or the problem '{original_input_text}'? "
-        f"What if the most foundational assumption were completely false?\n\n"
-        f"Example 1: Concept 'Education'. "
-        f"Question: 'If the primary purpose of education was not knowledge transfer but the cultivation of radical uncertainty, how would learning environments transform?'\n"
-        f"Example 2: Concept 'Success'. "
-        f"Question: 'What if the very metric by which we define 'success' was inherently designed to perpetuate systemic inequities, making true universal success impossible?'"
-    )
-    llm_prompt_assumptions = generate_llm_prompt(system_msg_assumptions, user_msg_assumptions)
-    if "Error" not in llm_prompt_assumptions:
-        agitation_prompts.append(f"<b>Challenge Assumptions:</b> {llm_prompt_assumptions}")
-    else:
-        agitation_prompts.append(
-            f"<b>Challenge Assumptions (Template):</b> What core assumptions are you making about '{main_term}' or the overall problem? Try to list them out and then consider what would happen if the opposite of one of those assumptions were true."
-        )
-
-    # Agitation 5: Perspective Shifting
-    perspectives = [
-        "a time-traveling anthropologist from 3077",
-        "a sentient quantum AI managing a planetary ecosystem",
-        "a deep-sea vent microbiologist observing a new life form",
-        "a minimalist architect designing a space colony",
-        "a performance artist interpreting the concept through dance",
-        "a disillusioned philosopher from the digital dark ages",
-        "a wise elder from a pre-industrial indigenous tribe",
-        "a rogue neuroscientist experimenting with dream states"
-    ]
-    random_perspective = random.choice(perspectives)
-    system_msg_perspective = (
-        f"You are a conceptual alchemist facilitating radical empathy and reframing. "
-        f"Your task is to generate a single, imaginative question that forces the user to "
-        f"view their concept or problem '{original_input_text}' through the highly unique "
-        f"lens of a specific, unconventional perspective: '{random_perspective}'. "
-        f"The question should reveal unexpected values, priorities, or solutions."
-    )
-    user_msg_perspective = (
-        f"How would '{original_input_text}' be understood, solved, or transformed by {random_perspective}?\n\n"
-        f"Example 1: Problem 'Urban Traffic Congestion', Perspective 'a migratory bird observing from above'. "
-        f"Question: 'If urban traffic congestion was viewed through the eyes of a migratory bird, what fundamental, unseen patterns of flow and bottleneck would become apparent, suggesting solutions entirely external to human infrastructure?'\n"
-        f"Example 2: Concept 'Data Security', Perspective 'a medieval cryptographer protecting ancient scrolls'. "
-        f"Question: 'How might the principles of counterpoint and harmony in classical music composition offer a framework for balancing conflicting priorities in complex decision-making processes?'"
-    )
-    llm_prompt_perspective = generate_llm_prompt(system_msg_perspective, user_msg_perspective)
-    if "Error" not in llm_prompt_perspective:
-        agitation_prompts.append(f"<b>Shift Your Perspective:</b> {llm_prompt_perspective}")
-    else:
-        agitation_prompts.append(
-            f"<b>Shift Your Perspective (Template):</b> How would '{original_input_text}' (your input) be perceived, approached, or solved by {random_perspective}?"
-        )
-
-    return agitation_prompts
+def generate_agitation_prompts(concept_graph, key_terms_list, original_input_text, mode=None, deadline=None,
+                               degraded=None, user_id=None, priority='interactive'):
+    # The five prompt types and the sequential/concurrent/structured modes live in agitation.py
+    llm = partial(generate_llm_prompt, user_id=user_id, priority=priority)
+    # Frequent terms have questions waiting in prompt_pool; only the rest go to Ollama
+    return agitation.generate_agitation_prompts(key_terms_list, original_input_text, llm, mode, deadline, degraded,
+                                                pregenerated=partial(prompt_pool.lookup, DATABASE))
 
 
 # --- SQLite Interactions ---
-def save_session(user_id, input_text, key_terms, prompts, graph_data_json):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+def save_session(user_id, input_text, key_terms, prompts, graph_data_json, job_id=None):
+    """
+    Inserts the session and returns its id. For a queued job the session id is recorded
+    on the job in the same transaction, and a retried attempt (after a failure or a
+    reclaimed lease) overwrites that session instead of adding another one.
+    """
+    conn = sqlite3.connect(DATABASE, timeout=30, isolation_level=None)
     key_terms_json = json.dumps(key_terms)
     prompts_json = json.dumps(prompts)
 
-    cursor.execute(
-        'INSERT INTO sessions (user_id, input_text, key_terms, prompts, graph_data) VALUES (?, ?, ?, ?, ?)',
-        (user_id, input_text, key_terms_json, prompts_json, graph_data_json)
-    )
-    session_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    try:
+        with observe_db("insert_session"):
+            conn.execute('BEGIN IMMEDIATE')
+            session_id = None
+            if job_id is not None:
+                row = conn.execute('SELECT s.id FROM jobs j JOIN sessions s ON s.id = j.session_id WHERE j.id = ?',
+                                   (job_id,)).fetchone()
+                session_id = row[0] if row else None
+            if session_id is not None:
+                conn.execute('UPDATE sessions SET input_text = ?, key_terms = ?, prompts = ?, graph_data = ?, '
+                             'timestamp = CURRENT_TIMESTAMP WHERE id = ?',
+                             (input_text, key_terms_json, prompts_json, graph_data_json, session_id))
+            else:
+                session_id = conn.execute(
+                    'INSERT INTO sessions (user_id, input_text, key_terms, prompts, graph_data) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, input_text, key_terms_json, prompts_json, graph_data_json)
+                ).lastrowid
+                if job_id is not None:
+                    conn.execute('UPDATE jobs SET session_id = ? WHERE id = ?', (session_id, job_id))
+            conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
     return session_id
 
 
+def store_completed_graph(session_id):
+    """
+    An on_completed callback for load_concept_graph: stores the layout and clusters
+    computed for a session saved without them, so they are computed only once.
+    """
+    def store(graph_data_json):
+        conn = sqlite3.connect(DATABASE, timeout=30)
+        try:
+            with observe_db("update_session_graph"), conn:
+                conn.execute('UPDATE sessions SET graph_data = ? WHERE id = ?', (graph_data_json, session_id))
+        finally:
+            conn.close()
+    return store
+
+
 def delete_session_from_db(session_id, user_id):
     conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM sessions WHERE id = ? AND user_id = ?', (session_id, user_id))
-    rows_affected = cursor.rowcount
-    conn.commit()
+    with observe_db("delete_session"):
+        cursor.execute('DELETE FROM sessions WHERE id = ? AND user_id = ?', (session_id, user_id))
+        rows_affected = cursor.rowcount
+        conn.commit()
     conn.close()
+    if rows_affected:
+        session_embeddings.delete_embeddings(DATABASE, session_id)
+        # So later inputs aren't matched against it
+        RESULT_INDEX.remove_session(session_id)
     return rows_affected > 0
 
 
@@ -396,9 +337,10 @@ def get_all_sessions(user_id):
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute('SELECT id, input_text, timestamp FROM sessions WHERE user_id = ? ORDER BY timestamp DESC',
-                   (user_id,))
-    sessions = cursor.fetchall()
+    with observe_db("list_sessions"):
+        cursor.execute('SELECT id, input_text, timestamp FROM sessions WHERE user_id = ? ORDER BY timestamp DESC',
+                       (user_id,))
+        sessions = cursor.fetchall()
     conn.close()
     return [
         {'id': s['id'], 'input_text': s['input_text'],
@@ -411,27 +353,139 @@ def get_last_session_data(user_id):
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute(
-        'SELECT input_text, key_terms, prompts, graph_data FROM sessions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1',
-        (user_id,))
-    last_session = cursor.fetchone()
+    with observe_db("last_session"):
+        cursor.execute(
+            'SELECT id, input_text, key_terms, prompts, graph_data FROM sessions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1',
+            (user_id,))
+        last_session = cursor.fetchone()
     conn.close()
 
     if last_session:
+        graph_data = load_graph_data(last_session['graph_data'], store_completed_graph(last_session['id']))
+        graph_data['session_id'] = last_session['id']
         return {
             'input_text': last_session['input_text'],
             'key_terms': json.loads(last_session['key_terms']),
             'prompts': json.loads(last_session['prompts']),
-            'graph_data': json.loads(last_session['graph_data']) if last_session['graph_data'] else {'nodes': [],
-                                                                                                     'edges': []}
+            'graph_data': graph_data
         }
     return None
 
 
+# --- Full analysis pipeline (shared by the web request and worker.py) ---
+def run_analysis(user_id, user_input, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, top_k=None, deadline=None,
+                 priority='interactive', templates_only=False, job_id=None):
+    """
+    `deadline` (a deadlines.Deadline) bounds the whole pipeline: stages that are only
+    nice to have are skipped once it has passed, and agitation prompts still waiting
+    on Ollama fall back to their templates. `priority` is the LLM scheduler priority
+    ('interactive' or 'background'). `templates_only` skips Ollama entirely; admission
+    control uses it to shed load. A near-duplicate of an earlier input reuses that
+    analysis instead (see result_cache.py). `job_id` is set by worker.py, so a
+    retried job writes the same session (see save_session).
+    """
+    degraded_stages = []
+    embedding, cached = None, None
+    if result_cache.RESULT_CACHE:
+        with stage_timer("result_cache"):
+            embedding = result_cache.embed_input(MODELS.encoder, user_input)
+            cached = RESULT_INDEX.find(user_id, embedding, len(user_input), similarity_threshold, top_k)
+
+    concept_graph = load_concept_graph(cached.graph_data) if cached and cached.decision == 'serve' else None
+    if concept_graph is not None:
+        extracted_terms = cached.key_terms
+    else:
+        with stage_timer("map_concepts"):
+            concept_graph, extracted_terms = map_concepts(user_input, similarity_threshold, top_k)
+        if deadline is not None and deadline.expired():
+            # Stored without positions/clusters; the first view computes and stores them (store_completed_graph)
+            degraded_stages += ["layout", "clustering"]
+        else:
+            with stage_timer("layout"):
+                # Positions are computed once here and stored, so the browser never runs physics
+                concept_graph = concept_graph.with_layout()
+            with stage_timer("clustering"):
+                # Large graphs are sent as a cluster summary that expands on demand
+                concept_graph = concept_graph.with_clusters()
+    with stage_timer("vis_convert"):
+        graph_data = convert_graph_to_vis_data(concept_graph)
+    degraded_prompts = []
+    # The stored prompts are about their main term; they still fit while it is one of ours
+    main_term = cached.key_terms[0] if cached and cached.key_terms else None
+    if main_term in extracted_terms:
+        prompts = cached.prompts
+        extracted_terms = [main_term] + [term for term in extracted_terms if term != main_term]
+    else:
+        cached = None
+        with stage_timer("agitation_prompts"):
+            prompts = generate_agitation_prompts(concept_graph, extracted_terms, user_input,
+                                                 mode=agitation.TEMPLATE_MODE if templates_only else None,
+                                                 deadline=deadline, degraded=degraded_prompts, user_id=user_id,
+                                                 priority=priority)
+
+    with stage_timer("json_encode"):
+        graph_data_json = concept_graph.to_json()
+    with stage_timer("db_insert"):
+        new_session_id = save_session(user_id, user_input, extracted_terms, prompts, graph_data_json, job_id)
+        # A served cache hit has the same terms as the session it came from
+        embeddings = concept_graph.embeddings
+        if embeddings is None and cached is not None and cached.decision == 'serve':
+            embeddings = session_embeddings.load_embeddings(DATABASE, cached.session_id)
+        if embeddings is not None and len(embeddings):
+            session_embeddings.save_embeddings(DATABASE, new_session_id, embeddings)
+    if embedding is not None and cached is None and not (degraded_prompts or degraded_stages or templates_only):
+        # Only complete, freshly generated results are offered to later inputs
+        RESULT_INDEX.add(new_session_id, user_id, embedding, len(user_input), similarity_threshold, top_k)
+    # The client needs it to request cluster expansions
+    graph_data['session_id'] = new_session_id
+
+    deadline_outcome = None
+    if deadline is not None:
+        deadline_outcome = 'cancelled' if deadline.cancelled else 'exceeded' if deadline.timed_out else 'met'
+        record_request_deadline(deadline_outcome)
+
+    current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M')
+    return {
+        "prompts": prompts,
+        "key_terms": extracted_terms,
+        "new_session_id": new_session_id,
+        "input_text": user_input,
+        "timestamp": current_timestamp,
+        "graph_data": graph_data,
+        # Agitation types answered from templates (Ollama failed, ran out of time or load was shed)
+        "degraded_prompts": degraded_prompts,
+        "degraded_stages": degraded_stages,
+        "deadline": deadline_outcome,
+        "load_shed": templates_only,
+        # Set when the result was reused from a near-identical earlier input
+        "cached": cached and {'decision': cached.decision, 'similarity': round(cached.similarity, 4),
+                              'session_id': cached.session_id},
+    }
+
+
 # --- Step 4: Setup Flask Web Application ---
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'a_default_dev_key_if_not_set')
 login_manager.init_app(app)
+install_request_metrics(app)
+install_profiler(app, DATABASE, lambda: current_user.get_id() if current_user.is_authenticated else None)
+
+
+@app.errorhandler(InferenceBusy)
+def inference_busy(e):
+    # Every inference thread of this worker is taken and the queue stayed full
+    response = jsonify({"message": "The server is busy right now. Please try again shortly.",
+                        "retry_after": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+# Most edges the threshold slider draws; a very low threshold on a large graph keeps the strongest
+MAX_SLIDER_EDGES = int(os.environ.get('ALCHEMIST_MAX_SLIDER_EDGES', '5000'))
+SLIDER_EDGES = session_embeddings.ThresholdEdges()
+
+# When enabled, POST / only enqueues the analysis and worker.py does the heavy lifting,
+# so slow Ollama responses no longer tie up gunicorn workers.
+ASYNC_JOBS = os.environ.get('ALCHEMIST_ASYNC_JOBS', '0') == '1'
 
 # HTML template
 LOGIN_REGISTER_HTML = """
@@ -476,6 +530,10 @@ LOGIN_REGISTER_HTML = """
          .user-info p { margin: 0; font-weight: bold; color: #5c678a; }
          .user-info a { color: #7a82ab; text-decoration: none; font-weight: normal; margin-left: 1em; }
          .user-info a:hover { text-decoration: underline; }
+         #preview-area { display: none; margin-bottom: 1em; color: #5c678a; }
+         #preview-graph { width: 100%; height: 250px; border: 1px dashed #cdd4df; border-radius: 8px; background-color: #fdfefe; margin-top: 0.5em; }
+         .threshold-control { margin-top: 1em; color: #5c678a; }
+         .threshold-control input { width: 100%; }
          #conceptual-graph {
              width: 100%;
              height: 400px;
@@ -497,6 +555,10 @@ LOGIN_REGISTER_HTML = """
              <p>Enter your idea, problem, or concept below, and let The Idea Forge help you discover new perspectives and unlock breakthrough insights.</p>
              <form id="alchemist-form">
                  <textarea name="user_input" id="user_input" rows="6" placeholder="E.g., 'How to foster sustainable energy solutions in urban environments?' or 'The challenge of balancing privacy and security in digital communication.'">{{ user_input }}</textarea>
+                 <div id="preview-area">
+                     <small id="preview-terms"></small>
+                     <div id="preview-graph"></div>
+                 </div>
                  <button type="submit">Forge My Ideas!</button>
              </form>
 
@@ -505,6 +567,10 @@ LOGIN_REGISTER_HTML = """
              <div id="results-area" class="results" style="{% if not show_results %}display: none;{% endif %}">
                  <h2>Your Thought Network:</h2>
                  <div id="conceptual-graph"></div>
+                 <div class="threshold-control">
+                     <label for="threshold-slider">Similarity threshold: <span id="threshold-value">{{ '%.2f'|format(default_threshold) }}</span></label>
+                     <input type="range" id="threshold-slider" min="0.05" max="0.95" step="0.01" value="{{ default_threshold }}">
+                 </div>
                  <h3>Core Concepts:</h3>
                  <p id="key-terms-display">{{ key_terms|join(', ') }}</p>
                  <h2>Provocative Prompts:</h2>
@@ -551,7 +617,9 @@ LOGIN_REGISTER_HTML = """
              var options = {
                  nodes: { borderWidth: 2, size: 20, font: { face: 'Segoe UI' } },
                  edges: { smooth: { type: 'continuous' } },
-                 physics: { stabilization: false, barnesHut: { gravitationalConstant: -2000, centralGravity: 0.3, springLength: 95, springConstant: 0.04, damping: 0.09, avoidOverlap: 0 } },
+                 // Server-computed positions: draw as-is instead of simulating
+                 physics: graphData.positioned ? false : { stabilization: false, barnesHut: { gravitationalConstant: -2000, centralGravity: 0.3, springLength: 95, springConstant: 0.04, damping: 0.09, avoidOverlap: 0 } },
+                 layout: { improvedLayout: !graphData.positioned },
                  interaction: { hover: true, navigationButtons: true, zoomView: true },
                  manipulation: { enabled: false }
              };
@@ -564,9 +632,88 @@ LOGIN_REGISTER_HTML = """
                  var network = new vis.Network(container, data, options);
                  network.fit(); // This makes the graph fit the view and center
                  window.currentNetwork = network; // Store for potential destruction
+                 // The threshold slider swaps the edges of this graph
+                 window.currentGraph = { nodes: nodes, edges: edges, sessionId: graphData.session_id };
+                 resetThresholdSlider();
+                 if (graphData.lod) {
+                     enableClusterExpansion(network, nodes, edges, graphData.session_id);
+                 }
              }
          }
 
+         // Level-of-detail graphs arrive as cluster nodes; clicking one swaps it for its members
+         function enableClusterExpansion(network, nodes, edges, sessionId) {
+             network.on('click', async function(params) {
+                 if (params.nodes.length !== 1) return;
+                 var node = nodes.get(params.nodes[0]);
+                 if (!node || !node.cluster) return;
+                 var visible = nodes.getIds().filter(function(id) { return id !== node.id; });
+                 var url = `/session/${sessionId}/clusters/${node.cluster}?visible=` + encodeURIComponent(visible.join(','));
+                 try {
+                     var response = await fetch(url);
+                     if (!response.ok) throw new Error('HTTP ' + response.status);
+                     var expansion = await response.json();
+                     edges.remove(network.getConnectedEdges(node.id));
+                     nodes.remove(node.id);
+                     nodes.add(expansion.nodes);
+                     edges.add(expansion.edges);
+                 } catch (error) {
+                     console.error('Error expanding cluster:', error);
+                 }
+             });
+         }
+
+         // --- Similarity threshold slider: edges recomputed on the server from stored embeddings ---
+         const DEFAULT_THRESHOLD = {{ default_threshold }};
+         let thresholdInFlight = false;
+         let thresholdPending = false;
+
+         function resetThresholdSlider() {
+             document.getElementById('threshold-slider').value = DEFAULT_THRESHOLD;
+             document.getElementById('threshold-value').textContent = DEFAULT_THRESHOLD.toFixed(2);
+         }
+
+         async function updateThreshold() {
+             const graph = window.currentGraph;
+             if (!graph || graph.sessionId === undefined) return;
+             // One request at a time; the latest slider position is sent when it returns
+             if (thresholdInFlight) {
+                 thresholdPending = true;
+                 return;
+             }
+             thresholdInFlight = true;
+             try {
+                 const response = await fetch(`/session/${graph.sessionId}/edges`, {
+                     method: 'POST',
+                     headers: {
+                         'Content-Type': 'application/json'
+                     },
+                     body: JSON.stringify({
+                         similarity_threshold: parseFloat(document.getElementById('threshold-slider').value),
+                         visible: graph.nodes.getIds()
+                     })
+                 });
+                 if (response.ok && graph === window.currentGraph) {
+                     const result = await response.json();
+                     graph.edges.clear();
+                     graph.edges.add(result.edges);
+                 }
+             } catch (error) {
+                 console.error('Error updating threshold:', error);
+             } finally {
+                 thresholdInFlight = false;
+                 if (thresholdPending) {
+                     thresholdPending = false;
+                     updateThreshold();
+                 }
+             }
+         }
+
+         document.getElementById('threshold-slider').addEventListener('input', function(event) {
+             document.getElementById('threshold-value').textContent = parseFloat(event.target.value).toFixed(2);
+             updateThreshold();
+         });
+
          // --- Main page load graph initialization ---
          document.addEventListener('DOMContentLoaded', function() {
              // Check if INITIAL_GRAPH_DATA has nodes (meaning data exists)
@@ -589,21 +736,30 @@ LOGIN_REGISTER_HTML = """
 
              promptsList.innerHTML = '';
              keyTermsDisplay.innerHTML = '';
+             document.getElementById('preview-area').style.display = 'none';
              conceptualGraphDiv.innerHTML = ''; // Clear graph container before new rendering
              resultsArea.style.display = 'none';
              loadingSpinner.style.display = 'block';
 
+             const requestId = newRequestId();
+             pendingRequestId = requestId;
              try {
                  const response = await fetch('/', {
                      method: 'POST',
                      headers: {
                          'Content-Type': 'application/json'
                      },
-                     body: JSON.stringify({ user_input: userInput })
+                     body: JSON.stringify({ user_input: userInput, request_id: requestId })
                  });
 
-                 const data = await response.json();
+                 let data = await response.json();
+
+                 // Async mode: the analysis was queued, poll until a worker finishes it
+                 if (response.status === 202 && data.status_url) {
+                     data = await pollJob(data.status_url);
+                 }
 
+                 pendingRequestId = null;
                  loadingSpinner.style.display = 'none';
 
                  if (data.prompts && data.key_terms && data.graph_data) {
@@ -612,6 +768,18 @@ LOGIN_REGISTER_HTML = """
                          li.innerHTML = prompt;
                          promptsList.appendChild(li);
                      });
+                     if (data.degraded_prompts && data.degraded_prompts.length > 0) {
+                         const note = document.createElement('li');
+                         note.innerHTML = `<p><small>${data.degraded_prompts.length} prompt(s) used a template because ` +
+                             `${data.load_shed ? 'the server was busy' : data.deadline === 'exceeded' ? 'the model ran out of time' : 'the model was unavailable'}.</small></p>`;
+                         promptsList.appendChild(note);
+                     }
+                     if (data.cached) {
+                         const note = document.createElement('li');
+                         note.innerHTML = `<p><small>Reused the prompts from a near-identical earlier input ` +
+                             `(<a href="/session/${data.cached.session_id}">session ${data.cached.session_id}</a>).</small></p>`;
+                         promptsList.appendChild(note);
+                     }
                      keyTermsDisplay.textContent = data.key_terms.join(', ');
 
                      renderGraph(data.graph_data); // Use the new function
@@ -637,6 +805,7 @@ LOGIN_REGISTER_HTML = """
                  }
 
              } catch (error) {
+                 pendingRequestId = null;
                  console.error('Error:', error);
                  loadingSpinner.style.display = 'none';
                  resultsArea.style.display = 'block';
@@ -644,6 +813,36 @@ LOGIN_REGISTER_HTML = """
              }
          });
 
+         // Id of the analysis in flight; if the page is closed before it finishes, tell the server to stop
+         let pendingRequestId = null;
+
+         function newRequestId() {
+             if (window.crypto && crypto.randomUUID) {
+                 return crypto.randomUUID();
+             }
+             return Date.now().toString(36) + Math.random().toString(36).slice(2);
+         }
+
+         window.addEventListener('pagehide', function() {
+             if (pendingRequestId) {
+                 navigator.sendBeacon(`/requests/${pendingRequestId}/cancel`);
+             }
+         });
+
+         async function pollJob(statusUrl) {
+             while (true) {
+                 await new Promise(resolve => setTimeout(resolve, 1000));
+                 const response = await fetch(statusUrl);
+                 const job = await response.json();
+                 if (job.status === 'done') {
+                     return job.result;
+                 }
+                 if (job.status === 'failed' || !response.ok) {
+                     return { message: job.error || job.message || 'The analysis job failed.' };
+                 }
+             }
+         }
+
          async function handleDeleteClick(event) {
              const sessionId = event.target.dataset.sessionId;
              if (confirm(`Are you sure you want to delete session ID ${sessionId}?`)) {
@@ -675,6 +874,77 @@ LOGIN_REGISTER_HTML = """
              button.addEventListener('click', handleDeleteClick);
          });
 
+         // --- Live preview while typing: key terms and graph deltas, no LLM calls ---
+         const previewDocId = newRequestId();
+         let previewVersion = null;
+         let previewTimer = null;
+         let previewInFlight = false;
+         let previewPending = false;
+         let previewNodes = null;
+         let previewEdges = null;
+
+         function schedulePreview() {
+             clearTimeout(previewTimer);
+             previewTimer = setTimeout(sendPreview, 400);
+         }
+
+         async function sendPreview() {
+             // One preview at a time; edits made meanwhile are sent once it returns
+             if (previewInFlight) {
+                 previewPending = true;
+                 return;
+             }
+             previewInFlight = true;
+             try {
+                 const response = await fetch('/preview', {
+                     method: 'POST',
+                     headers: {
+                         'Content-Type': 'application/json'
+                     },
+                     body: JSON.stringify({
+                         doc_id: previewDocId,
+                         user_input: document.getElementById('user_input').value,
+                         base_version: previewVersion
+                     })
+                 });
+                 if (response.ok) {
+                     applyPreview(await response.json());
+                 }
+             } catch (error) {
+                 console.error('Error fetching preview:', error);
+             } finally {
+                 previewInFlight = false;
+                 if (previewPending) {
+                     previewPending = false;
+                     schedulePreview();
+                 }
+             }
+         }
+
+         function applyPreview(delta) {
+             if (!previewNodes || delta.reset) {
+                 previewNodes = new vis.DataSet();
+                 previewEdges = new vis.DataSet();
+                 if (window.previewNetwork) {
+                     window.previewNetwork.destroy();
+                 }
+                 window.previewNetwork = new vis.Network(document.getElementById('preview-graph'),
+                     { nodes: previewNodes, edges: previewEdges },
+                     { nodes: { borderWidth: 2, size: 12, font: { face: 'Segoe UI' } },
+                       physics: { stabilization: false }, interaction: { hover: true } });
+             }
+             previewEdges.remove(delta.edges.remove);
+             previewNodes.remove(delta.nodes.remove);
+             previewNodes.add(delta.nodes.add);
+             previewEdges.add(delta.edges.add);
+             previewVersion = delta.version;
+             document.getElementById('preview-terms').textContent =
+                 `Live preview (${delta.total_nodes} concepts): ${delta.key_terms.join(', ')}`;
+             document.getElementById('preview-area').style.display = delta.total_nodes > 0 ? 'block' : 'none';
+         }
+
+         document.getElementById('user_input').addEventListener('input', schedulePreview);
+
          // Function to render graph for session detail page
          function renderGraphDetail(graphData, containerId) {
              var nodes = new vis.DataSet(graphData.nodes);
@@ -683,7 +953,9 @@ LOGIN_REGISTER_HTML = """
              var options = {
                  nodes: { borderWidth: 2, size: 20, font: { face: 'Segoe UI' } },
                  edges: { smooth: { type: 'continuous' } },
-                 physics: { stabilization: false, barnesHut: { gravitationalConstant: -2000, centralGravity: 0.3, springLength: 95, springConstant: 0.04, damping: 0.09, avoidOverlap: 0 } },
+                 // Server-computed positions: draw as-is instead of simulating
+                 physics: graphData.positioned ? false : { stabilization: false, barnesHut: { gravitationalConstant: -2000, centralGravity: 0.3, springLength: 95, springConstant: 0.04, damping: 0.09, avoidOverlap: 0 } },
+                 layout: { improvedLayout: !graphData.positioned },
                  interaction: { hover: true, navigationButtons: true, zoomView: true },
                  manipulation: { enabled: false }
              };
@@ -696,6 +968,9 @@ LOGIN_REGISTER_HTML = """
                  var network = new vis.Network(container, data, options);
                  network.fit(); // Fit graph to screen on detail page too
                  window.currentNetworkDetail = network; // Store for destruction
+                 if (graphData.lod) {
+                     enableClusterExpansion(network, nodes, edges, graphData.session_id);
+                 }
              }
          }
      </script>
@@ -703,6 +978,26 @@ LOGIN_REGISTER_HTML = """
  </html>
  """
 
+def parse_graph_options(data):
+    """
+    Reads the optional per-request graph settings from a JSON body.
+    Returns (options, error_message).
+    """
+    options = {}
+    try:
+        if data.get("similarity_threshold") is not None:
+            options["similarity_threshold"] = float(data["similarity_threshold"])
+            if not 0.0 <= options["similarity_threshold"] < 1.0:
+                return None, "similarity_threshold must be between 0 and 1."
+        if data.get("top_k") is not None:
+            options["top_k"] = int(data["top_k"])
+            if not 1 <= options["top_k"] <= MAX_TOP_K:
+                return None, f"top_k must be between 1 and {MAX_TOP_K}."
+    except (TypeError, ValueError):
+        return None, "similarity_threshold must be a number and top_k an integer."
+    return options, None
+
+
 @app.route("/", methods=["GET", "POST"])
 @login_required
 def index():
@@ -713,23 +1008,43 @@ def index():
         if not user_input:
             return jsonify({"message": "Please provide input text."}), 400
 
-        concept_graph, extracted_terms = map_concepts(user_input)
-        graph_data = convert_graph_to_vis_data(concept_graph)
-        prompts = generate_agitation_prompts(concept_graph, extracted_terms, user_input)
-
-        new_session_id = save_session(current_user.id, user_input, extracted_terms, prompts, json.dumps(graph_data))
-
-        current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M')
-
+        graph_options, error = parse_graph_options(data)
+        if error:
+            return jsonify({"message": error}), 400
+        # Client-chosen id, so the page can cancel the work with a beacon if it is closed
+        request_id = data.get("request_id")
+
+        # Queued analyses are bounded by the workers, so only the rate limit applies to them
+        admitted = admission.admit(DATABASE, current_user.id, check_capacity=not ASYNC_JOBS)
+        record_admission(admitted.decision)
+        if admitted.decision in ('overloaded', 'rate_limited'):
+            if admitted.decision == 'overloaded':
+                message, status = "The server is busy right now. Please try again shortly.", 503
+            else:
+                message, status = "You're sending analyses faster than we can run them. Please wait a moment.", 429
+            response = jsonify({"message": message, "retry_after": admitted.retry_after})
+            response.headers['Retry-After'] = str(admitted.retry_after)
+            return response, status
+
+        if ASYNC_JOBS:
+            job_id = enqueue_job(DATABASE, current_user.id,
+                                 {"user_input": user_input, "request_id": request_id, **graph_options})
+            return jsonify({
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": url_for('job_status', job_id=job_id),
+            }), 202
+
+        deadline = request_deadline(cancel_checker(DATABASE, current_user.id, request_id))
+        shed = admitted.decision == 'degrade'
+        started = time.perf_counter()
+        try:
+            result = run_analysis(current_user.id, user_input, deadline=deadline, templates_only=shed, **graph_options)
+        finally:
+            # Only full analyses say anything about how long the next one will take
+            admission.finish(DATABASE, admitted.ticket, None if shed else time.perf_counter() - started)
         # When we return JSON, the frontend script handles rendering
-        return jsonify({
-            "prompts": prompts,
-            "key_terms": extracted_terms,
-            "new_session_id": new_session_id,
-            "input_text": user_input,
-            "timestamp": current_timestamp,
-            "graph_data": graph_data,
-        })
+        return jsonify(result)
 
     # This is the GET request handling - always fetches the latest session data
     user_input = ""
@@ -753,7 +1068,25 @@ def index():
     return render_template_string(LOGIN_REGISTER_HTML, user_input=user_input, prompts=prompts, key_terms=key_terms,
                                   sessions=sessions, current_user=current_user,
                                   graph_data=graph_data, # FIX: Was json.dumps(graph_data)
-                                  show_results=show_results)
+                                  show_results=show_results, default_threshold=DEFAULT_SIMILARITY_THRESHOLD)
+
+# Key terms and graph changes while the user edits, without LLM calls; see live_preview.py
+PREVIEW_ENGINE = PreviewEngine(MODELS.nlp, MODELS.encoder)
+
+
+@app.route("/preview", methods=["POST"])
+@login_required
+def preview():
+    data = request.get_json(silent=True) or {}
+    doc_id = str(data.get("doc_id") or "")[:64]
+    if not doc_id:
+        return jsonify({"message": "Please provide a doc_id."}), 400
+    base_version = data.get("base_version")
+    with stage_timer("preview"):
+        result = PREVIEW_ENGINE.update((current_user.id, doc_id), data.get("user_input") or "",
+                                       base_version if isinstance(base_version, int) else None)
+    return jsonify(result)
+
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -809,25 +1142,132 @@ def delete_session(session_id):
         return jsonify({"message": "Session not found or you don't have permission to delete it."}), 404
 
 
+@app.route("/requests/<request_id>/cancel", methods=["POST"])
+@login_required
+def cancel_analysis(request_id):
+    # Sent with navigator.sendBeacon when the page goes away mid-analysis
+    cancel_request(DATABASE, current_user.id, request_id)
+    return '', 204
+
+
+@app.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id):
+    job = get_job(DATABASE, job_id, current_user.id)
+    if job is None:
+        return jsonify({"message": "Job not found or you don't have permission to view it."}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/stats")
+@login_required
+def job_queue_stats():
+    return jsonify(queue_stats(DATABASE))
+
+
+@app.route("/metrics")
+def metrics():
+    # Optional shared secret so the endpoint can be exposed beyond localhost
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return "Unauthorized", 401
+    body, content_type = render_metrics([JobQueueCollector(DATABASE), LLMSchedulerCollector(DATABASE)])
+    return body, 200, {'Content-Type': content_type}
+
+
+PROFILES_HTML = """
+ <!DOCTYPE html>
+ <html lang="en">
+ <head>
+     <meta charset="UTF-8">
+     <title>Request Profiles</title>
+     <style>
+         body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 2em; background-color: #f0f4f8; color: #333; }
+         h1 { color: #5c678a; }
+         table { border-collapse: collapse; width: 100%; background-color: #fff; }
+         th, td { padding: 0.5em 0.8em; border-bottom: 1px solid #dcdfe6; text-align: left; font-size: 0.9em; }
+         th { background-color: #e0e6f6; color: #5c678a; }
+         a { color: #5c678a; }
+     </style>
+ </head>
+ <body>
+     <h1>Request Profiles</h1>
+     <p>Collapsed stacks open in <a href="https://www.speedscope.app/">speedscope</a> or flamegraph.pl; pstats files in snakeviz or <code>python -m pstats</code>.</p>
+     <table>
+         <tr><th>ID</th><th>When</th><th>Request</th><th>User</th><th>Duration</th><th>Reason</th><th>Format</th><th>Samples</th><th></th></tr>
+         {% for p in profiles %}
+         <tr>
+             <td>{{ p.id }}</td>
+             <td>{{ p.created }}</td>
+             <td>{{ p.method }} {{ p.path }}</td>
+             <td>{{ p.user_id or '-' }}</td>
+             <td>{{ '%.3f'|format(p.duration) }}s</td>
+             <td>{{ p.reason }}</td>
+             <td>{{ p.format }}</td>
+             <td>{{ p.samples }}</td>
+             <td><a href="{{ url_for('download_profile', profile_id=p.id) }}">download</a></td>
+         </tr>
+         {% else %}
+         <tr><td colspan="9">No profiles captured yet.</td></tr>
+         {% endfor %}
+     </table>
+ </body>
+ </html>
+ """
+
+
+@app.route("/admin/profiles")
+@admin_required
+def list_request_profiles():
+    profiles = list_profiles(DATABASE)
+    if request.args.get('format') == 'json':
+        return jsonify(profiles)
+    for p in profiles:
+        p['created'] = datetime.fromtimestamp(p['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+    return render_template_string(PROFILES_HTML, profiles=profiles)
+
+
+@app.route("/admin/profiles/<int:profile_id>")
+@admin_required
+def download_profile(profile_id):
+    profile = get_profile(DATABASE, profile_id)
+    if profile is None:
+        return "Profile not found.", 404
+    if profile['format'] == 'pstats':
+        return profile['data'], 200, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename=profile-{profile_id}.prof'}
+    return profile['data'], 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Disposition': f'inline; filename=profile-{profile_id}.collapsed.txt'}
+
+
 @app.route("/session/<int:session_id>")
 @login_required
 def view_session(session_id):
     conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
-    cursor.execute(
-        'SELECT input_text, key_terms, prompts, timestamp, graph_data FROM sessions WHERE id = ? AND user_id = ?',
-        (session_id, current_user.id))
-    session_data = cursor.fetchone()
+    with observe_db("get_session"):
+        cursor.execute(
+            'SELECT input_text, key_terms, prompts, timestamp, graph_data FROM sessions WHERE id = ? AND user_id = ?',
+            (session_id, current_user.id))
+        session_data = cursor.fetchone()
     conn.close()
 
     if session_data:
         input_text, key_terms_json, prompts_json, timestamp_str, graph_data_json = session_data
         key_terms = json.loads(key_terms_json)
         prompts = json.loads(prompts_json)
-        graph_data = json.loads(graph_data_json) if graph_data_json else {'nodes': [], 'edges': []}
+        graph_data = load_graph_data(graph_data_json, store_completed_graph(session_id))
 
         timestamp_obj = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
         formatted_timestamp = timestamp_obj.strftime('%Y-%m-%d %H:%M')
+        if graph_data.get('positioned'):
+            # Positions were computed on the server; no physics simulation in the browser
+            physics_options = 'false'
+        else:
+            physics_options = ('{stabilization: false, barnesHut: {gravitationalConstant: -2000, centralGravity: 0.3, '
+                               'springLength: 95, springConstant: 0.04, damping: 0.09, avoidOverlap: 0}}')
 
         detail_html = f"""
  <!DOCTYPE html>
@@ -881,6 +1321,13 @@ def view_session(session_id):
          p {{
              margin-bottom: 0.5em;
          }}
+         .threshold-control {{
+             margin-top: 1em;
+             color: #5c678a;
+         }}
+         .threshold-control input {{
+             width: 100%;
+         }}
          #conceptual-graph-detail {{
              width: 100%;
              height: 400px;
@@ -899,6 +1346,10 @@ def view_session(session_id):
          <p><strong>Date:</strong> {formatted_timestamp}</p>
          <h2>Your Thought Network:</h2>
          <div id="conceptual-graph-detail"></div>
+         <div class="threshold-control">
+             <label for="threshold-slider">Similarity threshold: <span id="threshold-value">{DEFAULT_SIMILARITY_THRESHOLD:.2f}</span></label>
+             <input type="range" id="threshold-slider" min="0.05" max="0.95" step="0.01" value="{DEFAULT_SIMILARITY_THRESHOLD}">
+         </div>
          <h2>Core Concepts:</h2>
          <p>{', '.join(key_terms) if key_terms else 'No core concepts'}</p>
          <h2>Provocative Prompts:</h2>
@@ -923,16 +1374,9 @@ def view_session(session_id):
                  edges: {{
                      smooth: {{type: 'continuous'}}
                  }},
-                 physics: {{
-                     stabilization: false,
-                     barnesHut: {{
-                         gravitationalConstant: -2000,
-                         centralGravity: 0.3,
-                         springLength: 95,
-                         springConstant: 0.04,
-                         damping: 0.09,
-                         avoidOverlap: 0
-                     }}
+                 physics: {physics_options},
+                 layout: {{
+                     improvedLayout: {'false' if graph_data.get('positioned') else 'true'}
                  }},
                  interaction: {{
                      hover: true,
@@ -946,6 +1390,66 @@ def view_session(session_id):
 
              var network = new vis.Network(container, graphData, options);
              network.fit(); // Fit graph to screen on detail page too
+
+             // Similarity threshold slider: edges recomputed on the server from stored embeddings
+             var thresholdInFlight = false;
+             var thresholdPending = false;
+             async function updateThreshold() {{
+                 if (thresholdInFlight) {{
+                     thresholdPending = true;
+                     return;
+                 }}
+                 thresholdInFlight = true;
+                 try {{
+                     var response = await fetch('{url_for('session_edges', session_id=session_id)}', {{
+                         method: 'POST',
+                         headers: {{'Content-Type': 'application/json'}},
+                         body: JSON.stringify({{
+                             similarity_threshold: parseFloat(document.getElementById('threshold-slider').value),
+                             visible: graphData.nodes.getIds()
+                         }})
+                     }});
+                     if (!response.ok) throw new Error('HTTP ' + response.status);
+                     var result = await response.json();
+                     graphData.edges.clear();
+                     graphData.edges.add(result.edges);
+                 }} catch (error) {{
+                     console.error('Error updating threshold:', error);
+                 }} finally {{
+                     thresholdInFlight = false;
+                     if (thresholdPending) {{
+                         thresholdPending = false;
+                         updateThreshold();
+                     }}
+                 }}
+             }}
+             document.getElementById('threshold-slider').addEventListener('input', function(event) {{
+                 document.getElementById('threshold-value').textContent = parseFloat(event.target.value).toFixed(2);
+                 updateThreshold();
+             }});
+
+             if ({'true' if graph_data.get('lod') else 'false'}) {{
+                 // Cluster summary: clicking a cluster node swaps it for its members
+                 network.on('click', async function(params) {{
+                     if (params.nodes.length !== 1) return;
+                     var node = graphData.nodes.get(params.nodes[0]);
+                     if (!node || !node.cluster) return;
+                     var visible = graphData.nodes.getIds().filter(function(id) {{ return id !== node.id; }});
+                     var url = '{url_for('view_session', session_id=session_id)}/clusters/' + node.cluster +
+                               '?visible=' + encodeURIComponent(visible.join(','));
+                     try {{
+                         var response = await fetch(url);
+                         if (!response.ok) throw new Error('HTTP ' + response.status);
+                         var expansion = await response.json();
+                         graphData.edges.remove(network.getConnectedEdges(node.id));
+                         graphData.nodes.remove(node.id);
+                         graphData.nodes.add(expansion.nodes);
+                         graphData.edges.add(expansion.edges);
+                     }} catch (error) {{
+                         console.error('Error expanding cluster:', error);
+                     }}
+                 }});
+             }}
          }});
      </script>
  </body>
@@ -955,6 +1459,81 @@ def view_session(session_id):
     return "Session not found or you don't have permission to view it.", 403
 
 
+@app.route("/session/<int:session_id>/clusters/<cluster_key>")
+@login_required
+def expand_cluster(session_id, cluster_key):
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    with observe_db("get_session_graph"):
+        cursor.execute('SELECT graph_data FROM sessions WHERE id = ? AND user_id = ?', (session_id, current_user.id))
+        row = cursor.fetchone()
+    conn.close()
+    if row is None:
+        return jsonify({"message": "Session not found or you don't have permission to view it."}), 404
+
+    concept_graph = load_concept_graph(row[0], store_completed_graph(session_id))
+    if concept_graph is None or not concept_graph.clusters:
+        return jsonify({"message": "This session's graph is not clustered."}), 404
+    # Node ids already on screen, so edges from the new members to them come along
+    visible = [node_id for node_id in request.args.get('visible', '').split(',') if node_id]
+    try:
+        return jsonify(concept_graph.vis_expansion(cluster_key, visible))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 404
+
+
+@app.route("/session/<int:session_id>/edges", methods=["POST"])
+@login_required
+def session_edges(session_id):
+    """
+    The session graph's edges for another similarity_threshold/top_k, between the
+    node ids the client has on screen (`visible`), from the stored term embeddings.
+    Layout and clusters stay as they were computed for the original edges.
+    """
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    with observe_db("get_session_graph"):
+        cursor.execute('SELECT graph_data FROM sessions WHERE id = ? AND user_id = ?', (session_id, current_user.id))
+        row = cursor.fetchone()
+    conn.close()
+    if row is None:
+        return jsonify({"message": "Session not found or you don't have permission to view it."}), 404
+
+    concept_graph = load_concept_graph(row[0], store_completed_graph(session_id))
+    if concept_graph is None:
+        return jsonify({"message": "This session was saved in an older format."}), 404
+    data = request.get_json(silent=True) or {}
+    graph_options, error = parse_graph_options(data)
+    if error:
+        return jsonify({"message": error}), 400
+    if concept_graph.num_nodes == 0:
+        # No terms, so no embeddings were stored and there are no edges at any threshold
+        return jsonify({"edges": [], "total_edges": 0, "truncated": False})
+
+    def load_embeddings():
+        with observe_db("get_session_embeddings"):
+            embeddings = session_embeddings.load_embeddings(DATABASE, session_id)
+        if embeddings is None or len(embeddings) != concept_graph.num_nodes:
+            # Saved before embeddings were stored: encode once and keep them
+            embeddings = MODELS.encoder.encode(concept_graph.terms, normalize_embeddings=True)
+            session_embeddings.save_embeddings(DATABASE, session_id, embeddings)
+        return embeddings
+
+    with stage_timer("similarity"):
+        rows, cols, weights, total_edges = SLIDER_EDGES.edges(
+            session_id, load_embeddings, graph_options.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD),
+            graph_options.get("top_k"), limit=MAX_SLIDER_EDGES)
+    visible = data.get("visible")
+    if not isinstance(visible, list):
+        # What the page shows before any cluster is expanded
+        visible = [node['id'] for node in concept_graph.to_vis_data()['nodes']]
+    return jsonify({
+        "edges": concept_graph.with_edges(rows, cols, weights).vis_edges(visible),
+        "total_edges": total_edges,
+        "truncated": total_edges > MAX_SLIDER_EDGES,
+    })
+
+
 # --- Step 5: Run the Flask App ---
 if __name__ == "__main__":
     init_db()
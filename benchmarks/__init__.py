@@ -0,0 +1,6 @@
+import os
+
+# The benchmarks stub the LLM or call Ollama themselves; importing alchemist_core
+# shouldn't start the background model warm-up or backend health checks.
+os.environ.setdefault('ALCHEMIST_OLLAMA_WARMUP', '0')
+os.environ.setdefault('ALCHEMIST_OLLAMA_HEALTH_INTERVAL', '0')
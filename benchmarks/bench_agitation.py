@@ -0,0 +1,136 @@
+# benchmarks/bench_agitation.py
+#
+# The three agitation modes (five sequential calls, five concurrent calls, one
+# structured JSON call) compared on end-to-end latency and on the compute Ollama
+# reports spending (model load + prompt processing + generation), plus how many
+# prompts fell back to templates.
+#
+# Steady-state numbers come from a warm model with the shared prompt prefix cached.
+# With --cold-start the model is unloaded before each mode and the first run is
+# reported on its own, which is what a user sees after the app has been idle.
+#
+#   python -m benchmarks.bench_agitation --url http://localhost:11434/api/generate
+#   python -m benchmarks.bench_agitation --fake     # built-in fake Ollama, no model needed
+
+import argparse
+import os
+import random
+import threading
+import time
+
+import agitation
+import ollama_client
+from benchmarks.harness import bench
+from benchmarks.synthetic import noun_phrases, synthetic_text
+from deadlines import Deadline
+
+DEFAULT_URL = os.environ.get('OLLAMA_API_URL', "http://localhost:11434/api/generate")
+DEFAULT_MODEL = os.environ.get('OLLAMA_MODEL', "phi3:mini")
+
+
+class RecordingLLM:
+    """generate_llm_prompt stand-in that calls Ollama directly and adds up its reported timings."""
+
+    def __init__(self, url, model):
+        self.url = url
+        self.model = model
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.compute_ns = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+
+    def __call__(self, system_message, user_message, max_tokens=150, temperature=0.7, agitation_type="other",
+                 response_format=None, deadline=None, model=None, stop=None, stats=None):
+        stats = {} if stats is None else stats
+        result = ollama_client.generate(self.url, model or self.model, system_message, user_message, max_tokens,
+                                        temperature, response_format=response_format, stats=stats,
+                                        deadline=deadline, stop=stop)
+        with self.lock:
+            self.calls += 1
+            self.generated_tokens += stats.get('eval_count', 0)
+            self.compute_ns += sum(stats.get(f, 0) for f in ('load_duration', 'prompt_eval_duration',
+                                                              'eval_duration'))
+            self.prompt_tokens += stats.get('prompt_eval_count', 0)
+        return result
+
+
+def run(url, model, modes, repeat, deadline_seconds=None, cold_start=False):
+    llm = RecordingLLM(url, model)
+    key_terms = noun_phrases(8)
+    text = synthetic_text(8)[:300]
+    results = []
+    for mode in modes:
+        random.seed(0)
+        fallbacks = []
+
+        def once():
+            deadline = Deadline(deadline_seconds) if deadline_seconds else None
+            prompts = agitation.generate_agitation_prompts(key_terms, text, llm, mode, deadline)
+            fallbacks.append(sum('(Template)' in p for p in prompts))
+
+        cold_ms = None
+        if cold_start:
+            ollama_client.unload_model(url, model)
+            started = time.perf_counter()
+            once()
+            cold_ms = (time.perf_counter() - started) * 1000
+            fallbacks.clear()
+
+        llm.reset()
+        result = bench(f"agitation[{mode}]", once, repeat=repeat, warmup=1, items=5, mode=mode)
+        runs = len(fallbacks)
+        result.update({
+            'cold_start_ms': cold_ms,
+            'ollama_calls_per_run': llm.calls / runs,
+            'ollama_compute_ms_per_run': llm.compute_ns / 1e6 / runs,
+            'prompt_tokens_per_run': llm.prompt_tokens / runs,
+            'generated_tokens_per_run': llm.generated_tokens / runs,
+            'template_fallbacks_per_run': sum(fallbacks) / runs,
+        })
+        print(f"{'':<45} calls={result['ollama_calls_per_run']:.1f} "
+              f"ollama_compute={result['ollama_compute_ms_per_run']:.0f}ms "
+              f"prompt_tokens={result['prompt_tokens_per_run']:.0f} "
+              f"generated_tokens={result['generated_tokens_per_run']:.0f} "
+              f"fallbacks={result['template_fallbacks_per_run']:.2f}/5"
+              + (f" cold_start={cold_ms:.0f}ms" if cold_ms is not None else ""))
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agitation prompt modes: sequential vs concurrent vs structured.")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--modes', nargs='+', default=list(agitation.AGITATION_MODES),
+                        choices=agitation.AGITATION_MODES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="Per-run deadline in seconds; prompts not ready in time fall back to templates.")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="Unload the model before each mode and report the first run separately.")
+    parser.add_argument('--fake', action='store_true',
+                        help="Start loadtest.fake_ollama and benchmark against it instead of --url.")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.fake:
+        from loadtest.fake_ollama import serve
+        # ~0.5ms per prompt token, 20ms per generated token and 1s to load, roughly a small model on CPU
+        server = serve(port=0, latency='fixed:0.05', token_delay=0.02, prompt_token_delay=0.0005, seed=0,
+                       load_time=1.0)
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+        print(f"Using fake Ollama at {url}")
+    try:
+        run(url, args.model, args.modes, args.repeat, args.deadline, args.cold_start)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
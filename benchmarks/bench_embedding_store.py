@@ -0,0 +1,91 @@
+# benchmarks/bench_embedding_store.py
+#
+# Recall, memory and query latency of the embedding store layouts (embedding_store.py)
+# against exact float32 search. The vectors are synthetic: normalised 384-d points
+# around a few hundred cluster centres, which is closer to sentence embeddings than
+# uniform noise (there, every neighbour is about as far as any other and recall means
+# little). Recall@k is the fraction of each query's exact top-k that the store returns.
+#
+#   python -m benchmarks.bench_embedding_store --vectors 200000 --queries 200
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.harness import bench
+from embedding_store import EmbeddingStore
+
+LAYOUTS = [
+    ('float32', None),
+    ('float16', None),
+    ('int8', None),
+    ('float16', 128),
+    ('int8', 128),
+]
+
+
+def synthetic_embeddings(n, dim=384, clusters=500, spread=0.6, decay=0.75, seed=0):
+    rng = np.random.default_rng(seed)
+    # Per-direction scale ~ 1 / rank^decay, in a random orientation
+    scale = (np.arange(dim) + 1.0) ** -decay
+    scale *= np.sqrt(dim / np.sum(scale ** 2))
+    rotation, _ = np.linalg.qr(rng.standard_normal((dim, dim)))
+    centres = (rng.standard_normal((clusters, dim)) * scale) @ rotation.T
+    noise = (rng.standard_normal((n, dim)) * scale) @ rotation.T
+    vectors = (centres[rng.integers(0, clusters, n)] + spread * noise).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run(vectors=200000, queries=200, k=10, dim=384, repeat=5, add_batch=10000):
+    data = synthetic_embeddings(vectors + queries, dim)
+    data, query_batch = data[:vectors], data[vectors:]
+    exact = np.argsort(-(query_batch @ data.T), axis=1)[:, :k]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for quantization, reduce_dim in LAYOUTS:
+            label = quantization if reduce_dim is None else f"pca{reduce_dim}+{quantization}"
+            store = EmbeddingStore(os.path.join(tmp, label), input_dim=dim, quantization=quantization,
+                                   reduce_dim=reduce_dim)
+            store.fit_reduction(data[:5000])
+            for start in range(0, vectors, add_batch):
+                store.add(data[start:start + add_batch])
+
+            _, found = store.search(query_batch, k)
+            recall = np.mean([len(set(found[i]) & set(exact[i])) / k for i in range(queries)])
+            result = bench(f"store_search[{label},q={queries}]", lambda: store.search(query_batch, k),
+                           repeat=repeat, warmup=1, items=queries, vectors=vectors, k=k)
+            result.update(recall_at_k=float(recall), bytes_per_vector=store.bytes_per_vector,
+                          mb_per_million=store.bytes_per_vector * 1e6 / 2 ** 20)
+            print(f"{'':<45} recall@{k}={recall:.3f}  {store.bytes_per_vector} bytes/vector  "
+                  f"{result['mb_per_million']:.0f} MB per million")
+            results.append(result)
+
+        # The per-request case: one query at a time, against a plain float32 matrix in memory
+        def numpy_search():
+            scores = data @ query_batch[0]
+            top = np.argpartition(-scores, k - 1)[:k]
+            return top[np.argsort(-scores[top])]
+
+        results.append(bench("numpy_fp32_search[q=1]", numpy_search, repeat=repeat * 4, vectors=vectors, k=k))
+        for label in ('int8', 'pca128+int8'):
+            single = EmbeddingStore(os.path.join(tmp, label))
+            results.append(bench(f"store_search[{label},q=1]", lambda: single.search(query_batch[:1], k),
+                                 repeat=repeat * 4, vectors=vectors, k=k))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, memory and latency of the embedding store layouts.")
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.vectors, args.queries, args.k, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
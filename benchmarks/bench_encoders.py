@@ -0,0 +1,138 @@
+# benchmarks/bench_encoders.py
+#
+# Compares the encoder backends in encoders.py: similarity-graph agreement with the
+# PyTorch backend, encode latency, and resident memory. Each backend runs in its own
+# subprocess so memory numbers and the "was torch imported" check are not polluted.
+#
+#   python export_onnx_encoder.py
+#   python -m benchmarks.bench_encoders --sizes 10 200 2000
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.harness import percentile
+from benchmarks.synthetic import noun_phrases
+
+BACKENDS = {
+    'torch': {'ALCHEMIST_ENCODER_BACKEND': 'torch'},
+    'onnx-fp32': {'ALCHEMIST_ENCODER_BACKEND': 'onnx', 'ALCHEMIST_ONNX_QUANTIZED': '0'},
+    'onnx-int8': {'ALCHEMIST_ENCODER_BACKEND': 'onnx', 'ALCHEMIST_ONNX_QUANTIZED': '1'},
+}
+SIMILARITY_THRESHOLD = 0.4
+
+
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def child(sizes, repeat, out_path):
+    rss_before = _rss_mb()
+    from encoders import load_encoder
+
+    started = time.perf_counter()
+    encoder = load_encoder('all-MiniLM-L6-v2')
+    load_seconds = time.perf_counter() - started
+    rss_loaded = _rss_mb()
+
+    report = {'load_seconds': load_seconds, 'rss_before_mb': rss_before, 'rss_loaded_mb': rss_loaded,
+              'torch_imported': 'torch' in sys.modules, 'latency': {}}
+    embeddings = {}
+    for size in sizes:
+        terms = noun_phrases(size)
+        encoder.encode(terms, normalize_embeddings=True)  # warm-up
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            vectors = encoder.encode(terms, normalize_embeddings=True)
+            latencies.append(time.perf_counter() - started)
+        embeddings[str(size)] = vectors
+        report['latency'][str(size)] = {'p50_ms': percentile(latencies, 50) * 1000,
+                                        'p95_ms': percentile(latencies, 95) * 1000}
+    report['rss_peak_mb'] = _rss_mb()
+    np.savez(out_path, **embeddings)
+    print(json.dumps(report))
+
+
+def _edges(vectors):
+    similarities = vectors @ vectors.T
+    rows, cols = np.nonzero(np.triu(similarities > SIMILARITY_THRESHOLD, k=1))
+    return {(int(i), int(j)): float(similarities[i, j]) for i, j in zip(rows, cols)}
+
+
+def compare(reference, candidate):
+    """Edge-set agreement and weight error of the similarity graph built from each backend's embeddings."""
+    ref_edges, cand_edges = _edges(reference), _edges(candidate)
+    union = set(ref_edges) | set(cand_edges)
+    shared = set(ref_edges) & set(cand_edges)
+    cosine = np.sum(reference * candidate, axis=1)
+    return {
+        'embedding_cosine_min': float(cosine.min()),
+        'embedding_cosine_mean': float(cosine.mean()),
+        'edge_jaccard': len(shared) / len(union) if union else 1.0,
+        'edges_reference': len(ref_edges),
+        'edges_missing': len(set(ref_edges) - set(cand_edges)),
+        'edges_extra': len(set(cand_edges) - set(ref_edges)),
+        'weight_mae': float(np.mean([abs(ref_edges[e] - cand_edges[e]) for e in shared])) if shared else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder backend accuracy/latency/memory comparison.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 200, 2000])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.sizes, args.repeat, args.out)
+        return
+
+    results, embeddings = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            out_path = os.path.join(tmp, f"{backend}.npz")
+            env = dict(os.environ, **BACKENDS[backend])
+            completed = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_encoders', '--child', '--out', out_path,
+                 '--repeat', str(args.repeat), '--sizes', *map(str, args.sizes)],
+                env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{backend}: failed\n{completed.stderr.strip().splitlines()[-1]}")
+                continue
+            results[backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+            embeddings[backend] = dict(np.load(out_path))
+
+    print(f"\n{'backend':<11}{'load s':>8}{'RSS MB':>9}{'peak MB':>9}{'torch?':>8}  encode p50/p95 ms by size")
+    for backend, r in results.items():
+        latency = '  '.join(f"{size}: {v['p50_ms']:.1f}/{v['p95_ms']:.1f}" for size, v in r['latency'].items())
+        print(f"{backend:<11}{r['load_seconds']:>8.2f}{r['rss_loaded_mb'] - r['rss_before_mb']:>9.0f}"
+              f"{r['rss_peak_mb']:>9.0f}{str(r['torch_imported']):>8}  {latency}")
+
+    if 'torch' in embeddings:
+        print(f"\nSimilarity graph agreement with the torch backend (threshold {SIMILARITY_THRESHOLD}):")
+        for backend in embeddings:
+            if backend == 'torch':
+                continue
+            for size in map(str, args.sizes):
+                c = compare(embeddings['torch'][size], embeddings[backend][size])
+                print(f"{backend:<11} n={size:<5} cos(min/mean)={c['embedding_cosine_min']:.4f}/"
+                      f"{c['embedding_cosine_mean']:.4f}  edge Jaccard={c['edge_jaccard']:.4f} "
+                      f"({c['edges_missing']} missing, {c['edges_extra']} extra of {c['edges_reference']})  "
+                      f"weight MAE={c['weight_mae']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_graph_repr.py
+#
+# networkx.Graph versus the array-backed ConceptGraph for the work map_concepts and
+# run_analysis do with a graph: build it from scored pairs, emit the vis.js payload,
+# and serialise it for storage.
+#
+#   python -m benchmarks.bench_graph_repr --sizes 200 2000 8000 --degree 10
+
+import argparse
+import json
+
+import networkx as nx
+import numpy as np
+
+from benchmarks.harness import bench
+from benchmarks.synthetic import noun_phrases
+from concept_graph import ConceptGraph
+
+
+def _networkx_pipeline(terms, rows, cols, weights):
+    graph = nx.Graph()
+    for term in terms:
+        graph.add_node(term)
+    for i, j, w in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+        graph.add_edge(terms[i], terms[j], weight=w, relation="semantically similar")
+    vis = ConceptGraph.from_networkx(graph).to_vis_data()
+    return graph, json.dumps(vis)
+
+
+def _array_pipeline(terms, rows, cols, weights):
+    graph = ConceptGraph(terms, rows, cols, weights)
+    vis = graph.to_vis_data()
+    return graph, graph.to_json(), json.dumps(vis)
+
+
+def run(sizes, degree, repeat):
+    results = []
+    for n in sizes:
+        rng = np.random.RandomState(n)
+        terms = noun_phrases(n)
+        m = n * degree // 2
+        rows = rng.randint(0, n, m).astype(np.int32)
+        cols = rng.randint(0, n, m).astype(np.int32)
+        keep = rows < cols
+        rows, cols = rows[keep], cols[keep]
+        weights = (0.4 + 0.6 * rng.rand(len(rows))).astype(np.float32)
+        print(f"\n-- {n} terms, {len(rows)} edges --")
+
+        results.append(bench(f"networkx_build+vis[n={n}]",
+                             lambda: _networkx_pipeline(terms, rows, cols, weights),
+                             repeat=repeat, items=len(rows), terms=n))
+        results.append(bench(f"conceptgraph_build+vis+json[n={n}]",
+                             lambda: _array_pipeline(terms, rows, cols, weights),
+                             repeat=repeat, items=len(rows), terms=n))
+
+        nx_graph, _ = _networkx_pipeline(terms, rows, cols, weights)
+        array_graph = ConceptGraph(terms, rows, cols, weights)
+        results.append(bench(f"networkx_hold[n={n}]", lambda: _networkx_pipeline(terms, rows, cols, weights)[0],
+                             repeat=1, warmup=0, terms=n))
+        results.append(bench(f"conceptgraph_hold[n={n}]", lambda: ConceptGraph(terms, rows, cols, weights),
+                             repeat=1, warmup=0, terms=n))
+        print(f"stored JSON: vis payload {len(json.dumps(array_graph.to_vis_data())) / 1024:.0f} KB, "
+              f"compact {len(array_graph.to_json()) / 1024:.0f} KB; "
+              f"networkx edges {nx_graph.number_of_edges()}, array edges {array_graph.num_edges}")
+
+        # Level-of-detail: what the browser receives first once the graph is clustered
+        laid_out = array_graph.with_layout()
+        results.append(bench(f"cluster_hierarchy[n={n}]", lambda: laid_out.with_clusters(min_nodes=0),
+                             repeat=min(repeat, 3), items=n, terms=n))
+        clustered = laid_out.with_clusters(min_nodes=0)
+        summary = clustered.to_vis_data()
+        print(f"initial payload: full {len(json.dumps(clustered.to_vis_data(full=True))) / 1024:.0f} KB, "
+              f"summary {len(json.dumps(summary)) / 1024:.0f} KB "
+              f"({len(summary['nodes'])} nodes, {len(summary['edges'])} edges)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="networkx vs ConceptGraph time and memory.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 2000, 8000])
+    parser.add_argument('--degree', type=int, default=10, help="Average edges per term.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.degree, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
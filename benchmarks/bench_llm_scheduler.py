@@ -0,0 +1,95 @@
+# benchmarks/bench_llm_scheduler.py
+#
+# Light-user latency while a heavy user floods Ollama, with and without the global
+# scheduler. One fake Ollama generates PARALLEL requests at a time; the heavy user
+# keeps HEAVY_CLIENTS calls outstanding and the light user makes one call at a time.
+# Without the scheduler the light user queues behind everything the heavy user has
+# sent; with it, the light user's calls go to the front and the heavy user is held
+# to LLM_USER_CONCURRENCY slots.
+#
+#   python -m benchmarks.bench_llm_scheduler --duration 10
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import llm_scheduler
+import ollama_client
+from benchmarks.harness import percentile
+from loadtest.fake_ollama import serve
+
+PARALLEL = 4
+HEAVY_USER, LIGHT_USER = 1, 2
+
+
+def _scenario(url, database, use_scheduler, duration, heavy_clients):
+    stop = threading.Event()
+    latencies = {HEAVY_USER: [], LIGHT_USER: []}
+
+    def call(user_id):
+        started = time.perf_counter()
+        slot = llm_scheduler.llm_slot(database, user_id) if use_scheduler else nullcontext(True)
+        with slot:
+            ollama_client.generate(url, 'phi3:mini', "system", f"user {user_id}", max_tokens=10)
+        latencies[user_id].append(time.perf_counter() - started)
+
+    def heavy():
+        while not stop.is_set():
+            call(HEAVY_USER)
+
+    def light():
+        while not stop.is_set():
+            call(LIGHT_USER)
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=heavy) for _ in range(heavy_clients)] + [threading.Thread(target=light)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    name = f"llm_scheduler[{'on' if use_scheduler else 'off'}]"
+    result = {'name': name}
+    for user_id, label in ((LIGHT_USER, 'light'), (HEAVY_USER, 'heavy')):
+        values = latencies[user_id]
+        result[f'{label}_calls'] = len(values)
+        result[f'{label}_p50_ms'] = percentile(values, 50) * 1000
+        result[f'{label}_p95_ms'] = percentile(values, 95) * 1000
+    print(f"{name:<25} light: {result['light_calls']:4d} calls p50={result['light_p50_ms']:7.0f}ms "
+          f"p95={result['light_p95_ms']:7.0f}ms | heavy: {result['heavy_calls']:4d} calls "
+          f"p50={result['heavy_p50_ms']:7.0f}ms p95={result['heavy_p95_ms']:7.0f}ms")
+    return result
+
+
+def run(duration=10, heavy_clients=16):
+    server = serve(port=0, latency='fixed:0.1', token_delay=0.01, parallel=PARALLEL, seed=0)
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    llm_scheduler.LLM_CONCURRENCY = PARALLEL
+    llm_scheduler.LLM_USER_CONCURRENCY = PARALLEL // 2
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'scheduler.db')
+        llm_scheduler.init_scheduler_database(database)
+        try:
+            for use_scheduler in (False, True):
+                results.append(_scenario(url, database, use_scheduler, duration, heavy_clients))
+        finally:
+            server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Light-user latency under a heavy user, with/without the scheduler.")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--heavy-clients', type=int, default=16)
+    args = parser.parse_args()
+    run(args.duration, args.heavy_clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_model_access.py
+#
+# Concurrent load through model_access.ModelAccess, as a gthread worker would put on
+# it: T request threads each run concept mapping (spaCy + encoder) on their own texts
+# and then wait as if on Ollama. Every result is checked against a sequential run of
+# the same text, so a race in the pipelines shows up as a mismatch or an error (and
+# the run exits with status 1), and requests/s shows how much one process gains from
+# threads while requests wait on the LLM. Each extra inference thread loads its own
+# spaCy and encoder. tests/test_model_access.py checks the same
+# with stand-in models.
+#
+#   python -m benchmarks.bench_model_access --configs 1x1 8x1 8x2 --llm-seconds 1.0
+
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks.harness import percentile
+from benchmarks.synthetic import synthetic_text
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+def run_config(nlp, encoder, request_threads, inference_threads, texts, expected, llm_seconds):
+    import spacy
+    import thread_budget
+    from concept_stream import map_concepts_streaming
+    from encoders import load_encoder
+    from model_access import ModelAccess
+
+    models = ModelAccess(nlp, encoder, load_nlp=lambda: spacy.load("en_core_web_sm"),
+                         load_encoder=lambda: load_encoder(
+                             MODEL_NAME, threads=thread_budget.threads_per_pipeline(inference_threads)),
+                         threads=inference_threads)
+    models.start_all()  # every thread's models loaded before timing
+
+    latencies, mismatches, errors = [], [], []
+    lock = threading.Lock()
+
+    def serve(thread_index):
+        for i in range(thread_index, len(texts), request_threads):
+            started = time.perf_counter()
+            try:
+                _, key_terms = map_concepts_streaming(texts[i], models.nlp, models.encoder)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            time.sleep(llm_seconds)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if key_terms != expected[i]:
+                    mismatches.append(i)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=serve, args=(t,)) for t in range(request_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'request_threads': request_threads,
+        'inference_threads': inference_threads,
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'mismatches': len(mismatches),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent concept mapping through the model-access layer.")
+    parser.add_argument('--configs', nargs='+', default=['1x1', '4x1', '8x1', '8x2'],
+                        help="REQUEST_THREADSxINFERENCE_THREADS, e.g. 8x2")
+    parser.add_argument('--requests', type=int, default=48)
+    parser.add_argument('--chunks', type=int, default=50, help="Noun chunks per synthetic text.")
+    parser.add_argument('--llm-seconds', type=float, default=1.0, help="Simulated Ollama wait per request.")
+    args = parser.parse_args()
+
+    import spacy
+    import thread_budget
+    from concept_stream import map_concepts_streaming
+    from encoders import load_encoder
+
+    nlp = spacy.load("en_core_web_sm")
+    encoder = load_encoder(MODEL_NAME, threads=thread_budget.threads_per_pipeline(1))
+    texts = [synthetic_text(args.chunks, seed=i) for i in range(args.requests)]
+    expected = [map_concepts_streaming(text, nlp, encoder)[1] for text in texts]
+
+    print(f"{args.requests} requests, {args.chunks} noun chunks each, {args.llm_seconds}s simulated LLM wait\n")
+    print(f"{'req thr':>8}{'inf thr':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'mismatch':>10}{'errors':>8}")
+    failed = False
+    for config in args.configs:
+        request_threads, inference_threads = (int(x) for x in config.split('x'))
+        r = run_config(nlp, encoder, request_threads, inference_threads, texts, expected, args.llm_seconds)
+        print(f"{request_threads:>8}{inference_threads:>8}{r['requests_per_s']:>8.2f}{r['p50_ms'] or 0:>9.0f}"
+              f"{r['p95_ms'] or 0:>9.0f}{r['mismatches']:>10}{len(r['errors']):>8}")
+        for error in sorted(set(r['errors']))[:3]:
+            print(f"    {error}")
+        failed = failed or r['mismatches'] or r['errors']
+    if failed:
+        # Any mismatch or error means the models were shared between threads somewhere
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_ollama_pool.py
+#
+# Prompt throughput through ollama_pool with one backend vs several, against local
+# fake Ollama servers that each generate OLLAMA_NUM_PARALLEL-style a few requests at
+# a time; then the same load while one backend goes down halfway, to show it being
+# ejected (calls keep succeeding on the others) and reinstated when it comes back.
+#
+#   python -m benchmarks.bench_ollama_pool --backends 1 3 --calls 120
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ollama_pool
+from loadtest.fake_ollama import serve
+
+SERVER_OPTIONS = dict(latency='fixed:0.05', token_delay=0.005, parallel=2, seed=0)
+
+
+def _url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/api/generate"
+
+
+def _drive(pool, calls, clients):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(
+            lambda i: ollama_pool.pooled_generate(pool, 'phi3:mini', "system", f"question {i}", max_tokens=20),
+            range(calls)))
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(r.startswith("Error") for r in results)
+
+
+def throughput(backend_counts, calls, clients):
+    results = []
+    for count in backend_counts:
+        servers = [serve(port=0, **SERVER_OPTIONS) for _ in range(count)]
+        try:
+            pool = ollama_pool.BackendPool([_url(s) for s in servers], max_concurrency=2)
+            elapsed, errors = _drive(pool, calls, clients)
+            per_backend = [s.state.served for s in servers]
+        finally:
+            for server in servers:
+                server.shutdown()
+        result = {'name': f"ollama_pool[{count} backends]", 'calls_per_s': calls / elapsed, 'errors': errors,
+                  'served_per_backend': per_backend}
+        print(f"{result['name']:<45} {result['calls_per_s']:7.1f} calls/s  errors={errors}  "
+              f"per_backend={per_backend}")
+        results.append(result)
+    return results
+
+
+def failover(calls, clients):
+    servers = [serve(port=0, **SERVER_OPTIONS) for _ in range(3)]
+    urls = [_url(s) for s in servers]
+    pool = ollama_pool.BackendPool(urls, max_concurrency=2)
+    try:
+        elapsed, errors = _drive(pool, calls // 2, clients)
+        servers[0].shutdown()
+        servers[0].server_close()
+        down_elapsed, down_errors = _drive(pool, calls // 2, clients)
+        ejected = not pool.snapshot()[0]['healthy']
+
+        # Bring it back on the same port and let a health check find it
+        servers[0] = serve(port=servers[0].server_address[1], **SERVER_OPTIONS)
+        pool.check_health()
+        reinstated = pool.snapshot()[0]['healthy']
+    finally:
+        for server in servers:
+            server.shutdown()
+    print(f"{'ollama_pool[failover]':<45} errors before={errors} while down={down_errors}  "
+          f"ejected={ejected} reinstated={reinstated}")
+    return [{'name': 'ollama_pool[failover]', 'errors_while_down': down_errors, 'ejected': ejected,
+             'reinstated': reinstated}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and failover of the Ollama backend pool.")
+    parser.add_argument('--backends', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--calls', type=int, default=120)
+    parser.add_argument('--clients', type=int, default=12)
+    args = parser.parse_args()
+    throughput(args.backends, args.calls, args.clients)
+    failover(args.calls, args.clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_pipeline.py
+#
+# Latency/memory/throughput of the analysis pipeline at increasing input sizes,
+# with generate_llm_prompt replaced by a deterministic stub so Ollama is not involved.
+
+import json
+import random
+
+import numpy as np
+
+from benchmarks.harness import bench
+from benchmarks.synthetic import BENCH_SIZES, stub_llm_prompt, synthetic_text
+
+
+LONG_DOC_CHARS = [20_000, 100_000]
+SIMILARITY_SIZES = [500, 2000, 8000]
+
+
+def _repeat_for(size, repeat):
+    # Keep the large sizes from dominating the run time.
+    return max(3, repeat // max(1, size // 200))
+
+
+def run(sizes=None, repeat=20):
+    import alchemist_core
+
+    alchemist_core.generate_llm_prompt = stub_llm_prompt
+    results = []
+    for size in sizes or BENCH_SIZES:
+        text = synthetic_text(size)
+        concept_graph, key_terms = alchemist_core.map_concepts(text)
+        graph_data = alchemist_core.convert_graph_to_vis_data(concept_graph)
+        n_repeat = _repeat_for(size, repeat)
+        print(f"\n-- {size} noun chunks: {len(key_terms)} terms, {len(graph_data['edges'])} edges --")
+
+        results.append(bench(f"map_concepts[n={size}]",
+                             lambda: alchemist_core.map_concepts(text),
+                             repeat=n_repeat, items=len(key_terms), size=size))
+        results.append(bench(f"graph_layout[n={size}]",
+                             lambda: concept_graph.with_layout(),
+                             repeat=n_repeat, items=len(key_terms), size=size))
+        results.append(bench(f"convert_graph_to_vis_data[n={size}]",
+                             lambda: alchemist_core.convert_graph_to_vis_data(concept_graph),
+                             repeat=n_repeat, items=len(key_terms), size=size))
+        results.append(bench(f"graph_json_dumps[n={size}]",
+                             lambda: json.dumps(graph_data),
+                             repeat=n_repeat, items=len(key_terms), size=size))
+
+        def prompts():
+            random.seed(0)
+            return alchemist_core.generate_agitation_prompts(concept_graph, key_terms, text)
+        results.append(bench(f"generate_agitation_prompts[n={size}]", prompts,
+                             repeat=n_repeat, items=1, size=size))
+
+    # Dense all-pairs scoring versus the sparse top-k graph on random 384-d embeddings,
+    # and the server-side layout of the resulting graph
+    from graph_layout import compute_layout
+    from knn_graph import topk_edges
+    for n_terms in SIMILARITY_SIZES:
+        vectors = np.random.RandomState(0).randn(n_terms, 384).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        def dense():
+            similarities = vectors @ vectors.T
+            return np.nonzero(np.triu(similarities > 0.1, k=1))
+        results.append(bench(f"similarity_dense[n={n_terms}]", dense, repeat=5, items=n_terms, terms=n_terms))
+        results.append(bench(f"similarity_topk10[n={n_terms}]", lambda: topk_edges(vectors, 10, 0.1),
+                             repeat=5, items=n_terms, terms=n_terms))
+        rows, cols, weights = topk_edges(vectors, 10, 0.1)
+        results.append(bench(f"graph_layout_topk10[n={n_terms}]",
+                             lambda: compute_layout(n_terms, rows, cols, weights),
+                             repeat=3, items=n_terms, terms=n_terms))
+
+    # Long pasted documents take the streaming path (chunked spaCy, capped terms/edges)
+    for n_chars in LONG_DOC_CHARS:
+        text = "\n\n".join(synthetic_text(200, seed) for seed in range(n_chars // 5000 + 1))[:n_chars]
+        results.append(bench(f"map_concepts[long_doc={n_chars}]",
+                             lambda: alchemist_core.map_concepts(text),
+                             repeat=3, items=n_chars, chars=n_chars))
+    return results
@@ -0,0 +1,52 @@
+# benchmarks/bench_preview.py
+#
+# Live-preview latency per edit at increasing document sizes: the incremental engine
+# (live_preview.py) versus running map_concepts over the whole text again. Each edit
+# toggles a phrase in one sentence in the middle of the document, as typing would.
+#
+#   python -m benchmarks.bench_preview --sizes 50 500 2000
+
+import argparse
+
+from benchmarks.harness import bench
+from benchmarks.synthetic import synthetic_text
+
+PREVIEW_SIZES = [50, 200, 500, 2000]
+
+
+def run(sizes=None, repeat=20):
+    import alchemist_core
+    from live_preview import PreviewEngine
+
+    results = []
+    for size in sizes or PREVIEW_SIZES:
+        sentences = synthetic_text(size).split('. ')
+        middle = len(sentences) // 2
+        edited = sentences[:middle] + [sentences[middle] + ' near the silent harbour'] + sentences[middle + 1:]
+        texts = ['. '.join(sentences), '. '.join(edited)]
+        engine = PreviewEngine(alchemist_core.nlp_spacy, alchemist_core.alchemist_model)
+        state = {'turn': 0, 'version': engine.update('bench', texts[0])['version']}
+
+        def edit():
+            state['turn'] += 1
+            delta = engine.update('bench', texts[state['turn'] % 2], state['version'])
+            state['version'] = delta['version']
+            return delta
+
+        print(f"\n-- {size} noun chunks, {len(texts[0])} chars --")
+        results.append(bench(f"preview_edit[n={size}]", edit, repeat=repeat, size=size))
+        results.append(bench(f"map_concepts_full[n={size}]", lambda: alchemist_core.map_concepts(texts[0]),
+                             repeat=max(3, repeat // max(1, size // 200)), size=size))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live-preview edit latency versus a full re-analysis.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=PREVIEW_SIZES)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/bench_result_cache.py
+#
+# Hit rate and similarity distribution of the semantic result cache. Each base text
+# is analysed once (its embedding goes into the index), then looked up again as a
+# series of variants: punctuation/case stripped, sentences reordered, one phrase
+# edited, and an unrelated text. Near-duplicates should come back as serve/adapt and
+# unrelated texts as misses; the similarity percentiles help pick the thresholds.
+#
+#   python -m benchmarks.bench_result_cache --texts 50 --chunks 20
+
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+from collections import Counter
+
+import result_cache
+from benchmarks.harness import percentile
+from benchmarks.synthetic import NOUNS, synthetic_text
+
+USER_ID = 1
+THRESHOLD = 0.5
+
+
+def _variants(text, rng):
+    sentences = text.split('. ')
+    shuffled = sentences[:]
+    rng.shuffle(shuffled)
+    words = text.split(' ')
+    edited = words[:]
+    edited[rng.randrange(len(words))] = rng.choice(NOUNS)
+    return {
+        'punctuation': re.sub(r'[^\w\s]', '', text).lower(),
+        'reordered': '. '.join(s.rstrip('.') for s in shuffled) + '.',
+        'edited': ' '.join(edited),
+    }
+
+
+def run(texts=50, chunks=20, seed=0):
+    from encoders import load_encoder
+
+    encoder = load_encoder('all-MiniLM-L6-v2')
+    rng = random.Random(seed)
+    decisions = {}
+    similarities = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'cache.db')
+        with sqlite3.connect(database) as conn:
+            conn.execute('CREATE TABLE sessions (id INTEGER PRIMARY KEY, key_terms TEXT, prompts TEXT, '
+                         'graph_data TEXT)')
+            result_cache.init_result_cache_tables(conn.cursor())
+        index = result_cache.ResultIndex(database, os.path.join(tmp, 'embeddings'))
+
+        for i in range(texts):
+            base = synthetic_text(chunks, seed=seed * 1000 + i)
+            with sqlite3.connect(database) as conn:
+                session_id = conn.execute("INSERT INTO sessions (key_terms, prompts, graph_data) "
+                                          "VALUES ('[]', '[]', NULL)").lastrowid
+            base_embedding = result_cache.embed_input(encoder, base)
+            index.add(session_id, USER_ID, base_embedding, len(base), THRESHOLD)
+
+            lookups = _variants(base, rng)
+            lookups['unrelated'] = synthetic_text(chunks, seed=seed * 1000 + texts + i)
+            for kind, text in lookups.items():
+                embedding = result_cache.embed_input(encoder, text)
+                match = index.find(USER_ID, embedding, len(text), THRESHOLD)
+                decisions.setdefault(kind, Counter())[match.decision if match else 'miss'] += 1
+                # Similarity to its own base text, whatever the index decided
+                similarities.setdefault(kind, []).append(float(embedding @ base_embedding))
+
+    results = []
+    for kind, counts in decisions.items():
+        values = similarities[kind]
+        result = {'name': f"result_cache[{kind}]", 'params': {'texts': texts, 'chunks': chunks},
+                  'serve': counts['serve'] / texts, 'adapt': counts['adapt'] / texts, 'miss': counts['miss'] / texts,
+                  'similarity_p5': percentile(values, 5), 'similarity_p50': percentile(values, 50),
+                  'similarity_p95': percentile(values, 95)}
+        print(f"{result['name']:<28} serve={result['serve']:5.0%} adapt={result['adapt']:5.0%} "
+              f"miss={result['miss']:5.0%}  similarity p5={result['similarity_p5']:.3f} "
+              f"p50={result['similarity_p50']:.3f} p95={result['similarity_p95']:.3f}")
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and similarities of the semantic result cache.")
+    parser.add_argument('--texts', type=int, default=50)
+    parser.add_argument('--chunks', type=int, default=20, help="Noun chunks per synthetic text.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.texts, args.chunks, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/bench_storage.py
+#
+# SQLite helper latency against a large generated database (see make_sessions_db.py).
+
+import json
+import os
+import sqlite3
+
+from benchmarks.harness import bench
+from benchmarks.make_sessions_db import DEFAULT_DB_PATH
+
+
+def _pick_users(path):
+    conn = sqlite3.connect(path)
+    heavy = conn.execute(
+        'SELECT user_id, COUNT(*) AS c FROM sessions GROUP BY user_id ORDER BY c DESC LIMIT 1').fetchone()
+    light = conn.execute(
+        'SELECT user_id, COUNT(*) AS c FROM sessions GROUP BY user_id ORDER BY c ASC LIMIT 1').fetchone()
+    total = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+    sample = conn.execute('SELECT key_terms, prompts, graph_data FROM sessions LIMIT 1').fetchone()
+    conn.close()
+    return heavy, light, total, sample
+
+
+def run(db_path=None, repeat=50):
+    import alchemist_core
+
+    db_path = db_path or DEFAULT_DB_PATH
+    if not os.path.exists(db_path):
+        raise SystemExit(f"'{db_path}' not found. Generate it first: python -m benchmarks.make_sessions_db")
+    alchemist_core.DATABASE = db_path
+
+    (heavy_user, heavy_count), (light_user, light_count), total, sample = _pick_users(db_path)
+    print(f"\n-- {total} sessions; heavy user {heavy_user} has {heavy_count}, light user {light_user} has {light_count} --")
+    key_terms_json, prompts_json, graph_json = sample
+
+    results = [
+        bench("get_all_sessions[heavy_user]", lambda: alchemist_core.get_all_sessions(heavy_user),
+              repeat=repeat, items=heavy_count, sessions=total),
+        bench("get_all_sessions[light_user]", lambda: alchemist_core.get_all_sessions(light_user),
+              repeat=repeat, items=light_count, sessions=total),
+        bench("get_last_session_data[heavy_user]", lambda: alchemist_core.get_last_session_data(heavy_user),
+              repeat=repeat, sessions=total),
+        bench("get_last_session_data[light_user]", lambda: alchemist_core.get_last_session_data(light_user),
+              repeat=repeat, sessions=total),
+        bench("User.get", lambda: alchemist_core.User.get(heavy_user), repeat=repeat, sessions=total),
+    ]
+
+    key_terms = json.loads(key_terms_json)
+    prompts = json.loads(prompts_json)
+
+    def save_then_delete():
+        # Paired so the database stays the same size across runs.
+        session_id = alchemist_core.save_session(light_user, "benchmark input", key_terms, prompts, graph_json)
+        alchemist_core.delete_session_from_db(session_id, light_user)
+
+    results.append(bench("save_session+delete_session_from_db", save_then_delete,
+                         repeat=repeat, items=2, sessions=total))
+    return results
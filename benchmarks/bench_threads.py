@@ -0,0 +1,96 @@
+# benchmarks/bench_threads.py
+#
+# Encoder throughput versus thread allocation: P processes each running an encoder with
+# T intra-op threads, all encoding concurrently, like P gunicorn workers under load.
+#
+#   python -m benchmarks.bench_threads                       # default grid for this machine
+#   python -m benchmarks.bench_threads --configs 1x8 2x4 4x2 8x1 8x8 --duration 20
+
+import argparse
+import multiprocessing
+import os
+import time
+
+from benchmarks.harness import percentile
+from benchmarks.synthetic import noun_phrases
+
+
+def _encode_loop(threads, workers, batch, duration, start_barrier, results):
+    # Runs in a fresh (spawned) process, so the budget is applied before anything is imported
+    os.environ['ALCHEMIST_THREADS_PER_WORKER'] = str(threads)
+    os.environ['ALCHEMIST_BUDGET_WORKERS'] = str(workers)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'RAYON_NUM_THREADS'):
+        os.environ.pop(name, None)
+    import thread_budget
+    thread_budget.apply_env_budget(threads)
+    from encoders import load_encoder
+    encoder = load_encoder('all-MiniLM-L6-v2', threads=threads)
+    thread_budget.apply_runtime_budget(threads)
+
+    terms = noun_phrases(batch)
+    encoder.encode(terms)  # warm-up
+    start_barrier.wait()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        encoder.encode(terms)
+        latencies.append(time.perf_counter() - started)
+    results.put(latencies)
+
+
+def run_config(processes, threads, batch, duration):
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_encode_loop, args=(threads, processes, batch, duration, barrier, results))
+               for _ in range(processes)]
+    for w in workers:
+        w.start()
+    latencies = []
+    for _ in workers:
+        latencies += results.get()
+    for w in workers:
+        w.join()
+    return {
+        'processes': processes,
+        'threads': threads,
+        'batches_per_s': len(latencies) / duration,
+        'terms_per_s': len(latencies) * batch / duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+    }
+
+
+def default_configs(cores):
+    configs = {(1, cores), (cores, 1), (cores, cores)}  # last one: every worker with a full-size pool
+    half = max(1, cores // 2)
+    configs |= {(2, half), (half, 2)}
+    return sorted(configs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder throughput versus processes x threads.")
+    parser.add_argument('--configs', nargs='+', default=None, help="PROCESSESxTHREADS, e.g. 4x2")
+    parser.add_argument('--batch', type=int, default=50, help="Terms per encode call.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per configuration.")
+    args = parser.parse_args()
+
+    import thread_budget
+    cores = thread_budget.available_cores()
+    if args.configs:
+        configs = [tuple(int(x) for x in c.split('x')) for c in args.configs]
+    else:
+        configs = default_configs(cores)
+
+    print(f"{cores} core(s) available; {args.batch} terms per call, {args.duration}s per configuration\n")
+    print(f"{'procs':>6}{'threads':>8}{'total':>7}{'batches/s':>11}{'terms/s':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for processes, threads in configs:
+        r = run_config(processes, threads, args.batch, args.duration)
+        flag = '  oversubscribed' if processes * threads > cores else ''
+        print(f"{processes:>6}{threads:>8}{processes * threads:>7}{r['batches_per_s']:>11.1f}"
+              f"{r['terms_per_s']:>10.0f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{flag}")
+
+
+if __name__ == "__main__":
+    main()
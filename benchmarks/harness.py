@@ -0,0 +1,114 @@
+# benchmarks/harness.py
+#
+# Small timing harness shared by the benchmark scripts: latency percentiles,
+# peak traced memory, throughput, and JSON baselines for before/after comparison.
+
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def bench(name, func, repeat=20, warmup=2, items=1, **params):
+    """
+    Runs `func()` `warmup + repeat` times and returns a result dict.
+    `items` is the number of logical items one call processes (terms, rows...),
+    used to report throughput in items per second.
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    gc.collect()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run: tracemalloc itself slows Python code noticeably.
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = statistics.mean(latencies)
+    result = {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': mean * 1000,
+        'peak_mem_kb': peak / 1024,
+        'throughput_per_s': items / mean if mean > 0 else None,
+    }
+    print(f"{name:<45} p50={result['p50_ms']:9.2f}ms p95={result['p95_ms']:9.2f}ms "
+          f"p99={result['p99_ms']:9.2f}ms peak={result['peak_mem_kb']:10.1f}KB "
+          f"thr={result['throughput_per_s'] or 0:10.1f}/s")
+    return result
+
+
+def _key(result):
+    return result['name']
+
+
+def save_baseline(results, baseline_name):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{baseline_name}.json")
+    with open(path, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, f, indent=2)
+    print(f"\nSaved baseline '{baseline_name}' to {path}")
+    return path
+
+
+def compare_to_baseline(results, baseline_name, tolerance=0.10):
+    """
+    Prints p50/p95/peak-memory changes against a saved baseline and returns the
+    list of benchmarks whose p50 regressed by more than `tolerance`.
+    """
+    path = os.path.join(BASELINE_DIR, f"{baseline_name}.json")
+    with open(path) as f:
+        baseline = {_key(r): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nComparison against baseline '{baseline_name}':")
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            print(f"{result['name']:<45} (new)")
+            continue
+        p50_change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0.0
+        p95_change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        mem_change = ((result['peak_mem_kb'] - old['peak_mem_kb']) / old['peak_mem_kb']
+                      if old['peak_mem_kb'] else 0.0)
+        flag = ''
+        if p50_change > tolerance:
+            flag = '  <-- REGRESSION'
+            regressions.append(result['name'])
+        print(f"{result['name']:<45} p50 {p50_change:+7.1%}  p95 {p95_change:+7.1%}  mem {mem_change:+7.1%}{flag}")
+    return regressions
@@ -0,0 +1,107 @@
+# benchmarks/make_sessions_db.py
+#
+# Generates a large alchemist_sessions.db for the storage benchmarks.
+#
+#   python -m benchmarks.make_sessions_db                     # 1M sessions, 10k users
+#   python -m benchmarks.make_sessions_db --sessions 100000 --users 1000 --out /tmp/small.db
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import networkx as nx
+
+from benchmarks.synthetic import noun_phrases, synthetic_text
+from concept_graph import ConceptGraph
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bench_sessions.db')
+PAYLOAD_VARIANTS = 200
+
+
+def _payloads(terms_per_session, seed):
+    rng = random.Random(seed)
+    phrases = noun_phrases(2000, seed)
+    payloads = []
+    for i in range(PAYLOAD_VARIANTS):
+        terms = rng.sample(phrases, terms_per_session)
+        graph = nx.Graph()
+        graph.add_nodes_from(terms)
+        for a in range(len(terms)):
+            for b in range(a + 1, len(terms)):
+                if rng.random() < 0.3:
+                    graph.add_edge(terms[a], terms[b], weight=0.4 + rng.random() * 0.5,
+                                   relation="semantically similar")
+        prompts = [f"<b>Deconstruct This:</b> What are the core components of '{terms[0]}'?"] * 5
+        payloads.append((
+            synthetic_text(terms_per_session, seed + i)[:400],
+            json.dumps(terms),
+            json.dumps(prompts),
+            ConceptGraph.from_networkx(graph).to_json(),
+        ))
+    return payloads
+
+
+def build_database(path, n_sessions, n_users, terms_per_session=8, seed=42, batch_size=20000):
+    import alchemist_core
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    alchemist_core.DATABASE = path
+    alchemist_core.init_db()
+
+    rng = random.Random(seed)
+    payloads = _payloads(terms_per_session, seed)
+    start_time = datetime(2025, 1, 1)
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executemany('INSERT INTO users (id, username, password) VALUES (?, ?, ?)',
+                     ((uid, f"bench_user_{uid}", "not-a-real-hash") for uid in range(1, n_users + 1)))
+
+    # Zipf-ish skew: a few heavy users own many sessions, most users have a handful.
+    weights = [1.0 / (rank ** 0.8) for rank in range(1, n_users + 1)]
+    user_ids = list(range(1, n_users + 1))
+    inserted = 0
+    while inserted < n_sessions:
+        count = min(batch_size, n_sessions - inserted)
+        owners = rng.choices(user_ids, weights=weights, k=count)
+        rows = []
+        for offset, owner in enumerate(owners):
+            input_text, key_terms, prompts, graph_data = payloads[(inserted + offset) % PAYLOAD_VARIANTS]
+            timestamp = start_time + timedelta(seconds=(inserted + offset) * 30)
+            rows.append((owner, input_text, key_terms, prompts, graph_data, timestamp.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.executemany(
+            'INSERT INTO sessions (user_id, input_text, key_terms, prompts, graph_data, timestamp) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.commit()
+        inserted += count
+        print(f"  {inserted:>9}/{n_sessions} sessions ({time.perf_counter() - started:.1f}s)")
+
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"Generated '{path}': {n_sessions} sessions, {n_users} users, {size_mb:.1f} MB.")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large sessions database for benchmarking.")
+    parser.add_argument('--out', default=DEFAULT_DB_PATH)
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--terms', type=int, default=8, help="Key terms per generated session.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    build_database(args.out, args.sessions, args.users, args.terms, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# benchmarks/run.py
+#
+# Entry point for the benchmark suite.
+#
+#   python -m benchmarks.run pipeline                       # stubbed LLM, 10..2000 noun chunks
+#   python -m benchmarks.run storage --db path/to.db        # needs benchmarks.make_sessions_db first
+#   python -m benchmarks.run all --save-baseline main       # record a baseline
+#   python -m benchmarks.run all --compare main             # exit 1 if any p50 regressed > tolerance
+
+import argparse
+import sys
+
+from benchmarks.harness import compare_to_baseline, save_baseline
+from benchmarks.synthetic import BENCH_SIZES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="The Idea Forge benchmark suite.")
+    parser.add_argument('suite', choices=['pipeline', 'storage', 'all'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES,
+                        help="Noun-chunk counts for the pipeline benchmarks.")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--db', default=None, help="Sessions database for the storage benchmarks.")
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Relative p50 slowdown that counts as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    if args.suite in ('pipeline', 'all'):
+        from benchmarks import bench_pipeline
+        results += bench_pipeline.run(args.sizes, args.repeat)
+    if args.suite in ('storage', 'all'):
+        from benchmarks import bench_storage
+        results += bench_storage.run(args.db, args.repeat)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+    if args.compare:
+        regressions = compare_to_baseline(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
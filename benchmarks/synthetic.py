@@ -0,0 +1,61 @@
+# benchmarks/synthetic.py
+#
+# Deterministic synthetic inputs for the benchmarks: texts with a controlled number
+# of distinct noun chunks, and a stand-in for generate_llm_prompt that never hits Ollama.
+
+import hashlib
+import json
+import random
+
+ADJECTIVES = [
+    "sustainable", "urban", "digital", "hidden", "collective", "adaptive", "fragile", "distributed",
+    "ancient", "quantum", "social", "economic", "creative", "invisible", "local", "global",
+    "emergent", "resilient", "chaotic", "silent", "radical", "shared", "private", "organic",
+]
+NOUNS = [
+    "energy", "network", "privacy", "growth", "education", "community", "market", "memory",
+    "identity", "infrastructure", "language", "trust", "system", "habitat", "policy", "culture",
+    "security", "currency", "landscape", "algorithm", "ritual", "archive", "supply chain", "garden",
+    "protocol", "ecosystem", "platform", "factory", "theory", "boundary", "signal", "pattern",
+]
+VERBS = ["shapes", "undermines", "supports", "reflects", "transforms", "connects to", "competes with", "feeds"]
+
+BENCH_SIZES = [10, 50, 200, 500, 1000, 2000]
+
+
+def noun_phrases(count, seed=0):
+    """Returns `count` distinct two-word noun phrases (falls back to numbered phrases past the vocabulary)."""
+    rng = random.Random(seed)
+    phrases = [f"{adj} {noun}" for adj in ADJECTIVES for noun in NOUNS]
+    rng.shuffle(phrases)
+    while len(phrases) < count:
+        phrases.append(f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {len(phrases)}")
+    return phrases[:count]
+
+
+def synthetic_text(n_chunks, seed=0):
+    """
+    Builds a text of simple sentences containing roughly `n_chunks` distinct noun chunks,
+    two per sentence, so spaCy's noun_chunks yields a predictable term count.
+    """
+    rng = random.Random(seed)
+    phrases = noun_phrases(n_chunks, seed)
+    sentences = []
+    for i in range(0, len(phrases), 2):
+        pair = phrases[i:i + 2]
+        if len(pair) == 2:
+            sentences.append(f"The {pair[0]} {rng.choice(VERBS)} the {pair[1]}.")
+        else:
+            sentences.append(f"The {pair[0]} matters.")
+    return " ".join(sentences)
+
+
+def stub_llm_prompt(system_message, user_message, max_tokens=150, temperature=0.7, **kwargs):
+    """Deterministic replacement for generate_llm_prompt: same inputs, same question, no network."""
+    digest = hashlib.sha1((system_message + "\n" + user_message).encode('utf-8')).hexdigest()
+    question = f"What would change if the assumption behind #{digest[:8]} were reversed?"
+    response_format = kwargs.get('response_format')
+    if isinstance(response_format, dict):
+        # Structured agitation mode asks for one JSON object with a question per key
+        return json.dumps({key: question for key in response_format.get('properties', {})})
+    return question
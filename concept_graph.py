@@ -0,0 +1,361 @@
+# concept_graph.py
+#
+# Compact concept graph: a term array plus COO edge arrays (int32 endpoints, float32
+# weights). This is what map_concepts returns, what gets serialised into
+# sessions.graph_data, and what the vis.js payload is built from. Use to_networkx()
+# when you need graph algorithms. Node positions from graph_layout are optional and,
+# when present, are stored and sent along so the client can skip its physics layout.
+# Large graphs also carry a cluster hierarchy (graph_clusters) and are sent to the
+# browser as a per-cluster summary that expands on demand. Fresh graphs also carry
+# their term embeddings, which are stored beside the session (session_embeddings.py)
+# rather than in the JSON, so the edges can be recomputed for another threshold.
+
+import json
+
+import networkx as nx
+import numpy as np
+
+from graph_clusters import LOD_MIN_NODES, ancestors, build_hierarchy
+from graph_layout import compute_layout
+
+GRAPH_FORMAT = 'concept-graph/1'
+EDGE_RELATION = "semantically similar"
+
+# Shared by every node/edge in the vis.js payload instead of a fresh dict per element
+_NODE_FONT = {'size': 16}
+_NODE_COLOR = {
+    'background': '#8d99ae',
+    'border': '#2b2d42',
+    'highlight': {'background': '#edf2f4', 'border': '#ef233c'},
+    'hover': {'background': '#edf2f4', 'border': '#ef233c'}
+}
+_EDGE_COLOR = {
+    'color': '#8d99ae',
+    'highlight': '#ef233c',
+    'hover': '#ef233c'
+}
+_CLUSTER_COLOR = {
+    'background': '#2b2d42',
+    'border': '#8d99ae',
+    'highlight': {'background': '#ef233c', 'border': '#2b2d42'},
+    'hover': {'background': '#ef233c', 'border': '#2b2d42'}
+}
+_CLUSTER_FONT = {'size': 18, 'color': '#2b2d42'}
+# Terms listed in a cluster node's tooltip
+CLUSTER_TITLE_TERMS = 8
+
+
+class ConceptGraph:
+    __slots__ = ('terms', 'rows', 'cols', 'weights', 'positions', 'clusters', 'embeddings')
+
+    def __init__(self, terms, rows=None, cols=None, weights=None, positions=None, clusters=None, embeddings=None):
+        self.terms = list(terms)
+        self.rows = np.asarray(rows if rows is not None else [], dtype=np.int32)
+        self.cols = np.asarray(cols if cols is not None else [], dtype=np.int32)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float32)
+        self.positions = None if positions is None else np.asarray(positions, dtype=np.float32).reshape(-1, 2)
+        # Parent arrays per level, see graph_clusters.build_hierarchy
+        self.clusters = None if not clusters else [np.asarray(level, dtype=np.int32) for level in clusters]
+        # One normalised row per term, or None once loaded back from JSON
+        self.embeddings = embeddings
+
+    @classmethod
+    def empty(cls):
+        return cls([])
+
+    @property
+    def num_nodes(self):
+        return len(self.terms)
+
+    @property
+    def num_edges(self):
+        return len(self.weights)
+
+    def nodes(self):
+        return list(self.terms)
+
+    def number_of_nodes(self):
+        return self.num_nodes
+
+    def number_of_edges(self):
+        return self.num_edges
+
+    def sorted_by_weight(self):
+        """Returns a copy with edges ordered strongest first."""
+        order = np.argsort(-self.weights, kind='stable')
+        return ConceptGraph(self.terms, self.rows[order], self.cols[order], self.weights[order], self.positions,
+                            self.clusters, self.embeddings)
+
+    def with_layout(self, **kwargs):
+        """Returns a copy with node positions computed by graph_layout.compute_layout."""
+        positions = compute_layout(self.num_nodes, self.rows, self.cols, self.weights, **kwargs)
+        return ConceptGraph(self.terms, self.rows, self.cols, self.weights, positions, self.clusters, self.embeddings)
+
+    def with_clusters(self, min_nodes=LOD_MIN_NODES, **kwargs):
+        """Returns a copy with a cluster hierarchy, or this graph unchanged if it is small enough to send whole."""
+        if self.num_nodes < min_nodes:
+            return self
+        levels = build_hierarchy(self.num_nodes, self.rows, self.cols, self.weights, self.positions, **kwargs)
+        return ConceptGraph(self.terms, self.rows, self.cols, self.weights, self.positions, levels, self.embeddings)
+
+    def with_edges(self, rows, cols, weights):
+        """Returns a copy with other edges, keeping the layout and clusters computed for these."""
+        return ConceptGraph(self.terms, rows, cols, weights, self.positions, self.clusters,
+                            self.embeddings).sorted_by_weight()
+
+    def to_csr(self):
+        """Symmetric CSR adjacency as (indptr, indices, data)."""
+        n = self.num_nodes
+        src = np.concatenate([self.rows, self.cols])
+        dst = np.concatenate([self.cols, self.rows])
+        data = np.concatenate([self.weights, self.weights])
+        order = np.lexsort((dst, src))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return indptr, dst[order].astype(np.int32), data[order]
+
+    def weighted_degree(self):
+        degree = np.zeros(self.num_nodes, dtype=np.float64)
+        np.add.at(degree, self.rows, self.weights)
+        np.add.at(degree, self.cols, self.weights)
+        return degree
+
+    # --- networkx adapter ---
+    def to_networkx(self):
+        graph = nx.Graph()
+        graph.add_nodes_from(self.terms)
+        graph.add_weighted_edges_from(
+            ((self.terms[i], self.terms[j], w) for i, j, w in
+             zip(self.rows.tolist(), self.cols.tolist(), self.weights.tolist())),
+            relation=EDGE_RELATION)
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph):
+        terms = list(graph.nodes())
+        index = {term: i for i, term in enumerate(terms)}
+        edges = list(graph.edges(data='weight', default=0.0))
+        return cls(terms,
+                   [index[u] for u, _, _ in edges],
+                   [index[v] for _, v, _ in edges],
+                   [w for _, _, w in edges])
+
+    # --- serialisation ---
+    def to_dict(self):
+        data = {
+            'format': GRAPH_FORMAT,
+            'terms': self.terms,
+            'edges': {
+                'rows': self.rows.tolist(),
+                'cols': self.cols.tolist(),
+                # four decimals is plenty for display and keeps the stored JSON small
+                'weights': np.round(self.weights, 4).tolist(),
+            },
+        }
+        if self.positions is not None:
+            # whole pixels are enough on the canvas
+            data['positions'] = np.round(self.positions).astype(np.int32).ravel().tolist()
+        if self.clusters:
+            data['clusters'] = [level.tolist() for level in self.clusters]
+        return data
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    @classmethod
+    def from_dict(cls, data):
+        edges = data.get('edges', {})
+        return cls(data['terms'], edges.get('rows'), edges.get('cols'), edges.get('weights'), data.get('positions'),
+                   data.get('clusters'))
+
+    # --- vis.js payloads ---
+    def _term_node(self, i):
+        node = {
+            'id': i,
+            'label': self.terms[i],
+            'title': self.terms[i],
+            'font': _NODE_FONT,
+            'shape': 'dot',
+            'color': _NODE_COLOR,
+        }
+        if self.positions is not None:
+            node['x'], node['y'] = self.positions[i].tolist()
+        return node
+
+    def to_vis_data(self, full=False):
+        """
+        The vis.js payload. Graphs with a cluster hierarchy get the top-level summary
+        unless `full` is set; see vis_expansion for drilling into it.
+        """
+        if self.clusters and not full:
+            top = len(self.clusters) - 1
+            items = [(top, c) for c in range(int(self.clusters[top].max()) + 1)]
+            data = self._vis_items(items)
+            data.update({'positioned': self.positions is not None, 'lod': True, 'total_nodes': self.num_nodes})
+            return data
+
+        nodes = [self._term_node(i) for i in range(self.num_nodes)]
+        widths = np.maximum(1, (self.weights * 4).astype(np.int32) + 1).tolist()
+        edges = [{
+            'from': u,
+            'to': v,
+            'title': f"Similarity: {w:.2f}",
+            'width': width,
+            'color': _EDGE_COLOR,
+        } for u, v, w, width in zip(self.rows.tolist(), self.cols.tolist(), self.weights.tolist(), widths)]
+        # 'positioned' tells the client to draw as-is with physics off
+        return {'nodes': nodes, 'edges': edges, 'positioned': self.positions is not None}
+
+    def vis_expansion(self, cluster_key, visible=()):
+        """
+        The members of one cluster (its sub-clusters, or its terms at level 0) plus the
+        edges from them to each other and to the `visible` node ids already on screen.
+        Raises ValueError for an unknown cluster.
+        """
+        level, index = _parse_cluster_key(cluster_key, self.clusters)
+        # Skip levels where the cluster has a single sub-cluster, so one click always opens something up
+        children = [(level, index)]
+        while len(children) == 1 and children[0][0] >= 0:
+            level, index = children[0]
+            if level == 0:
+                children = [(-1, t) for t in np.nonzero(self.clusters[0] == index)[0].tolist()]
+            else:
+                children = [(level - 1, c) for c in np.nonzero(self.clusters[level] == index)[0].tolist()]
+
+        shown = self._visible_items(visible)
+        data = self._vis_items(shown + children, first_new=len(shown))
+        data['cluster'] = cluster_key
+        return data
+
+    def vis_edges(self, visible):
+        """The vis.js edges between the `visible` node ids (terms and clusters) already on screen."""
+        return self._vis_items(self._visible_items(visible))['edges']
+
+    def _visible_items(self, visible):
+        shown = []
+        for node_id in visible:
+            node_id = str(node_id)
+            if node_id.isdigit() and int(node_id) < self.num_nodes:
+                shown.append((-1, int(node_id)))
+            elif node_id.startswith('c'):
+                try:
+                    shown.append(_parse_cluster_key(node_id[1:], self.clusters))
+                except ValueError:
+                    pass
+        return shown
+
+    def _vis_items(self, items, first_new=0):
+        """
+        Nodes for items[first_new:] and the edges touching them. An item is a term
+        (level -1) or a (level, cluster) pair drawn as one node; edges between two
+        items are merged into one. Items later in the list win where they overlap.
+        """
+        levels = ancestors(self.clusters or [])
+        owner = np.full(self.num_nodes, -1, dtype=np.int64)
+        for item, (level, index) in enumerate(items):
+            if level < 0:
+                owner[index] = item
+            else:
+                owner[levels[level] == index] = item
+
+        order = np.argsort(owner, kind='stable')
+        bounds = np.searchsorted(owner[order], np.arange(len(items) + 1))
+        degree = self.weighted_degree()
+        display_ids = []
+        nodes = []
+        for item, (level, index) in enumerate(items):
+            members = order[bounds[item]:bounds[item + 1]]
+            if len(members) == 1:
+                display_ids.append(int(members[0]))
+                if item >= first_new:
+                    nodes.append(self._term_node(int(members[0])))
+                continue
+            key = f"{level}_{index}"
+            display_ids.append(f"c{key}")
+            if item < first_new or not len(members):
+                continue
+            top = members[np.argsort(-degree[members], kind='stable')][:CLUSTER_TITLE_TERMS]
+            title = ", ".join(self.terms[t] for t in top.tolist())
+            node = {
+                'id': f"c{key}",
+                'label': f"{self.terms[int(top[0])]} +{len(members) - 1}",
+                'title': title + (", ..." if len(members) > len(top) else ""),
+                'font': _CLUSTER_FONT,
+                'shape': 'dot',
+                'size': int(12 + 3 * np.sqrt(len(members))),
+                'color': _CLUSTER_COLOR,
+                'cluster': key,
+                'members': len(members),
+            }
+            if self.positions is not None:
+                node['x'], node['y'] = self.positions[members].mean(axis=0).tolist()
+            nodes.append(node)
+
+        a, b = owner[self.rows], owner[self.cols]
+        keep = (a >= 0) & (b >= 0) & (a != b) & ((a >= first_new) | (b >= first_new))
+        lo, hi, w = np.minimum(a, b)[keep], np.maximum(a, b)[keep], self.weights[keep]
+        pairs, inverse = np.unique(lo * len(items) + hi, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(pairs))
+        strongest = np.zeros(len(pairs), dtype=np.float32)
+        np.maximum.at(strongest, inverse, w)
+
+        widths = np.maximum(1, (strongest * 4).astype(np.int32) + 1).tolist()
+        edges = [{
+            'from': display_ids[pair // len(items)],
+            'to': display_ids[pair % len(items)],
+            'title': f"Similarity: {weight:.2f}" if count == 1 else f"{count} links, strongest {weight:.2f}",
+            'width': width,
+            'color': _EDGE_COLOR,
+        } for pair, count, weight, width in zip(pairs.tolist(), counts.tolist(), strongest.tolist(), widths)]
+        return {'nodes': nodes, 'edges': edges}
+
+
+def _parse_cluster_key(key, clusters):
+    """'<level>_<index>' -> (level, index), checked against the hierarchy."""
+    try:
+        level, index = (int(part) for part in str(key).split('_'))
+    except ValueError:
+        raise ValueError(f"Malformed cluster id '{key}'.")
+    if not clusters or not 0 <= level < len(clusters) or not 0 <= index <= int(clusters[level].max()):
+        raise ValueError(f"Unknown cluster '{key}'.")
+    return level, index
+
+
+def is_compact_graph(data):
+    return isinstance(data, dict) and data.get('format') == GRAPH_FORMAT
+
+
+def load_concept_graph(graph_data_json, on_completed=None):
+    """
+    Parses a stored sessions.graph_data value into a ConceptGraph, or None for the
+    older vis.js format. Graphs saved without a layout or clusters (older sessions, or
+    an analysis that ran out of time) get them computed here, and `on_completed(json)`
+    is called with the completed graph so the caller can store it for next time.
+    """
+    if not graph_data_json:
+        return None
+    data = json.loads(graph_data_json)
+    if not is_compact_graph(data):
+        return None
+    stored = graph = ConceptGraph.from_dict(data)
+    if graph.positions is None:
+        graph = graph.with_layout()
+    if graph.clusters is None:
+        # Unchanged for graphs too small to cluster
+        graph = graph.with_clusters()
+    if graph is not stored and on_completed is not None:
+        on_completed(graph.to_json())
+    return graph
+
+
+def load_graph_data(graph_data_json, on_completed=None):
+    """
+    Turns a stored sessions.graph_data value into vis.js data. Older sessions stored
+    the vis.js payload itself; newer ones store the compact ConceptGraph form.
+    """
+    if not graph_data_json:
+        return {'nodes': [], 'edges': []}
+    graph = load_concept_graph(graph_data_json, on_completed)
+    if graph is None:
+        return json.loads(graph_data_json)
+    return graph.to_vis_data()
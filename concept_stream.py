@@ -0,0 +1,206 @@
+# concept_stream.py
+#
+# Streaming concept mapping for long documents. The text goes through spaCy in chunks,
+# terms are counted incrementally, only the top terms are encoded (in fixed-size batches),
+# and the graph grows batch by batch while keeping at most `max_edges` edges, so time
+# and memory are bounded by the caps rather than by the length of the input.
+
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from concept_graph import ConceptGraph
+from knn_graph import DEFAULT_SIMILARITY_THRESHOLD, effective_top_k, topk_edges
+from metrics import stage_timer
+
+STREAMING_THRESHOLD_CHARS = int(os.environ.get('ALCHEMIST_STREAMING_THRESHOLD_CHARS', '5000'))
+STREAM_CHUNK_CHARS = int(os.environ.get('ALCHEMIST_STREAM_CHUNK_CHARS', '2000'))
+MAX_INPUT_CHARS = int(os.environ.get('ALCHEMIST_MAX_INPUT_CHARS', '200000'))
+MAX_TERMS = int(os.environ.get('ALCHEMIST_MAX_TERMS', '200'))
+MAX_EDGES = int(os.environ.get('ALCHEMIST_MAX_EDGES', '2000'))
+ENCODE_BATCH_SIZE = int(os.environ.get('ALCHEMIST_ENCODE_BATCH_SIZE', '64'))
+# 'frequency' keeps the most frequent terms; 'centrality' encodes a larger candidate pool
+# and keeps the terms with the highest weighted degree in the similarity graph
+TERM_RANKING = os.environ.get('ALCHEMIST_TERM_RANKING', 'frequency')
+CENTRALITY_POOL_FACTOR = 2
+
+STOP_TERMS = {"i", "you", "he", "she", "it", "we", "they", "me", "him", "her", "us", "them"}
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+
+def is_key_term(term):
+    return len(term.split()) > 0 and len(term) > 2 and term not in STOP_TERMS
+
+
+def chunk_text(text, chunk_chars=STREAM_CHUNK_CHARS):
+    """
+    Yields paragraph-sized chunks, packing whole sentences up to `chunk_chars`.
+    A single sentence longer than that is cut at the nearest space.
+    """
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        current = ''
+        for sentence in _SENTENCE_END.split(paragraph):
+            while len(sentence) > chunk_chars:
+                cut = sentence.rfind(' ', 0, chunk_chars)
+                cut = cut if cut > 0 else chunk_chars
+                if current:
+                    yield current
+                    current = ''
+                yield sentence[:cut]
+                sentence = sentence[cut:].lstrip()
+            if current and len(current) + len(sentence) + 1 > chunk_chars:
+                yield current
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            yield current
+
+
+def split_sentences(text):
+    """The sentences of `text`, on the same boundaries chunk_text packs by."""
+    return [sentence.strip() for paragraph in _PARAGRAPH_BREAK.split(text)
+            for sentence in _SENTENCE_END.split(paragraph) if sentence.strip()]
+
+
+class BoundedTermCounter:
+    """
+    Counts terms while holding at most ~2x `capacity` of them: when it overflows, it
+    keeps the `capacity` most frequent. Rare terms seen early may be dropped, which
+    is the point of the cap.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.first_seen = {}
+
+    def add(self, term):
+        if term not in self.first_seen:
+            self.first_seen[term] = len(self.first_seen)
+        self.counts[term] += 1
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        keep = dict(self.most_common(self.capacity))
+        self.counts = Counter(keep)
+        self.first_seen = {t: self.first_seen[t] for t in keep}
+
+    def most_common(self, n):
+        # Ties broken by first appearance, so the result is deterministic
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], self.first_seen[kv[0]]))[:n]
+
+
+class IncrementalGraphBuilder:
+    """
+    Adds terms batch by batch, scoring each new batch against everything seen so far
+    (one matrix product per batch) and keeping only the `max_edges` strongest edges.
+    """
+
+    def __init__(self, threshold, max_edges):
+        self.threshold = threshold
+        self.max_edges = max_edges
+        self.embeddings = None
+        self.rows = np.empty(0, dtype=np.int32)
+        self.cols = np.empty(0, dtype=np.int32)
+        self.weights = np.empty(0, dtype=np.float32)
+
+    def add_batch(self, vectors, score=True):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        offset = 0 if self.embeddings is None else len(self.embeddings)
+        self.embeddings = vectors if self.embeddings is None else np.vstack([self.embeddings, vectors])
+        if not score:
+            return
+
+        # New terms against all terms (old and new); keep j < i so each pair is seen once
+        similarities = vectors @ self.embeddings.T
+        new_index = np.arange(offset, offset + len(vectors))[:, None]
+        mask = (similarities > self.threshold) & (np.arange(len(self.embeddings))[None, :] < new_index)
+        local_rows, cols = np.nonzero(mask)
+        self._keep_strongest(
+            np.concatenate([self.rows, cols.astype(np.int32)]),
+            np.concatenate([self.cols, (local_rows + offset).astype(np.int32)]),
+            np.concatenate([self.weights, similarities[local_rows, cols].astype(np.float32)]),
+        )
+
+    def score_top_k(self, k):
+        """Replaces the edges with each term's top-k neighbours over all embeddings added so far."""
+        rows, cols, weights = topk_edges(self.embeddings, k, self.threshold)
+        self._keep_strongest(rows, cols, weights)
+
+    def _keep_strongest(self, rows, cols, weights):
+        if len(weights) > self.max_edges:
+            top = np.argpartition(-weights, self.max_edges - 1)[:self.max_edges]
+            rows, cols, weights = rows[top], cols[top], weights[top]
+        self.rows, self.cols, self.weights = rows, cols, weights
+
+    def weighted_degree(self):
+        n = 0 if self.embeddings is None else len(self.embeddings)
+        degree = np.zeros(n, dtype=np.float64)
+        np.add.at(degree, self.rows, self.weights)
+        np.add.at(degree, self.cols, self.weights)
+        return degree
+
+    def subgraph(self, keep):
+        """Restricts the graph to the term indices in `keep`, renumbered in that order."""
+        remap = np.full(len(self.embeddings), -1, dtype=np.int64)
+        remap[np.asarray(keep)] = np.arange(len(keep))
+        both = (remap[self.rows] >= 0) & (remap[self.cols] >= 0)
+        self.rows = remap[self.rows[both]].astype(np.int32)
+        self.cols = remap[self.cols[both]].astype(np.int32)
+        self.weights = self.weights[both]
+        self.embeddings = self.embeddings[np.asarray(keep)]
+
+    def to_concept_graph(self, terms):
+        return ConceptGraph(terms, self.rows, self.cols, self.weights, embeddings=self.embeddings).sorted_by_weight()
+
+
+def map_concepts_streaming(text_input, nlp, encoder, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, top_k=None,
+                           max_terms=MAX_TERMS, max_edges=MAX_EDGES, batch_size=ENCODE_BATCH_SIZE,
+                           ranking=TERM_RANKING):
+    if len(text_input) > MAX_INPUT_CHARS:
+        print(f"Input of {len(text_input)} characters truncated to {MAX_INPUT_CHARS} for concept mapping.")
+        text_input = text_input[:MAX_INPUT_CHARS]
+
+    pool_size = max_terms * CENTRALITY_POOL_FACTOR if ranking == 'centrality' else max_terms
+    counter = BoundedTermCounter(pool_size)
+    with stage_timer("spacy"):
+        for doc in nlp.pipe(chunk_text(text_input), batch_size=8):
+            for chunk in doc.noun_chunks:
+                term = chunk.text.lower()
+                if is_key_term(term):
+                    counter.add(term)
+
+    key_terms = [term for term, _ in counter.most_common(pool_size)]
+    if not key_terms:
+        return ConceptGraph.empty(), []
+
+    top_k = effective_top_k(len(key_terms), top_k)
+    builder = IncrementalGraphBuilder(similarity_threshold, max_edges)
+    for start in range(0, len(key_terms), batch_size):
+        batch = key_terms[start:start + batch_size]
+        with stage_timer("encode"):
+            vectors = encoder.encode(batch, batch_size=batch_size, normalize_embeddings=True)
+        with stage_timer("similarity"):
+            # In top-k mode the neighbours are only known once every term is in
+            builder.add_batch(vectors, score=top_k is None)
+    if top_k:
+        with stage_timer("similarity"):
+            builder.score_top_k(top_k)
+
+    if len(key_terms) > max_terms:
+        # Centrality ranking: keep the best-connected terms of the candidate pool
+        keep = np.argsort(-builder.weighted_degree(), kind='stable')[:max_terms]
+        keep = np.sort(keep)
+        builder.subgraph(keep)
+        key_terms = [key_terms[i] for i in keep.tolist()]
+
+    return builder.to_concept_graph(key_terms), key_terms
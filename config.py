@@ -0,0 +1,9 @@
+# config.py
+#
+# Settings shared by the app (alchemist_core.py) and code that must not import it,
+# such as the gunicorn hooks in gunicorn.conf.py, which run in the master process.
+
+import os
+
+# The main SQLite database; the LLM scheduler keeps its own next to it (llm_scheduler.py)
+DATABASE = os.environ.get('ALCHEMIST_DATABASE', 'alchemist_sessions.db')
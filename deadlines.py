@@ -0,0 +1,142 @@
+# deadlines.py
+#
+# Per-request time budget for the analysis pipeline. A Deadline is created when POST /
+# arrives and handed down through run_analysis to every Ollama call; once it expires
+# (or the browser reports it has gone away) outstanding generations are abandoned
+# and the remaining prompts fall back to their templates.
+#
+# Browser cancellations arrive as a beacon that may land on a different gunicorn
+# worker than the one running the request, so they go through SQLite.
+
+import os
+import sqlite3
+import threading
+import time
+
+# --- Deadline Configuration ---
+# 0 disables the deadline
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('ALCHEMIST_REQUEST_DEADLINE_SECONDS', '8'))
+# How often a running request looks for a cancellation from the browser
+CANCEL_POLL_INTERVAL = 0.25
+CANCEL_RETENTION_SECONDS = 3600
+
+
+class Deadline:
+    def __init__(self, seconds=None, cancel_check=None):
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds if seconds else None
+        self._cancel_check = cancel_check
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._last_checked = 0.0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        if self._cancelled.is_set():
+            return True
+        if self._cancel_check is None:
+            return False
+        # Several threads (concurrent agitation calls) poll this; only one hits the database at a time
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_checked >= CANCEL_POLL_INTERVAL:
+                self._last_checked = now
+                if self._cancel_check():
+                    self._cancelled.set()
+        return self._cancelled.is_set()
+
+    @property
+    def timed_out(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def expired(self):
+        return self.timed_out or self.cancelled
+
+    def remaining(self):
+        """Seconds left, or None when there is no time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+
+def request_deadline(cancel_check=None):
+    return Deadline(REQUEST_DEADLINE_SECONDS or None, cancel_check)
+
+
+class StepDeadline(Deadline):
+    """
+    A per-step budget inside a parent deadline. Its clock starts at start() (for an
+    LLM call, once the scheduler grants a slot); until then it expires only with its
+    parent.
+    """
+
+    def __init__(self, parent, seconds):
+        super().__init__(None, cancel_check=lambda: parent.cancelled)
+        self.parent = parent
+        self.seconds = seconds
+        self.expires_at = parent.expires_at
+
+    def start(self):
+        self.started_at = time.monotonic()
+        expires_at = self.started_at + self.seconds
+        self.expires_at = expires_at if self.parent.expires_at is None else min(expires_at, self.parent.expires_at)
+
+
+def budget_deadline(parent, seconds):
+    """
+    A StepDeadline of `seconds` within `parent`. Callers without a time limit
+    (queued jobs, pregeneration) have nothing to budget against, so they get
+    `parent` back unchanged, as they do when `seconds` is None.
+    """
+    if not seconds or parent is None or parent.expires_at is None:
+        return parent
+    return StepDeadline(parent, seconds)
+
+
+# --- Cancellation via SQLite ---
+def init_cancel_tables(cursor):
+    """
+    Creates the request_cancellations table. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS request_cancellations (
+             request_id TEXT NOT NULL,
+             user_id INTEGER NOT NULL,
+             cancelled_at REAL NOT NULL,
+             PRIMARY KEY (request_id, user_id)
+         )
+     ''')
+
+
+def cancel_request(database, user_id, request_id):
+    now = time.time()
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        conn.execute('INSERT OR IGNORE INTO request_cancellations (request_id, user_id, cancelled_at) VALUES (?, ?, ?)',
+                     (request_id, user_id, now))
+        conn.execute('DELETE FROM request_cancellations WHERE cancelled_at < ?', (now - CANCEL_RETENTION_SECONDS,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def is_request_cancelled(database, user_id, request_id):
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        row = conn.execute('SELECT 1 FROM request_cancellations WHERE request_id = ? AND user_id = ?',
+                           (request_id, user_id)).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def cancel_checker(database, user_id, request_id):
+    if not request_id:
+        return None
+    return lambda: is_request_cancelled(database, user_id, request_id)
@@ -0,0 +1,308 @@
+# embedding_store.py
+#
+# Compact on-disk store for normalised embeddings: one contiguous memory-mapped array
+# per store, quantised to int8 (with a float32 scale per row) or float16, and
+# optionally reduced in dimension first: PCA fitted on a sample, or plain truncation
+# for Matryoshka-trained encoders (all-MiniLM-L6-v2 is not one, so use PCA with it).
+# Every process maps the same files, so the vectors sit in the page cache once rather
+# than once per gunicorn worker. Search streams through them in cache-sized blocks:
+# each block is widened to float32 into a reused buffer and scored against the whole
+# query batch with one BLAS matrix product (numpy has no BLAS kernel for int8 or
+# float16 products, and widening a block that stays in L2 costs less than the
+# memory traffic a float32 copy of every vector would).
+#
+#   bytes per 384-d vector:  float32 1536 | float16 768 | int8 388 | pca128 + int8 132
+#
+# Appends from several processes are serialised with a file lock; readers pick up new
+# rows on their next search. Rows are never removed one by one: compact() rewrites the
+# store with the rows still wanted, renumbered, and bumps the store's generation so
+# every process remaps the new files (maps of the old ones stay valid until then). benchmarks/bench_embedding_store.py measures recall@k
+# against exact float32 search, memory per million vectors and query latency.
+#
+#   store = EmbeddingStore('embeddings/terms', input_dim=384, quantization='int8', reduce_dim=128)
+#   store.fit_reduction(sample)          # PCA only, before the first add
+#   rows = store.add(vectors)
+#   scores, rows = store.search(queries, k=10)
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+REDUCTIONS = ('pca', 'truncate')
+# Size of the float32 block scored per matrix product; much larger and the widened
+# block falls out of cache before the product reads it
+SEARCH_BLOCK_BYTES = int(os.environ.get('ALCHEMIST_SEARCH_BLOCK_BYTES', str(2 * 2 ** 20)))
+INITIAL_CAPACITY = 1024
+
+
+def _normalise(vectors):
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+class EmbeddingStore:
+    def __init__(self, path, input_dim=None, quantization='int8', reduce_dim=None, reduction='pca'):
+        """
+        Opens the store in directory `path`, creating it with these settings if it
+        doesn't exist yet (an existing store keeps the settings it was created with).
+        """
+        self.path = path
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            if input_dim is None:
+                raise ValueError(f"No embedding store at '{path}'; input_dim is needed to create one.")
+            if quantization not in QUANTIZATIONS:
+                raise ValueError(f"Unknown quantization '{quantization}' (expected one of {', '.join(QUANTIZATIONS)}).")
+            if reduce_dim is not None and reduction not in REDUCTIONS:
+                raise ValueError(f"Unknown reduction '{reduction}' (expected one of {', '.join(REDUCTIONS)}).")
+            os.makedirs(path, exist_ok=True)
+            with self._locked():
+                if not os.path.exists(meta_path):
+                    self._write_meta({
+                        'input_dim': input_dim,
+                        'dim': reduce_dim or input_dim,
+                        'quantization': quantization,
+                        'reduction': reduction if reduce_dim else None,
+                        'fitted': not reduce_dim or reduction == 'truncate',
+                        'count': 0,
+                        'capacity': 0,
+                        'generation': 0,
+                    })
+        self._meta_mtime = None
+        self._mapped_generation = None
+        self.vectors = None
+        self.scales = None
+        self._mapped_capacity = 0
+        self.refresh()
+
+    # --- files ---
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._file('lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_meta(self, meta):
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file('meta.json'))
+
+    def _read_meta(self):
+        with open(self._file('meta.json')) as f:
+            return json.load(f)
+
+    def refresh(self):
+        """Picks up rows added by other processes since the last call."""
+        mtime = os.stat(self._file('meta.json')).st_mtime_ns
+        if mtime == self._meta_mtime:
+            return
+        meta = self._read_meta()
+        self._meta_mtime = mtime
+        self.input_dim, self.dim = meta['input_dim'], meta['dim']
+        self.quantization, self.reduction, self.fitted = meta['quantization'], meta['reduction'], meta['fitted']
+        self.count, capacity = meta['count'], meta['capacity']
+        self.generation = meta.get('generation', 0)
+        if self.reduction == 'pca' and self.fitted and not hasattr(self, 'pca_mean'):
+            with np.load(self._file('pca.npz')) as pca:
+                self.pca_mean, self.pca_components = pca['mean'], pca['components']
+        if capacity != self._mapped_capacity or self.generation != self._mapped_generation:
+            self._map(capacity)
+
+    def _map(self, capacity):
+        self._mapped_capacity = capacity
+        self._mapped_generation = self.generation
+        if not capacity:
+            self.vectors = np.empty((0, self.dim), dtype=self.quantization)
+            self.scales = np.empty(0, dtype=np.float32)
+            return
+        self.vectors = np.memmap(self._file('vectors.bin'), dtype=self.quantization, mode='r',
+                                 shape=(capacity, self.dim))
+        if self.quantization == 'int8':
+            self.scales = np.memmap(self._file('scales.bin'), dtype=np.float32, mode='r', shape=(capacity,))
+
+    @property
+    def bytes_per_vector(self):
+        return self.dim * np.dtype(self.quantization).itemsize + (4 if self.quantization == 'int8' else 0)
+
+    # --- encoding ---
+    def fit_reduction(self, sample):
+        """Fits the PCA projection on `sample` (n x input_dim, n >= reduce_dim); once, before the first add."""
+        if self.reduction != 'pca' or self.fitted:
+            return
+        sample = np.asarray(sample, dtype=np.float32)
+        if len(sample) < self.dim:
+            raise ValueError(f"PCA to {self.dim} dimensions needs at least {self.dim} sample vectors.")
+        mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        with self._locked():
+            np.savez(self._file('pca.npz'), mean=mean, components=vt[:self.dim].astype(np.float32))
+            meta = self._read_meta()
+            meta['fitted'] = True
+            self._write_meta(meta)
+        self.refresh()
+
+    def project(self, vectors):
+        """Input-space vectors -> normalised float32 vectors in the store's space."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.reduction == 'pca':
+            if not self.fitted:
+                raise ValueError("The PCA reduction has to be fitted (fit_reduction) before use.")
+            vectors = (vectors - self.pca_mean) @ self.pca_components.T
+        elif self.reduction == 'truncate':
+            vectors = vectors[:, :self.dim]
+        return _normalise(vectors)
+
+    def _quantise(self, vectors):
+        if self.quantization != 'int8':
+            return vectors.astype(self.quantization), None
+        # Symmetric per-row scale: row ~= scale * codes
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    # --- writing ---
+    def add(self, vectors):
+        """Appends input-space vectors and returns their row numbers."""
+        return self.append(vectors)[1]
+
+    def append(self, vectors):
+        """
+        Appends input-space vectors and returns (generation, rows): row numbers only
+        hold within the generation they were added in (see compact).
+        """
+        codes, scales = self._quantise(self.project(vectors))
+        with self._locked():
+            meta = self._read_meta()
+            start, capacity = meta['count'], meta['capacity']
+            stop = start + len(codes)
+            if stop > capacity:
+                capacity = max(INITIAL_CAPACITY, capacity * 2, stop)
+                # Growing the files leaves the rows already written (and other processes' maps) as they are
+                with open(self._file('vectors.bin'), 'ab') as f:
+                    f.truncate(capacity * self.dim * codes.itemsize)
+                if scales is not None:
+                    with open(self._file('scales.bin'), 'ab') as f:
+                        f.truncate(capacity * 4)
+            target = np.memmap(self._file('vectors.bin'), dtype=self.quantization, mode='r+',
+                               shape=(capacity, self.dim))
+            target[start:stop] = codes
+            target.flush()
+            if scales is not None:
+                target_scales = np.memmap(self._file('scales.bin'), dtype=np.float32, mode='r+', shape=(capacity,))
+                target_scales[start:stop] = scales
+                target_scales.flush()
+            meta.update(count=stop, capacity=capacity)
+            self._write_meta(meta)
+        self.refresh()
+        return meta.get('generation', 0), np.arange(start, stop)
+
+    def compact(self, keep, on_compacted=None):
+        """
+        Rewrites the store with only the rows `keep(generation, count)` returns, renumbered
+        0, 1, ... in that order, as the next generation. Both callbacks run with the
+        store locked, so nothing is appended meanwhile; `on_compacted(generation)` runs
+        before the new files replace the old, so the caller can record the new
+        numbering first (if it raises, the store is left as it was). Returns the new
+        generation.
+        """
+        with self._locked():
+            meta = self._read_meta()
+            rows = np.asarray(keep(meta.get('generation', 0), meta['count']), dtype=np.int64)
+            if len(rows) and (rows.min() < 0 or rows.max() >= meta['count']):
+                raise ValueError("compact() was given rows the store doesn't have.")
+            capacity = max(INITIAL_CAPACITY, len(rows))
+            generation = meta.get('generation', 0) + 1
+            files = [('vectors.bin', self.quantization, (self.dim,))]
+            if self.quantization == 'int8':
+                files.append(('scales.bin', np.float32, ()))
+            try:
+                for name, dtype, row_shape in files:
+                    # The stored codes are copied as they are, so nothing is quantised twice
+                    target = np.memmap(self._file(name + '.tmp'), dtype=dtype, mode='w+',
+                                       shape=(capacity,) + row_shape)
+                    if len(rows):
+                        source = np.memmap(self._file(name), dtype=dtype, mode='r',
+                                           shape=(meta['capacity'],) + row_shape)
+                        target[:len(rows)] = source[rows]
+                    target.flush()
+                    del target
+                if on_compacted is not None:
+                    on_compacted(generation)
+            except BaseException:
+                for name, *_ in files:
+                    if os.path.exists(self._file(name + '.tmp')):
+                        os.remove(self._file(name + '.tmp'))
+                raise
+            for name, *_ in files:
+                os.replace(self._file(name + '.tmp'), self._file(name))
+            meta.update(count=len(rows), capacity=capacity, generation=generation)
+            self._write_meta(meta)
+        self.refresh()
+        return generation
+
+    # --- reading ---
+    def get(self, rows):
+        """The stored vectors for `rows`, dequantised to float32 (in the store's space)."""
+        self.refresh()
+        rows = np.asarray(rows)
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.quantization == 'int8':
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def search(self, queries, k=10, rows=None):
+        """
+        The k best rows by dot product for each query (input-space vectors), as
+        (scores, rows) arrays of shape (queries, k), best first. `rows` restricts the
+        search to those row numbers.
+        """
+        self.refresh()
+        queries = self.project(queries)
+        n = self.count if rows is None else len(rows)
+        k = min(k, n)
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+
+        block_rows_max = max(256, SEARCH_BLOCK_BYTES // (4 * self.dim))
+        widen = self.quantization != 'float32'
+        buffer = np.empty((min(block_rows_max, n), self.dim), dtype=np.float32) if widen else None
+        kept_scores, kept_rows = [], []
+        for start in range(0, n, block_rows_max):
+            stop = min(start + block_rows_max, n)
+            block_rows = None if rows is None else np.asarray(rows[start:stop])
+            codes = self.vectors[start:stop] if rows is None else self.vectors[block_rows]
+            if widen:
+                block = buffer[:stop - start]
+                np.copyto(block, codes, casting='unsafe')
+            else:
+                block = codes
+            scores = queries @ block.T
+            if self.quantization == 'int8':
+                scores *= self.scales[start:stop] if rows is None else self.scales[block_rows]
+
+            # Each block's own top k; the blocks' winners are merged once at the end
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            kept_scores.append(scores)
+            kept_rows.append(top + start if rows is None else block_rows[top])
+
+        best_scores, best_rows = np.concatenate(kept_scores, axis=1), np.concatenate(kept_rows, axis=1)
+        if best_scores.shape[1] > k:
+            top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
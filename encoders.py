@@ -0,0 +1,108 @@
+# encoders.py
+#
+# Sentence encoder backends behind one `encode()` interface. The default runs the
+# SentenceTransformer in PyTorch; the ONNX backend runs an exported graph (see
+# export_onnx_encoder.py) with onnxruntime and the `tokenizers` library, and never
+# imports torch.
+#
+#   ALCHEMIST_ENCODER_BACKEND=onnx ALCHEMIST_ONNX_QUANTIZED=1 gunicorn alchemist_core:app
+
+import os
+
+import numpy as np
+
+ENCODER_BACKEND = os.environ.get('ALCHEMIST_ENCODER_BACKEND', 'torch')
+ONNX_MODEL_DIR = os.environ.get('ALCHEMIST_ONNX_MODEL_DIR', os.path.join('models', 'all-MiniLM-L6-v2-onnx'))
+ONNX_QUANTIZED = os.environ.get('ALCHEMIST_ONNX_QUANTIZED', '0') == '1'
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces
+MAX_SEQ_LENGTH = 256
+
+
+class TorchEncoder:
+    backend = 'torch'
+
+    def __init__(self, model_name, device=None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cuda":
+            print(f"CUDA GPU found: {torch.cuda.get_device_name(0)}. Setting model device to GPU.")
+        else:
+            print("No CUDA GPU found or configured. Setting model device to CPU.")
+        self.model = SentenceTransformer(model_name, device=device)
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False):
+        return self.model.encode(sentences, batch_size=batch_size, normalize_embeddings=normalize_embeddings,
+                                 convert_to_numpy=True, show_progress_bar=False)
+
+
+class OnnxEncoder:
+    backend = 'onnx'
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, intra_op_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_file = 'model_int8.onnx' if quantized else 'model.onnx'
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX encoder '{model_path}' not found. Export it first: python export_onnx_encoder.py")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token='[PAD]')
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # last_hidden_state is (batch, sequence, hidden); only the first two are dynamic
+        self.dim = self.session.get_outputs()[0].shape[-1]
+        self.quantized = quantized
+        print(f"ONNX encoder loaded from '{model_path}' ({'int8' if quantized else 'fp32'}).")
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not len(sentences):
+            # Same as SentenceTransformer: an empty array, not None
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        # Sort by length so each batch pads to a similar size, as SentenceTransformer does
+        order = np.argsort([-len(s) for s in sentences], kind='stable')
+        embeddings = None
+        for start in range(0, len(sentences), batch_size):
+            batch_index = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([sentences[i] for i in batch_index])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if 'token_type_ids' in self.input_names:
+                feed['token_type_ids'] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feed)[0]
+
+            # Mean pooling over real tokens, then the L2 normalisation all-MiniLM-L6-v2 ends with
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), pooled.shape[1]), dtype=np.float32)
+            embeddings[batch_index] = pooled
+
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(model_name, backend=None, threads=None):
+    backend = backend or ENCODER_BACKEND
+    if backend == 'onnx':
+        return OnnxEncoder(intra_op_threads=threads)
+    if backend == 'torch':
+        return TorchEncoder(model_name)
+    raise ValueError(f"Unknown encoder backend '{backend}' (expected 'torch' or 'onnx').")
@@ -0,0 +1,65 @@
+# export_onnx_encoder.py
+#
+# One-off export of the MiniLM encoder to ONNX for the torch-free backend in encoders.py.
+# Needs torch, transformers, onnx and onnxruntime at export time only.
+#
+#   python export_onnx_encoder.py                 # writes model.onnx, model_int8.onnx, tokenizer.json
+
+import argparse
+import os
+
+from encoders import ONNX_MODEL_DIR
+
+
+def export(model_name, out_dir, opset=17, quantize=True):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(f"sentence-transformers/{model_name}")
+    model = AutoModel.from_pretrained(f"sentence-transformers/{model_name}")
+    model.eval()
+
+    sample = tokenizer(["a sample concept", "another longer sample concept phrase"],
+                       padding=True, return_tensors='pt')
+    model_path = os.path.join(out_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample['input_ids'], sample['attention_mask'], sample['token_type_ids']),
+            model_path,
+            input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'token_type_ids': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'},
+            },
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    # The fast tokenizer's tokenizer.json is all the `tokenizers` library needs at runtime
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, 'tokenizer.json'))
+    print(f"Exported fp32 encoder to '{model_path}'.")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(out_dir, 'model_int8.onnx')
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Wrote int8 dynamically quantized encoder to '{quantized_path}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export all-MiniLM-L6-v2 to ONNX (optionally int8).")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--out', default=ONNX_MODEL_DIR)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--no-quantize', action='store_true')
+    args = parser.parse_args()
+    export(args.model, args.out, args.opset, not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# graph_clusters.py
+#
+# Cluster hierarchy for large concept graphs, so a session can be sent to the browser
+# as a small summary (one node per top-level cluster) and expanded on demand.
+#
+# Level 0 groups terms into communities with weighted label propagation; each further
+# level runs the same thing on the graph of the previous level's clusters, until at
+# most LOD_MAX_CLUSTERS remain. Each level is stored as a parent array: levels[0][term]
+# is the term's level-0 cluster, levels[1][c] is level-0 cluster c's level-1 cluster,
+# and so on.
+
+import os
+
+import numpy as np
+
+# Graphs with fewer terms than this are sent whole
+LOD_MIN_NODES = int(os.environ.get('ALCHEMIST_LOD_MIN_NODES', '150'))
+# Nodes in the top-level summary
+LOD_MAX_CLUSTERS = int(os.environ.get('ALCHEMIST_LOD_MAX_CLUSTERS', '40'))
+LABEL_PROPAGATION_ITERATIONS = 30
+MAX_LEVELS = 8
+KMEANS_ITERATIONS = 15
+
+
+def label_propagation(num_nodes, rows, cols, weights, iterations=LABEL_PROPAGATION_ITERATIONS, seed=0):
+    """
+    Weighted label propagation. Every round, each node looks at the summed edge weight
+    per neighbouring label and takes the heaviest one if it beats its current label.
+    Only a random half of the nodes may move per round, which stops two-colourable
+    structures from swapping labels forever. Returns labels numbered 0..k-1.
+    """
+    labels = np.arange(num_nodes, dtype=np.int64)
+    if num_nodes == 0 or len(weights) == 0:
+        return labels
+
+    src = np.concatenate([rows, cols]).astype(np.int64)
+    dst = np.concatenate([cols, rows]).astype(np.int64)
+    w = np.concatenate([weights, weights]).astype(np.float64)
+    rng = np.random.RandomState(seed)
+
+    for _ in range(iterations):
+        # Score of every (node, neighbouring label) pair
+        keys, inverse = np.unique(dst * num_nodes + labels[src], return_inverse=True)
+        scores = np.bincount(inverse, weights=w)
+        nodes = keys // num_nodes
+        candidates = keys % num_nodes
+
+        # Best label per node; ties go to the smaller label so the result is stable
+        order = np.lexsort((candidates, -scores, nodes))
+        first = order[np.r_[True, nodes[order][1:] != nodes[order][:-1]]]
+        best_node, best_label, best_score = nodes[first], candidates[first], scores[first]
+
+        current_keys = best_node * num_nodes + labels[best_node]
+        at = np.minimum(np.searchsorted(keys, current_keys), len(keys) - 1)
+        current_score = np.where(keys[at] == current_keys, scores[at], 0.0)
+
+        move = (best_score > current_score) & (rng.rand(len(best_node)) < 0.5)
+        if not move.any():
+            if not (best_score > current_score).any():
+                break
+            continue
+        labels[best_node[move]] = best_label[move]
+
+    return np.unique(labels, return_inverse=True)[1].astype(np.int32)
+
+
+def _coarsen(labels, rows, cols, weights):
+    """Edges between clusters, with the weights of parallel edges summed."""
+    a, b = labels[rows].astype(np.int64), labels[cols].astype(np.int64)
+    between = a != b
+    a, b, w = np.minimum(a, b)[between], np.maximum(a, b)[between], weights[between]
+    if not len(w):
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    k = int(labels.max()) + 1
+    pairs, inverse = np.unique(a * k + b, return_inverse=True)
+    return (pairs // k).astype(np.int32), (pairs % k).astype(np.int32), np.bincount(inverse, weights=w)
+
+
+def _group_by_position(centroids, sizes, k, seed=0):
+    """
+    Fallback when label propagation can't merge any further (weakly connected or
+    isolated clusters): size-weighted k-means on the cluster centroids, so nearby
+    clusters on the canvas end up together.
+    """
+    rng = np.random.RandomState(seed)
+    centers = centroids[rng.choice(len(centroids), k, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        dist = ((centroids[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        assign = dist.argmin(axis=1)
+        totals = np.bincount(assign, weights=sizes, minlength=k)
+        for dim in range(centroids.shape[1]):
+            summed = np.bincount(assign, weights=sizes * centroids[:, dim], minlength=k)
+            centers[:, dim] = np.where(totals > 0, summed / np.maximum(totals, 1e-12), centers[:, dim])
+    return np.unique(assign, return_inverse=True)[1].astype(np.int32)
+
+
+def build_hierarchy(num_nodes, rows, cols, weights, positions=None, max_clusters=LOD_MAX_CLUSTERS):
+    """Returns the list of per-level parent arrays; the last level has at most `max_clusters` clusters."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if positions is None:
+        positions = np.zeros((num_nodes, 2), dtype=np.float64)
+    else:
+        positions = np.asarray(positions, dtype=np.float64)
+
+    levels = []
+    count = num_nodes
+    sizes = np.ones(num_nodes)
+    centroids = positions
+    while count > max_clusters and len(levels) < MAX_LEVELS:
+        labels = label_propagation(count, rows, cols, weights, seed=len(levels))
+        merged = int(labels.max()) + 1 if count else 0
+        if merged > max_clusters and merged >= count * 0.9:
+            # Stalled; finish by grouping what's left by position
+            labels = _group_by_position(centroids, sizes, max_clusters, seed=len(levels))
+            merged = int(labels.max()) + 1
+        levels.append(labels)
+
+        rows, cols, weights = _coarsen(labels, rows, cols, weights)
+        new_sizes = np.bincount(labels, weights=sizes, minlength=merged)
+        centroids = np.stack([np.bincount(labels, weights=sizes * centroids[:, d], minlength=merged)
+                              for d in range(2)], axis=1) / new_sizes[:, None]
+        sizes = new_sizes
+        count = merged
+    return levels
+
+
+def ancestors(levels):
+    """Per level, the cluster each term belongs to."""
+    result = []
+    current = None
+    for parents in levels:
+        current = parents if current is None else parents[current]
+        result.append(current)
+    return result
@@ -0,0 +1,85 @@
+# graph_layout.py
+#
+# Server-side node positions for the concept graph, computed once when a session is
+# saved so the browser can draw the graph with vis.js physics switched off. This is a
+# vectorised Fruchterman-Reingold layout: the repulsion between all node pairs is one
+# (n, n, 2) array operation per iteration, and the edge attraction is a scatter-add
+# over the COO edge arrays. A fixed seed makes a given graph always come out the same.
+
+import os
+
+import numpy as np
+
+LAYOUT_ITERATIONS = int(os.environ.get('ALCHEMIST_LAYOUT_ITERATIONS', '60'))
+# Above this many nodes, each iteration repels against a random sample of nodes
+# instead of all of them, so the cost stays O(n * sample) rather than O(n^2)
+LAYOUT_EXACT_MAX_NODES = int(os.environ.get('ALCHEMIST_LAYOUT_EXACT_MAX_NODES', '1000'))
+LAYOUT_REPULSION_SAMPLE = 400
+# Roughly the vis.js springLength, in canvas pixels
+NODE_SPACING = 100.0
+# Pull towards the centre so disconnected terms don't drift off the canvas
+GRAVITY = 0.05
+
+
+def compute_layout(num_nodes, rows, cols, weights, iterations=LAYOUT_ITERATIONS, seed=0):
+    """
+    Returns a (num_nodes, 2) float32 array of x/y positions in vis.js canvas units,
+    centred on the origin.
+    """
+    if num_nodes == 0:
+        return np.empty((0, 2), dtype=np.float32)
+    if num_nodes == 1:
+        return np.zeros((1, 2), dtype=np.float32)
+
+    rng = np.random.RandomState(seed)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    # Unit square layout; k is the ideal distance between neighbours
+    pos = rng.rand(num_nodes, 2).astype(np.float32) - 0.5
+    k = np.float32(1.0 / np.sqrt(num_nodes))
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    exact = num_nodes <= LAYOUT_EXACT_MAX_NODES
+
+    for _ in range(iterations):
+        # Repulsion: k^2 / d along each pair's direction
+        if exact:
+            others = pos
+            scale = 1.0
+        else:
+            sample = rng.choice(num_nodes, LAYOUT_REPULSION_SAMPLE, replace=False)
+            others = pos[sample]
+            scale = num_nodes / LAYOUT_REPULSION_SAMPLE
+        # x and y handled as separate (n, m) planes; much faster than one (n, m, 2) array
+        dx = pos[:, 0, None] - others[None, :, 0]
+        dy = pos[:, 1, None] - others[None, :, 1]
+        strength = dx * dx
+        strength += dy * dy
+        np.maximum(strength, 1e-6, out=strength)
+        np.divide(k * k * scale, strength, out=strength)
+        displacement = np.stack([(dx * strength).sum(axis=1), (dy * strength).sum(axis=1)], axis=1)
+
+        # Attraction: d^2 / k along each edge, scaled by similarity
+        if len(weights):
+            edge_delta = pos[rows] - pos[cols]
+            edge_dist = np.sqrt(np.einsum('ij,ij->i', edge_delta, edge_delta))
+            pull = edge_delta * (edge_dist * weights / k)[:, None]
+            np.subtract.at(displacement, rows, pull)
+            np.add.at(displacement, cols, pull)
+
+        displacement -= GRAVITY * pos * num_nodes * k
+
+        # Move each node at most `temperature`, which shrinks every iteration
+        length = np.sqrt(np.einsum('ij,ij->i', displacement, displacement))
+        np.maximum(length, 1e-9, out=length)
+        pos += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.mean(axis=0)
+    extent = np.abs(pos).max()
+    if extent > 0:
+        # Spread so neighbouring nodes end up about NODE_SPACING pixels apart
+        pos *= (NODE_SPACING * np.sqrt(num_nodes) / 2) / extent
+    return pos.astype(np.float32)
@@ -0,0 +1,55 @@
+# gunicorn.conf.py
+#
+# Picked up automatically by `gunicorn alchemist_core:app` (see Procfile).
+
+import os
+import shutil
+import tempfile
+
+import thread_budget
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+# Threaded workers: requests mostly wait on Ollama, and their spaCy/encoder calls are
+# queued onto the worker's inference threads (model_access.py). GUNICORN_WORKER_CLASS=sync
+# goes back to one request per process.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Each worker writes its metric samples here and /metrics aggregates them.
+# Must be in the environment before prometheus_client is imported by the app.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'alchemist_metrics'))
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be summed into the new one.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # Runs in the master: give the new worker the lowest CPU slot no live worker holds,
+    # so a restarted worker takes over the cores of the one it replaces.
+    taken = {getattr(w, 'cpu_slot', None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    os.environ['ALCHEMIST_BUDGET_WORKERS'] = str(server.num_workers)
+    thread_budget.apply_env_budget()
+    pinned = thread_budget.pin_to_cores(worker.cpu_slot)
+    if pinned is not None:
+        server.log.info("Worker %s (slot %s) pinned to CPUs %s", worker.pid, worker.cpu_slot, pinned)
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    import admission
+    import config
+    import llm_scheduler
+    mark_process_dead(worker.pid)
+    # A worker killed mid-request (e.g. by the timeout) would otherwise hold its LLM slots
+    # and admissions until their leases expire
+    llm_scheduler.release_process(config.DATABASE, worker.pid)
+    admission.release_process(config.DATABASE, worker.pid)
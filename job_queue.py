@@ -0,0 +1,274 @@
+# job_queue.py
+
+import json
+import os
+import sqlite3
+import time
+
+# --- Job Queue Configuration ---
+JOB_LEASE_SECONDS = int(os.environ.get('ALCHEMIST_JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('ALCHEMIST_JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BASE_DELAY = float(os.environ.get('ALCHEMIST_JOB_RETRY_DELAY', '5'))
+
+
+def init_job_tables(cursor):
+    """
+    Creates the jobs table. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS jobs (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id INTEGER NOT NULL,
+             kind TEXT NOT NULL DEFAULT 'analysis',
+             payload TEXT NOT NULL,
+             status TEXT NOT NULL DEFAULT 'queued',
+             attempts INTEGER NOT NULL DEFAULT 0,
+             max_attempts INTEGER NOT NULL,
+             worker_id TEXT,
+             lease_expires_at REAL,
+             available_at REAL NOT NULL,
+             enqueued_at REAL NOT NULL,
+             started_at REAL,
+             finished_at REAL,
+             session_id INTEGER,
+             result TEXT,
+             error TEXT,
+             FOREIGN KEY (user_id) REFERENCES users (id)
+         )
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at);
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs (user_id);
+     ''')
+
+
+def _connect(database):
+    # isolation_level=None lets us issue BEGIN IMMEDIATE ourselves, so a claim
+    # takes the write lock before reading and two workers never grab the same job.
+    conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def enqueue_job(database, user_id, payload, kind='analysis', max_attempts=None):
+    now = time.time()
+    conn = _connect(database)
+    try:
+        cursor = conn.execute(
+            'INSERT INTO jobs (user_id, kind, payload, status, max_attempts, available_at, enqueued_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (user_id, kind, json.dumps(payload), 'queued', max_attempts or JOB_MAX_ATTEMPTS, now, now)
+        )
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def _reclaim_expired(conn, now):
+    """
+    Returns jobs whose worker stopped renewing its lease (crashed or hung) to the queue,
+    or fails them outright once they have used up their attempts.
+    """
+    conn.execute(
+        "UPDATE jobs SET status = 'failed', worker_id = NULL, finished_at = ?, "
+        "error = COALESCE(error, 'Worker lease expired too many times.') "
+        "WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts",
+        (now, now)
+    )
+    reclaimed = conn.execute(
+        "UPDATE jobs SET status = 'queued', worker_id = NULL, lease_expires_at = NULL, available_at = ? "
+        "WHERE status = 'running' AND lease_expires_at < ?",
+        (now, now)
+    ).rowcount
+    return reclaimed
+
+
+def claim_job(database, worker_id, lease_seconds=None):
+    """
+    Atomically claims the oldest available job for `worker_id`.
+    Returns the job as a dict, or None when the queue is empty.
+    """
+    lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+    now = time.time()
+    conn = _connect(database)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        reclaimed = _reclaim_expired(conn, now)
+        if reclaimed:
+            print(f"Job queue: reclaimed {reclaimed} job(s) from expired worker leases.")
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+            "lease_expires_at = ?, started_at = ? WHERE id = ?",
+            (worker_id, now + lease_seconds, now, row['id'])
+        )
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['attempts'] += 1
+    job['started_at'] = now
+    return job
+
+
+def renew_lease(database, job_id, worker_id, lease_seconds=None):
+    """
+    Extends the lease on a running job. Returns False if the job is no longer ours
+    (it was reclaimed after the lease ran out), in which case the worker should stop.
+    """
+    lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+    conn = _connect(database)
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (time.time() + lease_seconds, job_id, worker_id)
+        )
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def complete_job(database, job_id, worker_id, session_id, result):
+    conn = _connect(database)
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, session_id = ?, result = ?, "
+            "lease_expires_at = NULL, error = NULL WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (time.time(), session_id, json.dumps(result), job_id, worker_id)
+        )
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def fail_job(database, job_id, worker_id, error):
+    """
+    Records a failed attempt. The job is re-queued with exponential backoff until
+    it has used max_attempts, after which it is marked failed for good.
+    """
+    now = time.time()
+    conn = _connect(database)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (job_id, worker_id)
+        ).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        if row['attempts'] >= row['max_attempts']:
+            status = 'failed'
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, worker_id = NULL, "
+                "lease_expires_at = NULL WHERE id = ?",
+                (now, error, job_id)
+            )
+        else:
+            status = 'queued'
+            delay = JOB_RETRY_BASE_DELAY * (2 ** (row['attempts'] - 1))
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, error = ?, worker_id = NULL, "
+                "lease_expires_at = NULL WHERE id = ?",
+                (now + delay, error, job_id)
+            )
+        conn.execute('COMMIT')
+        return status
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def get_job(database, job_id, user_id):
+    conn = _connect(database)
+    try:
+        row = conn.execute(
+            'SELECT id, status, attempts, max_attempts, enqueued_at, started_at, finished_at, session_id, result, error '
+            'FROM jobs WHERE id = ? AND user_id = ?',
+            (job_id, user_id)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    job = {
+        'job_id': row['id'],
+        'status': row['status'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'session_id': row['session_id'],
+    }
+    if row['status'] == 'queued':
+        job['queue_position'] = _queue_position(database, row['id'])
+    if row['status'] == 'done':
+        job['result'] = json.loads(row['result'])
+    if row['error']:
+        job['error'] = row['error']
+    return job
+
+
+def _queue_position(database, job_id):
+    conn = _connect(database)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?", (job_id,)
+        ).fetchone()[0] + 1
+    finally:
+        conn.close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return round(values[index], 3)
+
+
+def queue_stats(database, window_seconds=3600):
+    """
+    Queue depth by status plus wait/run latency percentiles for jobs finished
+    in the last `window_seconds`.
+    """
+    now = time.time()
+    conn = _connect(database)
+    try:
+        depth = {row['status']: row['count'] for row in conn.execute(
+            'SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+        oldest = conn.execute(
+            "SELECT MIN(enqueued_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        expired_leases = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lease_expires_at < ?", (now,)).fetchone()[0]
+        recent = conn.execute(
+            "SELECT enqueued_at, started_at, finished_at FROM jobs "
+            "WHERE status = 'done' AND finished_at >= ?", (now - window_seconds,)).fetchall()
+    finally:
+        conn.close()
+
+    wait_times = [r['started_at'] - r['enqueued_at'] for r in recent]
+    total_times = [r['finished_at'] - r['enqueued_at'] for r in recent]
+    return {
+        'depth': {status: depth.get(status, 0) for status in ('queued', 'running', 'done', 'failed')},
+        'oldest_queued_age_seconds': round(now - oldest, 3) if oldest else 0,
+        'expired_leases': expired_leases,
+        'completed_in_window': len(recent),
+        'window_seconds': window_seconds,
+        'wait_seconds': {'p50': _percentile(wait_times, 50), 'p95': _percentile(wait_times, 95)},
+        'total_seconds': {'p50': _percentile(total_times, 50), 'p95': _percentile(total_times, 95)},
+    }
@@ -0,0 +1,73 @@
+# knn_graph.py
+#
+# Sparse top-k similarity graph. Instead of every pair above the threshold (O(n^2)
+# edges), each term keeps only its k most similar terms above the threshold. Rows are
+# scored in blocks against all embeddings, so peak memory is block_size x n for the
+# scores plus O(n*k) for the result.
+
+import os
+
+import numpy as np
+
+DEFAULT_SIMILARITY_THRESHOLD = float(os.environ.get('ALCHEMIST_SIMILARITY_THRESHOLD', '0.4'))
+# Graphs with more terms than this switch to top-k mode when the request doesn't choose
+AUTO_SPARSE_MIN_TERMS = int(os.environ.get('ALCHEMIST_AUTO_SPARSE_MIN_TERMS', '300'))
+DEFAULT_TOP_K = int(os.environ.get('ALCHEMIST_DEFAULT_TOP_K', '10'))
+MAX_TOP_K = 100
+KNN_BLOCK_SIZE = int(os.environ.get('ALCHEMIST_KNN_BLOCK_SIZE', '1024'))
+
+
+def effective_top_k(n_terms, top_k=None):
+    if top_k:
+        return top_k
+    if n_terms > AUTO_SPARSE_MIN_TERMS:
+        return DEFAULT_TOP_K
+    return None
+
+
+def topk_edges(embeddings, k, threshold=DEFAULT_SIMILARITY_THRESHOLD, block_size=KNN_BLOCK_SIZE):
+    """
+    Returns (rows, cols, weights) with rows < cols: the union of every term's top-k
+    neighbours whose similarity is above `threshold`. `embeddings` must be L2-normalised.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    n = len(embeddings)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.float32)
+
+    found_rows, found_cols, found_weights = [], [], []
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        scores = embeddings[start:stop] @ embeddings.T
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf  # no self-loops
+        neighbours = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+        weights = np.take_along_axis(scores, neighbours, axis=1)
+        keep = weights > threshold
+        block_rows = np.broadcast_to(np.arange(start, stop)[:, None], neighbours.shape)
+        found_rows.append(block_rows[keep])
+        found_cols.append(neighbours[keep])
+        found_weights.append(weights[keep])
+
+    rows = np.concatenate(found_rows)
+    cols = np.concatenate(found_cols)
+    weights = np.concatenate(found_weights).astype(np.float32)
+    # i->j and j->i both appear when each is in the other's top k; keep one
+    lo, hi = np.minimum(rows, cols), np.maximum(rows, cols)
+    _, unique = np.unique(lo.astype(np.int64) * n + hi, return_index=True)
+    return lo[unique].astype(np.int32), hi[unique].astype(np.int32), weights[unique]
+
+
+def similarity_edges(embeddings, threshold=DEFAULT_SIMILARITY_THRESHOLD, top_k=None):
+    """
+    (rows, cols, weights) with rows < cols for L2-normalised `embeddings`: every pair
+    above `threshold`, or the sparse top-k graph when `top_k` is set or the number of
+    terms calls for it (see effective_top_k).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    top_k = effective_top_k(len(embeddings), top_k)
+    if top_k:
+        return topk_edges(embeddings, top_k, threshold)
+    similarities = embeddings @ embeddings.T
+    rows, cols = np.nonzero(np.triu(similarities > threshold, k=1))
+    return rows, cols, similarities[rows, cols]
@@ -0,0 +1,251 @@
+# live_preview.py
+#
+# Live preview while the user types: key terms and graph changes, no LLM calls. The
+# (debounced) client sends the whole text along with the version it last applied,
+# and the engine keeps each document's previous state so it only works on what
+# changed:
+#
+#   - sentences are compared with the previous version and spaCy parses only the new
+#     ones (a sentence parsed before, in any document, comes from a cache)
+#   - only terms that have never been encoded go to the encoder
+#   - edges are dropped for the terms that disappeared and scored for the new terms
+#     against the current ones, never all pairs again
+#
+# An edit therefore costs about one sentence of parsing and a few rows of similarity,
+# however long the document is. Documents are held in this process; when a preview
+# lands on another gunicorn worker, or the client's version doesn't match, the reply
+# carries the full state with `reset` set.
+
+import heapq
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from concept_stream import MAX_INPUT_CHARS, is_key_term, split_sentences
+from knn_graph import DEFAULT_SIMILARITY_THRESHOLD
+
+PREVIEW_MAX_DOCUMENTS = int(os.environ.get('ALCHEMIST_PREVIEW_MAX_DOCUMENTS', '256'))
+SENTENCE_CACHE_SIZE = 20000
+TERM_CACHE_SIZE = 20000
+# Key terms listed with each preview, most frequent first
+PREVIEW_KEY_TERMS = 20
+
+
+class _LRU(OrderedDict):
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+
+    def lookup(self, key):
+        value = self.get(key)
+        if value is not None:
+            self.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.capacity:
+            self.popitem(last=False)
+
+
+class PreviewDocument:
+    """One document's sentences, term counts and graph, as of its last preview."""
+
+    def __init__(self):
+        self.version = 0
+        self.sentences = Counter()
+        self.sentence_terms = {}
+        self.term_counts = Counter()
+        # Term embeddings in rows of a growing matrix; rows of removed terms are reused
+        self.matrix = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.slots = {}
+        self.slot_terms = []
+        self.free_slots = []
+        self.neighbours = {}
+        self.edges = {}
+
+    def add_term(self, term, vector):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slot_terms[slot] = term
+        else:
+            slot = len(self.slot_terms)
+            if self.matrix is None:
+                self.matrix = np.empty((64, len(vector)), dtype=np.float32)
+                self.alive = np.zeros(64, dtype=bool)
+            elif slot == len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+                self.alive = np.concatenate([self.alive, np.zeros_like(self.alive)])
+            self.slot_terms.append(term)
+        self.matrix[slot] = vector
+        self.alive[slot] = True
+        self.slots[term] = slot
+        self.neighbours[term] = set()
+        return slot
+
+    def remove_term(self, term):
+        """Drops the term and returns the keys of the edges that went with it."""
+        slot = self.slots.pop(term)
+        self.slot_terms[slot] = None
+        self.alive[slot] = False
+        self.free_slots.append(slot)
+        removed = []
+        for other in self.neighbours.pop(term):
+            self.neighbours[other].discard(term)
+            key = _edge_key(term, other)
+            del self.edges[key]
+            removed.append(key)
+        return removed
+
+
+def _edge_key(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def _vis_node(term):
+    return {'id': term, 'label': term, 'title': term, 'shape': 'dot'}
+
+
+def _vis_edge(key, weight):
+    return {'id': '|'.join(key), 'from': key[0], 'to': key[1], 'title': f"Similarity: {weight:.2f}",
+            'width': max(1, int(weight * 4) + 1)}
+
+
+class PreviewEngine:
+    def __init__(self, nlp, encoder, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                 max_documents=PREVIEW_MAX_DOCUMENTS):
+        self.nlp = nlp
+        self.encoder = encoder
+        self.similarity_threshold = similarity_threshold
+        self.documents = _LRU(max_documents)
+        self.sentence_cache = _LRU(SENTENCE_CACHE_SIZE)
+        self.term_cache = _LRU(TERM_CACHE_SIZE)
+        # spaCy and the encoder are shared by every document in the process
+        self.lock = threading.Lock()
+
+    def _parse(self, sentences):
+        """Key terms per sentence, parsing only the sentences not in the cache."""
+        found = {}
+        missing = []
+        for sentence in sentences:
+            terms = self.sentence_cache.lookup(sentence)
+            if terms is None:
+                missing.append(sentence)
+            else:
+                found[sentence] = terms
+        for sentence, doc in zip(missing, self.nlp.pipe(missing, batch_size=16)):
+            terms = tuple({chunk.text.lower() for chunk in doc.noun_chunks if is_key_term(chunk.text.lower())})
+            self.sentence_cache.store(sentence, terms)
+            found[sentence] = terms
+        return found, len(missing)
+
+    def _vectors(self, terms):
+        vectors = {}
+        missing = []
+        for term in terms:
+            vector = self.term_cache.lookup(term)
+            if vector is None:
+                missing.append(term)
+            else:
+                vectors[term] = vector
+        if missing:
+            encoded = np.asarray(self.encoder.encode(missing, normalize_embeddings=True), dtype=np.float32)
+            for term, vector in zip(missing, encoded):
+                self.term_cache.store(term, vector)
+                vectors[term] = vector
+        return vectors, len(missing)
+
+    def update(self, key, text, base_version=None):
+        """
+        Brings document `key` up to `text` and returns the changes as vis.js node/edge
+        additions and removals, relative to `base_version` (the version the client
+        has). If that isn't the version held here, everything is sent with `reset`.
+        """
+        started = time.perf_counter()
+        text = text[:MAX_INPUT_CHARS]
+        with self.lock:
+            doc = self.documents.lookup(key)
+            reset = doc is None or base_version != doc.version
+            if doc is None:
+                doc = PreviewDocument()
+                self.documents.store(key, doc)
+
+            sentences = Counter(split_sentences(text))
+            added_sentences = sentences - doc.sentences
+            removed_sentences = doc.sentences - sentences
+            parsed, parsed_count = self._parse(list(added_sentences))
+
+            touched = set()
+            for sentence, count in removed_sentences.items():
+                for term in doc.sentence_terms[sentence]:
+                    doc.term_counts[term] -= count
+                    touched.add(term)
+            for sentence, count in added_sentences.items():
+                doc.sentence_terms[sentence] = parsed[sentence]
+                for term in parsed[sentence]:
+                    doc.term_counts[term] += count
+                    touched.add(term)
+            doc.sentences = sentences
+            for sentence in removed_sentences:
+                if sentence not in sentences:
+                    del doc.sentence_terms[sentence]
+
+            # A term that only moved between sentences is in neither list
+            removed_terms = sorted(t for t in touched if doc.term_counts[t] <= 0)
+            added_terms = sorted(t for t in touched if doc.term_counts[t] > 0 and t not in doc.slots)
+            removed_edges = []
+            for term in removed_terms:
+                del doc.term_counts[term]
+                removed_edges += doc.remove_term(term)
+
+            vectors, encoded_count = self._vectors(added_terms)
+            new_slots = np.array([doc.add_term(term, vectors[term]) for term in added_terms], dtype=np.int64)
+            added_edges = self._score(doc, new_slots)
+            doc.version += 1
+
+            if reset:
+                nodes = {'add': [_vis_node(term) for term in doc.slots], 'remove': []}
+                edges = {'add': [_vis_edge(k, w) for k, w in doc.edges.items()], 'remove': []}
+            else:
+                nodes = {'add': [_vis_node(term) for term in added_terms], 'remove': removed_terms}
+                edges = {'add': [_vis_edge(k, doc.edges[k]) for k in added_edges],
+                         'remove': ['|'.join(k) for k in removed_edges]}
+            key_terms = heapq.nlargest(PREVIEW_KEY_TERMS, doc.term_counts, key=doc.term_counts.get)
+            return {
+                'version': doc.version,
+                'reset': reset,
+                'key_terms': key_terms,
+                'nodes': nodes,
+                'edges': edges,
+                'total_nodes': len(doc.slots),
+                'total_edges': len(doc.edges),
+                'parsed_sentences': parsed_count,
+                'encoded_terms': encoded_count,
+                'seconds': round(time.perf_counter() - started, 4),
+            }
+
+    def _score(self, doc, new_slots):
+        """Edges from the new terms to every current term (each new-new pair once)."""
+        if not len(new_slots):
+            return []
+        used = len(doc.slot_terms)
+        # Position of each slot among the new terms, -1 for older terms
+        position = np.full(used, -1, dtype=np.int64)
+        position[new_slots] = np.arange(len(new_slots))
+        scores = doc.matrix[new_slots] @ doc.matrix[:used].T
+        mask = (scores > self.similarity_threshold) & doc.alive[None, :used]
+        mask &= (position[None, :] < 0) | (position[None, :] > np.arange(len(new_slots))[:, None])
+        added = []
+        for i, j in zip(*np.nonzero(mask)):
+            a, b = doc.slot_terms[new_slots[i]], doc.slot_terms[j]
+            key = _edge_key(a, b)
+            doc.edges[key] = float(scores[i, j])
+            doc.neighbours[a].add(b)
+            doc.neighbours[b].add(a)
+            added.append(key)
+        return added
@@ -0,0 +1,241 @@
+# llm_scheduler.py
+#
+# Global admission for Ollama calls, shared by every gunicorn worker and worker.py
+# process through SQLite. Each call takes a ticket and waits until the scheduler
+# grants it one of LLM_CONCURRENCY slots. Among waiting tickets, grants go by:
+#
+#   1. priority      interactive requests before background/bulk work
+#   2. fairness      the user with the fewest calls running, then the user served
+#                    longest ago, so a heavy user can't crowd out everyone else
+#   3. arrival       oldest ticket first
+#
+# No user holds more than LLM_USER_CONCURRENCY slots at once, which keeps slots free
+# for light users when a heavy one is saturating the queue.
+#
+# The tickets live in their own WAL-mode database next to the main one
+# (alchemist_sessions_llm_scheduler.db), so waiting calls never contend with
+# session, admission or job-queue writes. Waiters mostly poll with plain reads and
+# back off while nothing changes; the write lock is taken only to claim a slot or to
+# refresh the ticket's heartbeat.
+#
+#   ALCHEMIST_LLM_CONCURRENCY=0 gunicorn alchemist_core:app   # scheduler off
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import observe_llm_queue_wait
+
+# --- Scheduler Configuration ---
+# Should not exceed what the Ollama backends can run at once (see ollama_pool.py)
+LLM_CONCURRENCY = int(os.environ.get('ALCHEMIST_LLM_CONCURRENCY', '4'))
+LLM_USER_CONCURRENCY = int(os.environ.get('ALCHEMIST_LLM_USER_CONCURRENCY', str(max(1, LLM_CONCURRENCY // 2))))
+PRIORITIES = {'interactive': 0, 'background': 1}
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.2
+# How often a waiting ticket refreshes seen_at
+HEARTBEAT_INTERVAL = 2
+# How long a call without a deadline waits for a slot
+WAIT_TIMEOUT = 60
+# A granted slot older than this belongs to a call that died without releasing it
+SLOT_LEASE_SECONDS = 300
+# Waiting tickets refresh seen_at every HEARTBEAT_INTERVAL; one that has gone this
+# long without doing so has lost its process. Keep it well above HEARTBEAT_INTERVAL,
+# or a live waiter that is slow to get the write lock loses its place in the queue
+WAITER_TIMEOUT_SECONDS = 10
+
+
+_prepared = set()
+_prepare_lock = threading.Lock()
+
+
+def scheduler_database(database):
+    """The scheduler's own database file for the main `database`."""
+    base, ext = os.path.splitext(database)
+    return f"{base}_llm_scheduler{ext or '.db'}"
+
+
+def init_scheduler_database(database):
+    """Creates the scheduler database for the main `database` in WAL mode. Called from init_db()."""
+    path = scheduler_database(database)
+    with _prepare_lock:
+        if path in _prepared:
+            return
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            init_scheduler_tables(conn.cursor())
+        finally:
+            conn.close()
+        _prepared.add(path)
+
+
+def init_scheduler_tables(cursor):
+    """
+    Creates the llm_tickets and llm_user_service tables. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS llm_tickets (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id INTEGER NOT NULL,
+             priority INTEGER NOT NULL,
+             pid INTEGER NOT NULL,
+             enqueued_at REAL NOT NULL,
+             seen_at REAL NOT NULL,
+             granted_at REAL
+         )
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_llm_tickets_granted ON llm_tickets (granted_at);
+     ''')
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS llm_user_service (
+             user_id INTEGER PRIMARY KEY,
+             last_granted_at REAL NOT NULL
+         )
+     ''')
+
+
+def _connect(database):
+    # BEGIN IMMEDIATE around each scheduling decision, as in job_queue.py
+    init_scheduler_database(database)
+    return sqlite3.connect(scheduler_database(database), timeout=30, isolation_level=None)
+
+
+def _enqueue(conn, ticket, user_id, level, enqueued_at, now):
+    # `ticket` None takes a new id; an existing id re-queues a ticket in its old place
+    return conn.execute(
+        'INSERT INTO llm_tickets (id, user_id, priority, pid, enqueued_at, seen_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (ticket, user_id, level, os.getpid(), enqueued_at, now)).lastrowid
+
+
+def _expire_stale(conn, now):
+    conn.execute('DELETE FROM llm_tickets WHERE granted_at IS NOT NULL AND granted_at < ?',
+                 (now - SLOT_LEASE_SECONDS,))
+    conn.execute('DELETE FROM llm_tickets WHERE granted_at IS NULL AND seen_at < ?',
+                 (now - WAITER_TIMEOUT_SECONDS,))
+
+
+def _next_ticket(conn):
+    """The waiting ticket that should get the next free slot, or None if none can run now."""
+    running = conn.execute('SELECT COUNT(*) FROM llm_tickets WHERE granted_at IS NOT NULL').fetchone()[0]
+    if running >= LLM_CONCURRENCY:
+        return None
+    row = conn.execute('''
+        SELECT t.id FROM llm_tickets t
+        LEFT JOIN (SELECT user_id, COUNT(*) AS running FROM llm_tickets
+                   WHERE granted_at IS NOT NULL GROUP BY user_id) r ON r.user_id = t.user_id
+        LEFT JOIN llm_user_service s ON s.user_id = t.user_id
+        WHERE t.granted_at IS NULL AND COALESCE(r.running, 0) < ?
+        ORDER BY t.priority, COALESCE(r.running, 0), COALESCE(s.last_granted_at, 0), t.id
+        LIMIT 1
+    ''', (LLM_USER_CONCURRENCY,)).fetchone()
+    return row[0] if row else None
+
+
+def acquire(database, user_id, priority='interactive', deadline=None, timeout=WAIT_TIMEOUT):
+    """
+    Waits for a slot and returns the granted ticket id, or None if `deadline` (a
+    deadlines.Deadline) or `timeout` runs out first.
+    """
+    level = PRIORITIES[priority]
+    user_id = user_id or 0
+    started = time.time()
+    conn = _connect(database)
+    try:
+        ticket = _enqueue(conn, None, user_id, level, started, started)
+        last_seen = started
+        interval = POLL_INTERVAL
+        while True:
+            now = time.time()
+            granted = False
+            # A plain read most of the time; the write lock only to claim a slot or heartbeat
+            if _next_ticket(conn) == ticket or now - last_seen >= HEARTBEAT_INTERVAL:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    _expire_stale(conn, now)
+                    if conn.execute('UPDATE llm_tickets SET seen_at = ? WHERE id = ?', (now, ticket)).rowcount == 0:
+                        # Expired by another process while this one was stalled: queue again in the same place
+                        _enqueue(conn, ticket, user_id, level, started, now)
+                    last_seen = now
+                    granted = _next_ticket(conn) == ticket
+                    if granted:
+                        conn.execute('UPDATE llm_tickets SET granted_at = ? WHERE id = ?', (now, ticket))
+                        conn.execute('INSERT INTO llm_user_service (user_id, last_granted_at) VALUES (?, ?) '
+                                     'ON CONFLICT(user_id) DO UPDATE SET last_granted_at = excluded.last_granted_at',
+                                     (user_id, now))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            if granted:
+                observe_llm_queue_wait(priority, now - started, True)
+                return ticket
+
+            out_of_time = now - started >= timeout or (deadline is not None and deadline.expired())
+            if out_of_time:
+                conn.execute('DELETE FROM llm_tickets WHERE id = ?', (ticket,))
+                observe_llm_queue_wait(priority, time.time() - started, False)
+                return None
+            time.sleep(interval)
+            interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+    finally:
+        conn.close()
+
+
+def release(database, ticket):
+    conn = _connect(database)
+    try:
+        conn.execute('DELETE FROM llm_tickets WHERE id = ?', (ticket,))
+    finally:
+        conn.close()
+
+
+def release_process(database, pid):
+    """Frees every ticket held by a process that has exited (gunicorn's child_exit hook)."""
+    conn = _connect(database)
+    try:
+        conn.execute('DELETE FROM llm_tickets WHERE pid = ?', (pid,))
+    except sqlite3.OperationalError:
+        pass  # tables not created yet
+    finally:
+        conn.close()
+
+
+@contextmanager
+def llm_slot(database, user_id, priority='interactive', deadline=None):
+    """Yields True while holding a slot, or False if none was granted in time."""
+    if not LLM_CONCURRENCY:
+        yield True
+        return
+    ticket = acquire(database, user_id, priority, deadline)
+    try:
+        yield ticket is not None
+    finally:
+        if ticket is not None:
+            release(database, ticket)
+
+
+def scheduler_stats(database):
+    conn = _connect(database)
+    try:
+        rows = conn.execute('''
+            SELECT priority, granted_at IS NOT NULL, COUNT(*), COUNT(DISTINCT user_id), MIN(enqueued_at)
+            FROM llm_tickets GROUP BY priority, granted_at IS NOT NULL
+        ''').fetchall()
+    finally:
+        conn.close()
+    names = {level: name for name, level in PRIORITIES.items()}
+    now = time.time()
+    stats = {'running': {}, 'waiting': {}, 'waiting_users': {}, 'oldest_waiting_age_seconds': 0.0}
+    for level, granted, count, users, oldest in rows:
+        name = names.get(level, str(level))
+        if granted:
+            stats['running'][name] = count
+        else:
+            stats['waiting'][name] = count
+            stats['waiting_users'][name] = users
+            stats['oldest_waiting_age_seconds'] = max(stats['oldest_waiting_age_seconds'], now - oldest)
+    return stats
@@ -0,0 +1,202 @@
+# loadtest/driver.py
+#
+# Open-loop load generator for the web app. Logs in synthetic users and drives
+# POST /, GET /session/<id> and DELETE /delete_session/<id> at a target rate.
+#
+#   python -m loadtest.fake_ollama --port 11500 &
+#   OLLAMA_API_URL=http://127.0.0.1:11500/api/generate gunicorn -c gunicorn.conf.py alchemist_core:app &
+#   python -m loadtest.driver --base-url http://127.0.0.1:8000 --users 50 --rps 5 --duration 60 \
+#       --gunicorn-config gunicorn.conf.py
+
+import argparse
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.harness import percentile
+from benchmarks.synthetic import synthetic_text
+
+DEFAULT_MIX = {'analyze': 0.4, 'index': 0.2, 'view': 0.3, 'delete': 0.1}
+
+
+def read_gunicorn_capacity(config_path, workers=None, threads=None):
+    """
+    Reads `workers` and `threads` from a gunicorn config file (plain Python), with
+    command-line overrides. Returns the number of requests the server can run at once.
+    """
+    settings = {}
+    if config_path:
+        with open(config_path) as f:
+            exec(compile(f.read(), config_path, 'exec'), settings)
+    workers = workers or settings.get('workers', 1)
+    threads = threads or settings.get('threads', 1)
+    return int(workers), int(threads)
+
+
+class SyntheticUser:
+    def __init__(self, base_url, index, password='loadtest-password'):
+        self.base_url = base_url.rstrip('/')
+        self.username = f"loadtest_user_{index}"
+        self.password = password
+        self.http = requests.Session()
+        self.session_ids = []
+        self.lock = threading.Lock()
+
+    def login(self):
+        form = {'username': self.username, 'password': self.password}
+        self.http.post(f"{self.base_url}/register", data=form, allow_redirects=False)
+        response = self.http.post(f"{self.base_url}/login", data=form, allow_redirects=False)
+        if response.status_code != 302 or '/login' in response.headers.get('Location', ''):
+            raise RuntimeError(f"Could not log in {self.username} (HTTP {response.status_code}).")
+
+    def analyze(self, rng):
+        text = synthetic_text(rng.choice([10, 20, 40]), seed=rng.randrange(1_000_000))
+        response = self.http.post(f"{self.base_url}/", json={'user_input': text}, timeout=300)
+        if response.status_code == 200:
+            with self.lock:
+                self.session_ids.append(response.json()['new_session_id'])
+        return response
+
+    def index(self, rng):
+        return self.http.get(f"{self.base_url}/", timeout=300)
+
+    def view(self, rng):
+        with self.lock:
+            session_id = rng.choice(self.session_ids) if self.session_ids else None
+        if session_id is None:
+            return self.analyze(rng)
+        return self.http.get(f"{self.base_url}/session/{session_id}", timeout=300)
+
+    def delete(self, rng):
+        with self.lock:
+            session_id = self.session_ids.pop(rng.randrange(len(self.session_ids))) if self.session_ids else None
+        if session_id is None:
+            return self.analyze(rng)
+        return self.http.delete(f"{self.base_url}/delete_session/{session_id}", timeout=300)
+
+
+class LoadRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.in_flight = 0
+        self.in_flight_samples = []
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self, action, latency, status):
+        with self.lock:
+            self.in_flight -= 1
+            self.latencies[action].append(latency)
+            self.statuses[action][status] += 1
+
+    def sample_in_flight(self):
+        with self.lock:
+            self.in_flight_samples.append(self.in_flight)
+
+
+def run_load(base_url, users, rps, duration, mix=None, capacity=None, seed=0, max_concurrency=512):
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    actions, weights = zip(*mix.items())
+
+    print(f"Logging in {users} synthetic users...")
+    population = [SyntheticUser(base_url, i) for i in range(users)]
+    with ThreadPoolExecutor(max_workers=min(32, users)) as pool:
+        list(pool.map(lambda u: u.login(), population))
+
+    recorder = LoadRecorder()
+    stop = threading.Event()
+
+    def sampler():
+        while not stop.wait(0.1):
+            recorder.sample_in_flight()
+
+    def fire(user, action, scheduled_at, action_rng):
+        recorder.started()
+        status = 'exception'
+        try:
+            status = getattr(user, action)(action_rng).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        finally:
+            # Latency counts from the scheduled send time, so client-side queueing
+            # is not hidden when the server falls behind (no coordinated omission).
+            recorder.finished(action, time.perf_counter() - scheduled_at, status)
+
+    threading.Thread(target=sampler, daemon=True).start()
+    print(f"Driving {rps} req/s for {duration}s...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        n = 0
+        while True:
+            scheduled_at = started + n / rps
+            if scheduled_at - started >= duration:
+                break
+            sleep_for = scheduled_at - time.perf_counter()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            action = rng.choices(actions, weights)[0]
+            pool.submit(fire, rng.choice(population), action, scheduled_at, random.Random(rng.random()))
+            n += 1
+    stop.set()
+    elapsed = time.perf_counter() - started
+    report(recorder, elapsed, rps, capacity)
+    return recorder
+
+
+def report(recorder, elapsed, target_rps, capacity):
+    total = sum(len(v) for v in recorder.latencies.values())
+    print(f"\nCompleted {total} requests in {elapsed:.1f}s ({total / elapsed:.2f} req/s achieved, "
+          f"{target_rps} targeted)\n")
+    print(f"{'action':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>9}")
+    for action, latencies in sorted(recorder.latencies.items()):
+        statuses = recorder.statuses[action]
+        errors = sum(c for s, c in statuses.items() if not (isinstance(s, int) and s < 400))
+        print(f"{action:<10}{len(latencies):>8}"
+              f"{percentile(latencies, 50) * 1000:>10.0f}{percentile(latencies, 95) * 1000:>10.0f}"
+              f"{percentile(latencies, 99) * 1000:>10.0f}{max(latencies) * 1000:>10.0f}"
+              f"{errors / len(latencies):>9.1%}")
+        print(f"{'':<10}statuses: {dict(statuses)}")
+
+    if capacity and recorder.in_flight_samples:
+        workers, threads = capacity
+        slots = workers * threads
+        samples = recorder.in_flight_samples
+        saturated = sum(1 for s in samples if s >= slots) / len(samples)
+        print(f"\nGunicorn capacity: {workers} worker(s) x {threads} thread(s) = {slots} concurrent requests")
+        print(f"In-flight requests: mean {sum(samples) / len(samples):.1f}, max {max(samples)}; "
+              f"mean utilisation {min(1.0, sum(samples) / len(samples) / slots):.0%}; "
+              f"saturated {saturated:.0%} of the time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test driver for The Idea Forge.")
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--rps', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds of load.")
+    parser.add_argument('--mix', default=None,
+                        help="Comma-separated action=weight pairs, e.g. analyze=0.5,view=0.4,delete=0.1")
+    parser.add_argument('--gunicorn-config', default=None, help="Config file to read workers/threads from.")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mix = None
+    if args.mix:
+        mix = {k: float(v) for k, v in (pair.split('=') for pair in args.mix.split(','))}
+    capacity = read_gunicorn_capacity(args.gunicorn_config, args.workers, args.threads)
+    run_load(args.base_url, args.users, args.rps, args.duration, mix, capacity, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# loadtest/fake_ollama.py
+#
+# Local stand-in for Ollama's /api/generate, for load testing without a real model.
+#
+#   python -m loadtest.fake_ollama --port 11500 --latency lognormal:0.0,0.5 --error-rate 0.02
+#   OLLAMA_API_URL=http://127.0.0.1:11500/api/generate gunicorn alchemist_core:app
+#
+#   python -m loadtest.fake_ollama --port 11500 --count 3   # three backends on 11500-11502
+#
+# With --load-time the model has to be "loaded" before the first call and again after
+# its keep_alive runs out, and prompt processing is only charged for the part of the
+# prompt not shared with a recently seen one, like Ollama's prompt cache.
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUESTION_TEMPLATES = [
+    "What if the opposite of {} were the only way forward?",
+    "Which hidden assumption about {} would collapse first under pressure?",
+    "How would {} behave if nobody were allowed to measure it?",
+    "What does {} quietly depend on that nobody has named yet?",
+]
+# Small models rarely stop at the question; this is what a stop sequence saves
+FOLLOW_UP = ("Consider how this reframes the problem, which constraints it removes, and which small "
+             "experiment you could run tomorrow to test it.")
+
+
+def parse_latency(spec):
+    """
+    Turns a latency spec into a zero-argument sampler returning seconds:
+      fixed:S            always S seconds
+      uniform:LO,HI      uniform between LO and HI
+      normal:MEAN,SD     normal, clipped at 0
+      lognormal:MU,SIGMA exp(N(MU, SIGMA)), i.e. a long right tail
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda: math.exp(random.gauss(values[0], values[1]))
+    raise ValueError(f"Unknown latency spec '{spec}'")
+
+
+# Ollama's default when a request doesn't say
+DEFAULT_KEEP_ALIVE_SECONDS = 300
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_keep_alive(value):
+    """Seconds the model stays loaded after a request; negative values mean for ever."""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE_SECONDS
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        seconds = sum(float(amount) * _DURATION_UNITS[unit]
+                      for amount, unit in re.findall(r'(-?[\d.]+)(ms|s|m|h)', value))
+    return math.inf if seconds < 0 else seconds
+
+
+def _common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class FakeOllamaState:
+    def __init__(self, latency, error_rate, token_delay, seed=None, prompt_token_delay=0.0, load_time=0.0,
+                 cache_slots=4, parallel=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.load_time = load_time
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.served = 0
+        self.errors = 0
+        self.loads = 0
+        self.loaded_until = 0.0
+        self.cached_prompts = deque(maxlen=cache_slots)
+        # Like OLLAMA_NUM_PARALLEL: requests beyond this wait for a free slot
+        self.slots = threading.BoundedSemaphore(parallel) if parallel else nullcontext()
+
+    def use_model(self, keep_alive):
+        """Seconds spent loading the model for this request (0 if it was resident)."""
+        with self.lock:
+            now = time.monotonic()
+            load = 0.0 if now < self.loaded_until else self.load_time
+            if load:
+                self.loads += 1
+            self.loaded_until = now + load + parse_keep_alive(keep_alive)
+        return load
+
+    def uncached_tokens(self, tokens):
+        """How many of the prompt's tokens need processing after reusing the longest cached prefix."""
+        with self.lock:
+            reused = max((_common_prefix(tokens, cached) for cached in self.cached_prompts), default=0)
+            self.cached_prompts.append(tokens)
+        return len(tokens) - reused
+
+    def response_text(self, prompt):
+        digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+        words = [w.strip("'\".,:?") for w in prompt.split() if len(w) > 4]
+        topic = words[digest % len(words)] if words else "this idea"
+        return QUESTION_TEMPLATES[digest % len(QUESTION_TEMPLATES)].format(topic) + " " + FOLLOW_UP
+
+    def json_response_text(self, prompt, response_format):
+        """With `format` set, Ollama replies with a JSON object; fill every schema property with a question."""
+        keys = list(response_format.get('properties', {})) if isinstance(response_format, dict) else []
+        return json.dumps({key: self.response_text(f"{key} {prompt}") for key in keys or ['response']})
+
+
+def make_handler(state):
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                self._send_json(200, {'models': [{'name': 'phi3:mini'}]})
+            elif self.path == '/stats':
+                with state.lock:
+                    self._send_json(200, {'in_flight': state.in_flight, 'served': state.served,
+                                          'errors': state.errors, 'loads': state.loads})
+            else:
+                self._send_json(200, {'status': 'Ollama is running'})
+
+        def do_POST(self):
+            if self.path != '/api/generate':
+                self._send_json(404, {'error': 'not found'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            request_data = json.loads(self.rfile.read(length) or b'{}')
+            with state.lock:
+                state.in_flight += 1
+            try:
+                with state.slots:
+                    self._generate(request_data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client gave up (timeout or cancellation), same as a real server would see
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _generate(self, request_data):
+            started = time.perf_counter()
+            load = state.use_model(request_data.get('keep_alive'))
+            if not request_data.get('prompt') and not request_data.get('system'):
+                # An empty request only loads (or, with keep_alive 0, unloads) the model
+                time.sleep(load)
+                self._send_json(200, {'model': request_data.get('model', 'phi3:mini'), 'response': '',
+                                      'done': True, 'done_reason': 'load', 'load_duration': int(load * 1e9)})
+                return
+            with state.lock:
+                fail = state.random.random() < state.error_rate
+                delay = state.latency()
+            # Prompt processing scales with the part of the prompt that isn't cached, as on a real model
+            prompt_tokens = state.uncached_tokens(self._prompt_tokens(request_data))
+            time.sleep(load + delay + state.prompt_token_delay * prompt_tokens)
+            if fail:
+                with state.lock:
+                    state.errors += 1
+                self._send_json(500, {'error': 'simulated failure'})
+                return
+
+            if request_data.get('format'):
+                text = state.json_response_text(request_data.get('prompt', ''), request_data['format'])
+            else:
+                text = state.response_text(request_data.get('prompt', ''))
+            # Like Ollama, the stop string itself is not returned
+            options = request_data.get('options', {})
+            stops = [text.find(stop) for stop in options.get('stop') or [] if stop in text]
+            if stops:
+                text = text[:min(stops)]
+            tokens = text.split(' ')
+            done_reason = 'stop'
+            num_predict = options.get('num_predict')
+            if num_predict and len(tokens) > num_predict:
+                tokens = tokens[:num_predict]
+                done_reason = 'length'
+            base = {'model': request_data.get('model', 'phi3:mini'),
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+            # Ollama streams unless told otherwise
+            if request_data.get('stream', True):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    time.sleep(state.token_delay)
+                    self._write_chunk(dict(base, response=token + (' ' if i < len(tokens) - 1 else ''), done=False))
+                self._write_chunk(dict(base, response='', done=True, done_reason=done_reason,
+                                       **self._timings(started, load, prompt_tokens, tokens)))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                time.sleep(state.token_delay * len(tokens))
+                self._send_json(200, dict(base, response=' '.join(tokens), done=True, done_reason=done_reason,
+                                          **self._timings(started, load, prompt_tokens, tokens)))
+            with state.lock:
+                state.served += 1
+
+        def _write_chunk(self, payload):
+            line = (json.dumps(payload) + '\n').encode('utf-8')
+            self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b'\r\n')
+            self.wfile.flush()
+
+        @staticmethod
+        def _prompt_tokens(request_data):
+            # The system message comes first in the rendered prompt, so it is the cacheable prefix
+            return (request_data.get('system', '') + ' ' + request_data.get('prompt', '')).split()
+
+        def _timings(self, started, load, prompt_tokens, tokens):
+            total_ns = int((time.perf_counter() - started) * 1e9)
+            return {'total_duration': total_ns, 'load_duration': int(load * 1e9),
+                    'prompt_eval_count': prompt_tokens, 'eval_count': len(tokens),
+                    'prompt_eval_duration': int(state.prompt_token_delay * prompt_tokens * 1e9),
+                    'eval_duration': int(state.token_delay * len(tokens) * 1e9)}
+
+    return FakeOllamaHandler
+
+
+def serve(host='127.0.0.1', port=11500, latency='fixed:0.5', error_rate=0.0, token_delay=0.0, seed=None,
+          prompt_token_delay=0.0, load_time=0.0, parallel=None):
+    """Starts a fake Ollama server in a background thread and returns it (call .shutdown() to stop)."""
+    state = FakeOllamaState(parse_latency(latency), error_rate, token_delay, seed, prompt_token_delay, load_time,
+                            parallel=parallel)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama /api/generate server for load testing.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--latency', default='fixed:0.5',
+                        help="fixed:S | uniform:LO,HI | normal:MEAN,SD | lognormal:MU,SIGMA (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument('--token-delay', type=float, default=0.02,
+                        help="Seconds between streamed tokens (also added to non-streaming responses).")
+    parser.add_argument('--prompt-token-delay', type=float, default=0.0,
+                        help="Seconds of prompt processing per prompt token (system + prompt words).")
+    parser.add_argument('--load-time', type=float, default=0.0,
+                        help="Seconds to load the model when it isn't resident (see keep_alive).")
+    parser.add_argument('--parallel', type=int, default=None,
+                        help="Requests generated at once per server, like OLLAMA_NUM_PARALLEL (default: unlimited).")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--count', type=int, default=1,
+                        help="Number of independent servers, on consecutive ports from --port.")
+    args = parser.parse_args()
+
+    servers = [serve(args.host, args.port + i, args.latency, args.error_rate, args.token_delay, args.seed,
+                     args.prompt_token_delay, args.load_time, args.parallel) for i in range(args.count)]
+    urls = [f"http://{args.host}:{args.port + i}/api/generate" for i in range(args.count)]
+    print(f"Fake Ollama listening on {', '.join(urls)} "
+          f"(latency={args.latency}, error_rate={args.error_rate}, token_delay={args.token_delay}s)")
+    if args.count > 1:
+        print(f"OLLAMA_API_URLS={','.join(urls)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# metrics.py
+#
+# Prometheus metrics for the web app and workers. With several gunicorn workers,
+# set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does this) so every process writes
+# its samples there and /metrics aggregates across all of them.
+
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess, REGISTRY)
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    'alchemist_pipeline_stage_seconds', 'Time spent in each stage of the analysis pipeline.',
+    ['stage'], buckets=STAGE_BUCKETS)
+AGITATION_SECONDS = Histogram(
+    'alchemist_agitation_seconds', 'Time spent generating each agitation prompt type via Ollama.',
+    ['agitation_type', 'outcome'], buckets=STAGE_BUCKETS)
+AGITATION_FALLBACKS = Counter(
+    'alchemist_agitation_fallbacks_total', 'Agitation prompts served from the template instead of the LLM.',
+    ['agitation_type', 'mode', 'reason'])
+REQUEST_DEADLINES = Counter(
+    'alchemist_request_deadlines_total', 'Analysis requests by how they ended relative to their deadline '
+    '(met, exceeded, cancelled).', ['outcome'])
+OLLAMA_COMPUTE_SECONDS = Histogram(
+    'alchemist_ollama_compute_seconds', "Ollama's own reported time per generation, by phase "
+    "(load, prompt_eval, eval).", ['agitation_type', 'phase'], buckets=STAGE_BUCKETS)
+AGITATION_TOKENS = Histogram(
+    'alchemist_agitation_tokens', 'Tokens generated per Ollama call, by agitation type and model.',
+    ['agitation_type', 'model'], buckets=(5, 10, 20, 40, 60, 80, 120, 160, 250, 400, 600))
+OLLAMA_CALL_SECONDS = Histogram(
+    'alchemist_ollama_call_seconds', 'Ollama call latency, split into cold starts (the model had to be '
+    'loaded first) and warm calls.', ['agitation_type', 'start'], buckets=STAGE_BUCKETS)
+OLLAMA_BACKEND_OUTSTANDING = Gauge(
+    'alchemist_ollama_backend_outstanding', 'Ollama calls in flight per backend.',
+    ['backend'], multiprocess_mode='livesum')
+OLLAMA_BACKEND_HEALTHY = Gauge(
+    'alchemist_ollama_backend_healthy', 'Whether each Ollama backend is in rotation (0 if any process has '
+    'ejected it).', ['backend'], multiprocess_mode='livemin')
+OLLAMA_BACKEND_REQUESTS = Counter(
+    'alchemist_ollama_backend_requests_total', 'Ollama calls per backend by outcome (ok/error).',
+    ['backend', 'outcome'])
+OLLAMA_BACKEND_EJECTIONS = Counter(
+    'alchemist_ollama_backend_ejections_total', 'Times each Ollama backend was taken out of rotation.',
+    ['backend'])
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    'alchemist_llm_queue_wait_seconds', 'Time Ollama calls waited for a global scheduler slot, by priority '
+    'and whether they got one.', ['priority', 'outcome'], buckets=STAGE_BUCKETS)
+INFERENCE_QUEUE_WAIT_SECONDS = Histogram(
+    'alchemist_inference_queue_wait_seconds', 'Time spaCy/encoder calls waited for an inference thread, by '
+    'whether they got a place in the queue.', ['outcome'], buckets=STAGE_BUCKETS)
+DB_QUERY_SECONDS = Histogram(
+    'alchemist_db_query_seconds', 'SQLite query latency by statement.',
+    ['statement'], buckets=DB_BUCKETS)
+CACHE_REQUESTS = Counter(
+    'alchemist_cache_requests_total', 'Cache lookups by cache and result (hit/miss).',
+    ['cache', 'result'])
+RESULT_CACHE_SIMILARITY = Histogram(
+    'alchemist_result_cache_similarity', 'Similarity of the nearest earlier input per result cache lookup, by '
+    'decision (serve, adapt, miss).', ['decision'],
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.97, 0.98, 0.99, 0.995, 1.0))
+HTTP_REQUEST_SECONDS = Histogram(
+    'alchemist_http_request_seconds', 'HTTP request latency by endpoint.',
+    ['endpoint', 'method', 'status'], buckets=STAGE_BUCKETS)
+IN_FLIGHT_REQUESTS = Gauge(
+    'alchemist_in_flight_requests', 'Requests currently being handled, by endpoint.',
+    ['endpoint'], multiprocess_mode='livesum')
+ADMISSIONS = Counter(
+    'alchemist_admissions_total', 'Admission decisions for analysis requests (admit, degrade, overloaded, '
+    'rate_limited).', ['decision'])
+MODEL_LOAD_SECONDS = Gauge(
+    'alchemist_model_load_seconds', 'Time taken to load each model at process start.',
+    ['model'], multiprocess_mode='max')
+
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def observe_db(statement):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_QUERY_SECONDS.labels(statement=statement).observe(time.perf_counter() - started)
+
+
+def observe_agitation(agitation_type, seconds, ok):
+    AGITATION_SECONDS.labels(agitation_type=agitation_type, outcome='llm' if ok else 'error').observe(seconds)
+
+
+def record_agitation_fallback(agitation_type, mode, reason='error'):
+    AGITATION_FALLBACKS.labels(agitation_type=agitation_type, mode=mode, reason=reason).inc()
+
+
+def record_request_deadline(outcome):
+    REQUEST_DEADLINES.labels(outcome=outcome).inc()
+
+
+def observe_ollama_timings(agitation_type, stats):
+    """`stats` holds the *_duration fields (nanoseconds) from an Ollama response."""
+    for phase in ('load', 'prompt_eval', 'eval'):
+        if f'{phase}_duration' in stats:
+            OLLAMA_COMPUTE_SECONDS.labels(agitation_type=agitation_type, phase=phase).observe(
+                stats[f'{phase}_duration'] / 1e9)
+
+
+def observe_agitation_tokens(agitation_type, model, stats):
+    if 'eval_count' in stats:
+        AGITATION_TOKENS.labels(agitation_type=agitation_type, model=model).observe(stats['eval_count'])
+
+
+def observe_ollama_call(agitation_type, seconds, cold):
+    OLLAMA_CALL_SECONDS.labels(agitation_type=agitation_type, start='cold' if cold else 'warm').observe(seconds)
+
+
+def record_backend_state(backend, outstanding, healthy):
+    OLLAMA_BACKEND_OUTSTANDING.labels(backend=backend).set(outstanding)
+    OLLAMA_BACKEND_HEALTHY.labels(backend=backend).set(1 if healthy else 0)
+
+
+def record_backend_request(backend, ok):
+    OLLAMA_BACKEND_REQUESTS.labels(backend=backend, outcome='ok' if ok else 'error').inc()
+
+
+def record_backend_ejection(backend):
+    OLLAMA_BACKEND_EJECTIONS.labels(backend=backend).inc()
+
+
+def record_admission(decision):
+    ADMISSIONS.labels(decision=decision).inc()
+
+
+def observe_llm_queue_wait(priority, seconds, granted):
+    LLM_QUEUE_WAIT_SECONDS.labels(priority=priority, outcome='granted' if granted else 'timeout').observe(seconds)
+
+
+def observe_inference_wait(seconds, queued):
+    INFERENCE_QUEUE_WAIT_SECONDS.labels(outcome='queued' if queued else 'rejected').observe(seconds)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def observe_result_cache(similarity, decision):
+    """`similarity` is None when there was no candidate to compare with."""
+    record_cache('result', decision != 'miss')
+    if similarity is not None:
+        RESULT_CACHE_SIMILARITY.labels(decision=decision).observe(similarity)
+
+
+def record_model_load(model, seconds):
+    MODEL_LOAD_SECONDS.labels(model=model).set(seconds)
+
+
+class JobQueueCollector:
+    """Reads job queue depth straight from SQLite at scrape time, so it is correct across processes."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def collect(self):
+        from job_queue import queue_stats
+
+        stats = queue_stats(self.database)
+        depth = GaugeMetricFamily('alchemist_job_queue_depth', 'Jobs in the durable queue by status.',
+                                  labels=['status'])
+        for status, count in stats['depth'].items():
+            depth.add_metric([status], count)
+        yield depth
+        yield GaugeMetricFamily('alchemist_job_queue_oldest_age_seconds',
+                                'Age of the oldest queued job.', value=stats['oldest_queued_age_seconds'])
+        wait = GaugeMetricFamily('alchemist_job_wait_seconds',
+                                 'Queue wait of jobs completed in the last hour.', labels=['quantile'])
+        total = GaugeMetricFamily('alchemist_job_total_seconds',
+                                  'Enqueue-to-finish time of jobs completed in the last hour.', labels=['quantile'])
+        for quantile in ('p50', 'p95'):
+            if stats['wait_seconds'][quantile] is not None:
+                wait.add_metric([quantile], stats['wait_seconds'][quantile])
+            if stats['total_seconds'][quantile] is not None:
+                total.add_metric([quantile], stats['total_seconds'][quantile])
+        yield wait
+        yield total
+
+
+class LLMSchedulerCollector:
+    """Running and waiting Ollama calls from the scheduler's SQLite tables, read at scrape time."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def collect(self):
+        from llm_scheduler import scheduler_stats
+
+        stats = scheduler_stats(self.database)
+        calls = GaugeMetricFamily('alchemist_llm_scheduler_calls', 'Ollama calls holding or waiting for a '
+                                  'scheduler slot.', labels=['state', 'priority'])
+        for state in ('running', 'waiting'):
+            for priority, count in stats[state].items():
+                calls.add_metric([state, priority], count)
+        yield calls
+        users = GaugeMetricFamily('alchemist_llm_scheduler_waiting_users', 'Distinct users with calls waiting.',
+                                  labels=['priority'])
+        for priority, count in stats['waiting_users'].items():
+            users.add_metric([priority], count)
+        yield users
+        yield GaugeMetricFamily('alchemist_llm_scheduler_oldest_wait_seconds',
+                                'Age of the oldest waiting call.', value=stats['oldest_waiting_age_seconds'])
+
+
+def render_metrics(extra_collectors=()):
+    """Returns (body, content_type) for the /metrics endpoint."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        registry.register(_DefaultRegistryProxy())
+    for collector in extra_collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class _DefaultRegistryProxy:
+    # Lets a fresh registry include the process-global metrics without re-registering them.
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def mark_process_dead(pid):
+    """Called from gunicorn's child_exit hook so dead workers' live gauges stop counting."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def install_request_metrics(app):
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_endpoint = request.endpoint or 'unknown'
+        IN_FLIGHT_REQUESTS.labels(endpoint=g._metrics_endpoint).inc()
+
+    @app.after_request
+    def _record_request(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request_timer(exc):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        endpoint = g.pop('_metrics_endpoint')
+        status = g.pop('_metrics_status', 500)
+        IN_FLIGHT_REQUESTS.labels(endpoint=endpoint).dec()
+        HTTP_REQUEST_SECONDS.labels(endpoint=endpoint, method=request.method,
+                                    status=str(status)).observe(time.perf_counter() - started)
@@ -0,0 +1,132 @@
+# model_access.py
+#
+# Thread-safe access to spaCy and the sentence encoder, so gunicorn can run threaded
+# (gthread) workers. Neither pipeline may be called from several threads at once:
+# spaCy's Language object isn't documented as thread-safe, and a Hugging Face fast
+# tokenizer with padding/truncation fails with "Already borrowed" when two threads
+# use it together. So every model call runs on a small inference executor whose
+# threads each own a copy of both pipelines. The first thread uses the models
+# loaded at import; each extra thread (ALCHEMIST_INFERENCE_THREADS > 1) loads its
+# own copy when it starts (start_all() starts them all up front).
+#
+# A request spends most of an analysis waiting on Ollama, not on the models, so one
+# process can serve many requests on threads while their model calls take turns
+# here. The queue is bounded: a call that can't get a place within
+# ALCHEMIST_INFERENCE_WAIT_SECONDS raises InferenceBusy (answered with 503).
+#
+# MODELS.nlp and MODELS.encoder stand in for the pipelines with the same interface
+# (nlp(text), nlp.pipe(texts), encoder.encode(...)), so code that takes an nlp or
+# encoder argument works unchanged.
+#
+#   GUNICORN_WORKER_CLASS=gthread GUNICORN_THREADS=8 gunicorn alchemist_core:app
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import observe_inference_wait
+from profiler import attributed_to
+
+# --- Inference Configuration ---
+# Threads (each with its own spaCy and encoder) running model calls per process
+INFERENCE_THREADS = int(os.environ.get('ALCHEMIST_INFERENCE_THREADS', '1'))
+# Model calls that may wait for a thread on top of the ones running
+INFERENCE_QUEUE = int(os.environ.get('ALCHEMIST_INFERENCE_QUEUE', '32'))
+INFERENCE_WAIT_SECONDS = float(os.environ.get('ALCHEMIST_INFERENCE_WAIT_SECONDS', '10'))
+
+
+class InferenceBusy(Exception):
+    """The inference queue stayed full for longer than the caller may wait."""
+
+    retry_after = 5
+
+
+class ModelAccess:
+    def __init__(self, nlp, encoder, load_nlp=None, load_encoder=None, threads=INFERENCE_THREADS,
+                 max_queued=INFERENCE_QUEUE, wait_seconds=INFERENCE_WAIT_SECONDS):
+        """
+        `nlp` and `encoder` are the already-loaded pipelines; `load_nlp()` and
+        `load_encoder()` make the copies for any further threads.
+        """
+        if threads > 1 and (load_nlp is None or load_encoder is None):
+            raise ValueError("More than one inference thread needs load_nlp and load_encoder.")
+        self.threads = threads
+        self.wait_seconds = wait_seconds
+        self._unclaimed = [(nlp, encoder)]
+        self._loaders = (load_nlp, load_encoder)
+        self._claim_lock = threading.Lock()
+        self._local = threading.local()
+        self._places = threading.BoundedSemaphore(threads + max_queued)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='inference', initializer=self._claim_models)
+        self.nlp = _NlpProxy(self)
+        self.encoder = _EncoderProxy(self)
+
+    def _claim_models(self):
+        # Runs once in each executor thread as it starts
+        with self._claim_lock:
+            models = self._unclaimed.pop() if self._unclaimed else None
+        if models is None:
+            load_nlp, load_encoder = self._loaders
+            started = time.perf_counter()
+            models = (load_nlp(), load_encoder())
+            print(f"Inference thread {threading.current_thread().name} loaded its models in "
+                  f"{time.perf_counter() - started:.1f}s.")
+        self._local.models = models
+
+    def start_all(self):
+        """Starts every inference thread now, loading their models, rather than when load first needs them. Call before serving."""
+        barrier = threading.Barrier(self.threads)
+        # Each wait() blocks its thread until all have started, so every submit gets a new thread
+        for future in [self._executor.submit(barrier.wait) for _ in range(self.threads)]:
+            future.result()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn(nlp, encoder, *args, **kwargs) on an inference thread and returns its result."""
+        models = getattr(self._local, 'models', None)
+        if models is not None:
+            # Already on an inference thread (fn calling back into MODELS): queueing would deadlock
+            return fn(*models, *args, **kwargs)
+
+        started = time.perf_counter()
+        if not self._places.acquire(timeout=self.wait_seconds):
+            observe_inference_wait(time.perf_counter() - started, queued=False)
+            raise InferenceBusy(f"No inference thread free within {self.wait_seconds:g}s.")
+        try:
+            future = self._executor.submit(self._run, threading.get_ident(), started, fn, args, kwargs)
+        except BaseException:
+            self._places.release()
+            raise
+        future.add_done_callback(lambda _: self._places.release())
+        return future.result()
+
+    def _run(self, requester, submitted, fn, args, kwargs):
+        observe_inference_wait(time.perf_counter() - submitted, queued=True)
+        # Shows up in the requesting thread's profile, if it has one (profiler.py)
+        with attributed_to(requester):
+            return fn(*self._local.models, *args, **kwargs)
+
+
+class _NlpProxy:
+    """Calls a spaCy pipeline through ModelAccess."""
+
+    def __init__(self, access):
+        self._access = access
+
+    def __call__(self, text):
+        return self._access.call(lambda nlp, encoder: nlp(text))
+
+    def pipe(self, texts, **kwargs):
+        # Parsed in one call, so the docs come back as a list rather than lazily
+        texts = list(texts)
+        return self._access.call(lambda nlp, encoder: list(nlp.pipe(texts, **kwargs)))
+
+
+class _EncoderProxy:
+    """Calls a sentence encoder through ModelAccess."""
+
+    def __init__(self, access):
+        self._access = access
+
+    def encode(self, sentences, **kwargs):
+        return self._access.call(lambda nlp, encoder: encoder.encode(sentences, **kwargs))
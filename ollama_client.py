@@ -0,0 +1,169 @@
+# ollama_client.py
+#
+# The HTTP call to Ollama's /api/generate. Failures come back as a string starting
+# with "Error" rather than an exception, which is what the agitation code checks for.
+#
+# With a deadline the response is streamed, and the connection is dropped as soon as
+# the deadline passes or the request is cancelled; Ollama stops generating when its
+# client disconnects, so abandoned calls don't keep the model busy.
+#
+# Every call asks Ollama to keep the model loaded for KEEP_ALIVE afterwards, and
+# start_keep_warm() loads it up front and pings it while the app is idle, so users
+# don't pay for loading the model after a quiet spell.
+
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+# Reported by Ollama with every finished generation: durations in nanoseconds, counts in tokens
+TIMING_FIELDS = ('total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration')
+COUNT_FIELDS = ('prompt_eval_count', 'eval_count')
+# 'stop' (finished or hit a stop string) or 'length' (ran into num_predict)
+OTHER_FIELDS = ('done_reason',)
+CONNECT_TIMEOUT = 5
+# How long Ollama keeps the model in memory after a call: a duration ("30m"), seconds, or -1 for ever
+KEEP_ALIVE = os.environ.get('ALCHEMIST_OLLAMA_KEEP_ALIVE', '30m')
+# A call whose load_duration is longer than this had to load the model first
+COLD_LOAD_SECONDS = 0.5
+# Loading a model from disk can take a while on a small machine
+LOAD_TIMEOUT = 300
+
+UNREACHABLE_MESSAGE = "Error: Ollama server not running or unreachable. Please ensure Ollama is installed and running."
+
+
+def keep_alive_value(keep_alive=None):
+    """Ollama takes bare numbers as seconds only when they are sent as JSON numbers."""
+    value = KEEP_ALIVE if keep_alive is None else keep_alive
+    if isinstance(value, str) and re.fullmatch(r'-?\d+', value.strip()):
+        return int(value)
+    return value
+
+
+def is_cold(stats):
+    """Whether the generation behind `stats` (see generate) started by loading the model."""
+    return stats.get('load_duration', 0) / 1e9 >= COLD_LOAD_SECONDS
+
+
+def generate(api_url, model, system_message, user_message, max_tokens=150, temperature=0.7,
+             response_format=None, stats=None, deadline=None, stop=None):
+    """
+    Returns the generated text. `response_format` is passed as Ollama's `format`
+    ('json' or a JSON schema); generation ends early at any of the `stop` strings. If `stats` is a dict, Ollama's timing and token counts
+    are copied into it. `deadline` is a deadlines.Deadline.
+    """
+    headers = {'Content-Type': 'application/json'}
+    data = {
+        "model": model,
+        "prompt": user_message,
+        "system": system_message,
+        "stream": False,
+        "keep_alive": keep_alive_value(),
+        "options": {
+            "temperature": temperature,
+            "num_predict": max_tokens
+        }
+    }
+    if response_format is not None:
+        data["format"] = response_format
+    if stop:
+        data["options"]["stop"] = list(stop)
+    if deadline is not None:
+        return _generate_streaming(api_url, headers, data, stats, deadline)
+    try:
+        response = requests.post(api_url, headers=headers, json=data)
+        response.raise_for_status()
+        result = response.json()
+        if stats is not None:
+            stats.update({field: result[field] for field in TIMING_FIELDS + COUNT_FIELDS + OTHER_FIELDS if field in result})
+        return result.get("response", "").strip()
+    except requests.exceptions.ConnectionError:
+        return UNREACHABLE_MESSAGE
+    except requests.exceptions.RequestException as e:
+        return f"Error interacting with Ollama API: {e}"
+    except json.JSONDecodeError:
+        return "Error: Could not decode JSON response from Ollama."
+
+
+def _generate_streaming(api_url, headers, data, stats, deadline):
+    if deadline.expired():
+        return "Error: request deadline reached before calling Ollama."
+    data["stream"] = True
+    remaining = deadline.remaining()
+    read_timeout = None if remaining is None else max(remaining, 0.01)
+    parts = []
+    try:
+        # The read timeout bounds each wait for the next chunk, so a stalled server can't outlast the deadline
+        with requests.post(api_url, headers=headers, json=data, stream=True,
+                           timeout=(CONNECT_TIMEOUT, read_timeout)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if deadline.expired():
+                    # Leaving the `with` block closes the connection, which aborts the generation
+                    reason = "cancelled by the client" if deadline.cancelled else "request deadline exceeded"
+                    return f"Error: Ollama generation abandoned ({reason})."
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                parts.append(chunk.get("response", ""))
+                if chunk.get("done"):
+                    if stats is not None:
+                        stats.update({field: chunk[field] for field in TIMING_FIELDS + COUNT_FIELDS + OTHER_FIELDS if field in chunk})
+                    break
+        return "".join(parts).strip()
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        # A read timeout in the middle of the stream surfaces as a ConnectionError
+        if deadline.timed_out:
+            return "Error: Ollama did not respond before the request deadline."
+        return UNREACHABLE_MESSAGE
+    except requests.exceptions.RequestException as e:
+        return f"Error interacting with Ollama API: {e}"
+    except json.JSONDecodeError:
+        return "Error: Could not decode JSON response from Ollama."
+
+
+# --- Model residency ---
+def load_model(api_url, model, keep_alive=None):
+    """
+    Loads `model` (a generate call without a prompt) and resets its keep-alive timer.
+    Returns the seconds it took, or None if Ollama could not be reached.
+    """
+    started = time.perf_counter()
+    try:
+        response = requests.post(api_url, json={"model": model, "keep_alive": keep_alive_value(keep_alive)},
+                                 timeout=(CONNECT_TIMEOUT, LOAD_TIMEOUT))
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Could not load Ollama model '{model}': {e}")
+        return None
+    return time.perf_counter() - started
+
+
+def unload_model(api_url, model):
+    return load_model(api_url, model, keep_alive=0)
+
+
+def start_keep_warm(api_url, model, interval, on_load=None):
+    """
+    Loads the model in a background thread, then pings it every `interval` seconds
+    (0 loads it once). `on_load(seconds)` is called after the first successful load.
+    """
+    def run():
+        loaded = False
+        while True:
+            seconds = load_model(api_url, model)
+            if seconds is not None and not loaded:
+                loaded = True
+                print(f"Ollama model '{model}' loaded in {seconds:.1f}s.")
+                if on_load is not None:
+                    on_load(seconds)
+            if not interval:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='ollama-keep-warm', daemon=True)
+    thread.start()
+    return thread
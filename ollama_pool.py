@@ -0,0 +1,188 @@
+# ollama_pool.py
+#
+# Routes Ollama calls across several backends instead of the single OLLAMA_API_URL.
+#
+#   OLLAMA_API_URLS=http://gpu1:11434/api/generate,http://gpu2:11434/api/generate
+#
+# Each call goes to the healthy backend with the fewest outstanding requests, and no
+# backend gets more than OLLAMA_BACKEND_CONCURRENCY at once from this process; when
+# every backend is full the call waits for a slot (or for its deadline). A backend is
+# ejected after EJECT_AFTER_FAILURES failed calls in a row or a failed health check,
+# and taken back once a health check passes. Without health checks it gets one trial
+# call after EJECT_SECONDS.
+#
+# The pool lives in each process, so the per-backend limit applies per gunicorn worker.
+
+import os
+import threading
+import time
+
+import requests
+
+import ollama_client
+from metrics import record_backend_ejection, record_backend_request, record_backend_state
+
+# --- Pool Configuration ---
+OLLAMA_BACKEND_CONCURRENCY = int(os.environ.get('ALCHEMIST_OLLAMA_BACKEND_CONCURRENCY', '4'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('ALCHEMIST_OLLAMA_HEALTH_INTERVAL', '5'))
+HEALTH_CHECK_TIMEOUT = 2
+EJECT_AFTER_FAILURES = 3
+EJECT_SECONDS = 30
+# How long a call without a deadline waits for a free backend
+ACQUIRE_TIMEOUT = 30
+ACQUIRE_POLL_INTERVAL = 0.25
+
+
+def backend_urls(default_url):
+    """OLLAMA_API_URLS (comma-separated) if set, otherwise just `default_url`."""
+    urls = [url.strip() for url in os.environ.get('OLLAMA_API_URLS', '').split(',') if url.strip()]
+    return urls or [default_url]
+
+
+def health_url(api_url):
+    # /api/tags answers without touching a model
+    return api_url.rsplit('/api/', 1)[0] + '/api/tags'
+
+
+class Backend:
+    def __init__(self, url, max_concurrency):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.served = 0
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        if self.outstanding >= self.max_concurrency:
+            return False
+        # An ejected backend gets a trial call once its ejection runs out
+        return self.healthy or now >= self.ejected_until
+
+
+class BackendPool:
+    def __init__(self, urls, max_concurrency=OLLAMA_BACKEND_CONCURRENCY):
+        self.backends = [Backend(url, max_concurrency) for url in urls]
+        self._condition = threading.Condition()
+        self._health_thread = None
+        for backend in self.backends:
+            record_backend_state(backend.url, 0, True)
+
+    def _pick(self, exclude):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+        if not candidates:
+            return None
+        # Least outstanding first; among equals, the one that has served least so load spreads evenly
+        return min(candidates, key=lambda b: (not b.healthy, b.outstanding, b.served))
+
+    def acquire(self, deadline=None, timeout=ACQUIRE_TIMEOUT, exclude=()):
+        """Reserves a slot on a backend and returns it, or None if none frees up in time."""
+        give_up_at = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                backend = self._pick(exclude)
+                if backend is not None:
+                    backend.outstanding += 1
+                    backend.served += 1
+                    record_backend_state(backend.url, backend.outstanding, backend.healthy)
+                    return backend
+                if deadline is not None and deadline.expired():
+                    return None
+                wait = give_up_at - time.monotonic()
+                if deadline is not None and deadline.remaining() is not None:
+                    wait = min(wait, deadline.remaining())
+                if wait <= 0:
+                    return None
+                # Woken by release(); the poll interval also notices cancellation and ejections running out
+                self._condition.wait(min(wait, ACQUIRE_POLL_INTERVAL))
+
+    def release(self, backend, ok):
+        """`ok` is False when the call failed in a way that says something about the backend."""
+        with self._condition:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                if not backend.healthy:
+                    self._reinstate(backend)
+            else:
+                backend.failures += 1
+                if backend.failures >= EJECT_AFTER_FAILURES or not backend.healthy:
+                    self._eject(backend, f"{backend.failures} failed calls in a row")
+            record_backend_state(backend.url, backend.outstanding, backend.healthy)
+            self._condition.notify_all()
+        record_backend_request(backend.url, ok)
+
+    def _eject(self, backend, reason):
+        backend.ejected_until = time.monotonic() + EJECT_SECONDS
+        if backend.healthy:
+            backend.healthy = False
+            record_backend_ejection(backend.url)
+            print(f"Ollama backend {backend.url} ejected ({reason}).")
+
+    def _reinstate(self, backend):
+        backend.healthy = True
+        backend.failures = 0
+        print(f"Ollama backend {backend.url} reinstated.")
+
+    # --- Active health checks ---
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                ok = requests.get(health_url(backend.url), timeout=HEALTH_CHECK_TIMEOUT).ok
+            except requests.exceptions.RequestException:
+                ok = False
+            with self._condition:
+                if ok and not backend.healthy:
+                    self._reinstate(backend)
+                elif not ok:
+                    self._eject(backend, "health check failed")
+                record_backend_state(backend.url, backend.outstanding, backend.healthy)
+                self._condition.notify_all()
+
+    def start_health_checks(self, interval=HEALTH_CHECK_INTERVAL):
+        if self._health_thread is not None or not interval:
+            return
+
+        def run():
+            while True:
+                self.check_health()
+                time.sleep(interval)
+
+        self._health_thread = threading.Thread(target=run, name='ollama-health', daemon=True)
+        self._health_thread.start()
+
+    def snapshot(self):
+        with self._condition:
+            return [{'url': b.url, 'outstanding': b.outstanding, 'served': b.served, 'healthy': b.healthy,
+                     'failures': b.failures} for b in self.backends]
+
+
+NO_BACKEND_MESSAGE = "Error: no Ollama backend available (all busy or unhealthy)."
+
+
+def pooled_generate(pool, model, system_message, user_message, deadline=None, **kwargs):
+    """
+    ollama_client.generate on a backend from `pool`. A call that fails because its
+    backend is unreachable is retried once on another backend.
+    """
+    result = NO_BACKEND_MESSAGE
+    tried = []
+    for _ in range(2 if len(pool.backends) > 1 else 1):
+        backend = pool.acquire(deadline, exclude=tried)
+        if backend is None:
+            return result
+        tried.append(backend)
+        try:
+            result = ollama_client.generate(backend.url, model, system_message, user_message,
+                                            deadline=deadline, **kwargs)
+        except Exception:
+            pool.release(backend, False)
+            raise
+        # Running out of time or being cancelled is not the backend's fault
+        abandoned = deadline is not None and deadline.expired()
+        pool.release(backend, not result.startswith("Error") or abandoned)
+        if result != ollama_client.UNREACHABLE_MESSAGE or abandoned:
+            break
+    return result
@@ -0,0 +1,282 @@
+# profiler.py
+#
+# Opt-in request profiling. A request is profiled when it is picked by the sample rate
+# or carries the profiling header; with auto-capture on, every request is stack-sampled
+# cheaply and only the slowest N per hour are kept. Profiles are stored in SQLite and
+# browsed from /admin/profiles.
+#
+# Work a request hands to another thread (spaCy and the encoder run on inference
+# threads, see model_access.py) is counted in the request's profile through
+# attributed_to(): sampled stacks are grafted under the request thread's own stack,
+# and cProfile stats are merged in when the request finishes.
+
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+
+PROFILING_ENABLED = os.environ.get('ALCHEMIST_PROFILING', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('ALCHEMIST_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_HEADER = os.environ.get('ALCHEMIST_PROFILE_HEADER', 'X-Alchemist-Profile')
+PROFILE_TOKEN = os.environ.get('ALCHEMIST_PROFILE_TOKEN')
+PROFILE_MODE = os.environ.get('ALCHEMIST_PROFILE_MODE', 'sample')  # 'sample' (collapsed stacks) or 'cprofile'
+PROFILE_INTERVAL = float(os.environ.get('ALCHEMIST_PROFILE_INTERVAL', '0.005'))
+PROFILE_AUTO_SLOWEST = os.environ.get('ALCHEMIST_PROFILE_AUTO_SLOWEST', '0') == '1'
+PROFILE_SLOWEST_N = int(os.environ.get('ALCHEMIST_PROFILE_SLOWEST_N', '5'))
+PROFILE_SLOWEST_MIN_SECONDS = float(os.environ.get('ALCHEMIST_PROFILE_SLOWEST_MIN_SECONDS', '0.5'))
+PROFILE_RETENTION = int(os.environ.get('ALCHEMIST_PROFILE_RETENTION', '200'))
+
+# Never profile the endpoints used to look at profiles and metrics
+EXCLUDED_ENDPOINTS = {'static', 'metrics', 'list_request_profiles', 'download_profile'}
+
+
+def init_profile_tables(cursor):
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS request_profiles (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             created_at REAL NOT NULL,
+             hour_bucket INTEGER NOT NULL,
+             method TEXT NOT NULL,
+             path TEXT NOT NULL,
+             endpoint TEXT,
+             user_id INTEGER,
+             duration REAL NOT NULL,
+             reason TEXT NOT NULL,
+             format TEXT NOT NULL,
+             samples INTEGER,
+             data BLOB NOT NULL
+         )
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_request_profiles_slowest ON request_profiles (reason, hour_bucket, duration);
+     ''')
+
+
+class StackSampler:
+    """
+    One background thread that periodically snapshots the stacks of the threads
+    registered with it and counts them as collapsed stacks ("a;b;c" -> samples),
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}
+        # Helper thread -> the registered thread it is working for
+        self.delegates = {}
+        self.thread = None
+
+    def start(self, thread_id):
+        counts = Counter()
+        with self.lock:
+            self.active[thread_id] = counts
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='alchemist-stack-sampler', daemon=True)
+                self.thread.start()
+        return counts
+
+    def stop(self, thread_id):
+        with self.lock:
+            return self.active.pop(thread_id, Counter())
+
+    def link(self, helper_id, thread_id):
+        with self.lock:
+            self.delegates[helper_id] = thread_id
+
+    def unlink(self, helper_id):
+        with self.lock:
+            self.delegates.pop(helper_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                targets = list(self.active.items())
+                helpers = {}
+                for helper_id, thread_id in self.delegates.items():
+                    helpers.setdefault(thread_id, []).append(helper_id)
+            frames = sys._current_frames()
+            for thread_id, counts in targets:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = self._collapse(frame)
+                helper_frames = [frames[h] for h in helpers.get(thread_id, ()) if h in frames]
+                if helper_frames:
+                    # Waiting on a helper: count where the helper is, under where the request waits
+                    for helper_frame in helper_frames:
+                        counts[f"{stack};{self._collapse(helper_frame)}"] += 1
+                else:
+                    counts[stack] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+_sampler = StackSampler(PROFILE_INTERVAL)
+# Request thread -> cProfile.Profile objects of work done for it on other threads
+_cprofile_extras = {}
+_cprofile_lock = threading.Lock()
+
+
+@contextmanager
+def attributed_to(thread_id):
+    """
+    Counts the work done on the current thread inside this block as part of the
+    profile of thread `thread_id`, if that thread's request is being profiled.
+    """
+    with _cprofile_lock:
+        extras = _cprofile_extras.get(thread_id)
+    if extras is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with _cprofile_lock:
+                extras.append(profile)
+        return
+    _sampler.link(threading.get_ident(), thread_id)
+    try:
+        yield
+    finally:
+        _sampler.unlink(threading.get_ident())
+
+
+def _should_profile():
+    header_value = request.headers.get(PROFILE_HEADER)
+    if header_value and (PROFILE_TOKEN is None or header_value == PROFILE_TOKEN):
+        return 'header'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    if PROFILE_AUTO_SLOWEST:
+        return 'slowest'
+    return None
+
+
+def _store_profile(database, reason, fmt, data, samples, duration, user_id):
+    now = time.time()
+    hour_bucket = int(now // 3600)
+    row = (now, hour_bucket, request.method, request.path, request.endpoint, user_id, duration, reason, fmt,
+           samples, data)
+    conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if reason == 'slowest':
+            # Keep only the N slowest requests of this hour
+            kept = conn.execute(
+                "SELECT id, duration FROM request_profiles WHERE reason = 'slowest' AND hour_bucket = ? "
+                "ORDER BY duration ASC", (hour_bucket,)).fetchall()
+            if len(kept) >= PROFILE_SLOWEST_N:
+                if duration <= kept[0][1]:
+                    conn.execute('COMMIT')
+                    return None
+                conn.execute('DELETE FROM request_profiles WHERE id = ?', (kept[0][0],))
+        cursor = conn.execute(
+            'INSERT INTO request_profiles (created_at, hour_bucket, method, path, endpoint, user_id, duration, '
+            'reason, format, samples, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+        if reason != 'slowest':
+            conn.execute(
+                "DELETE FROM request_profiles WHERE reason != 'slowest' AND id NOT IN "
+                "(SELECT id FROM request_profiles WHERE reason != 'slowest' ORDER BY id DESC LIMIT ?)",
+                (PROFILE_RETENTION,))
+        conn.execute('COMMIT')
+        return cursor.lastrowid
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def install_profiler(app, database, get_user_id):
+    if not PROFILING_ENABLED:
+        return
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint in EXCLUDED_ENDPOINTS:
+            return
+        reason = _should_profile()
+        if reason is None:
+            return
+        g._profile_reason = reason
+        g._profile_started = time.perf_counter()
+        g._profile_thread = threading.get_ident()
+        # Auto-capture always uses the stack sampler: cProfile on every request would cost too much
+        if PROFILE_MODE == 'cprofile' and reason != 'slowest':
+            with _cprofile_lock:
+                _cprofile_extras[g._profile_thread] = []
+            g._profile_cprofile = cProfile.Profile()
+            g._profile_cprofile.enable()
+        else:
+            _sampler.start(g._profile_thread)
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        reason = g.pop('_profile_reason', None)
+        if reason is None:
+            return
+        duration = time.perf_counter() - g.pop('_profile_started')
+        profile = g.pop('_profile_cprofile', None)
+        thread_id = g.pop('_profile_thread')
+        if profile is not None:
+            profile.disable()
+            with _cprofile_lock:
+                extras = _cprofile_extras.pop(thread_id, [])
+            stats = pstats.Stats(profile)
+            for extra in extras:
+                stats.add(extra)
+            fmt, data, samples = 'pstats', marshal.dumps(stats.stats), stats.total_calls
+        else:
+            counts = _sampler.stop(thread_id)
+            fmt = 'collapsed'
+            data = '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()).encode('utf-8')
+            samples = sum(counts.values())
+        if reason == 'slowest' and duration < PROFILE_SLOWEST_MIN_SECONDS:
+            return
+        try:
+            _store_profile(database, reason, fmt, data, samples, duration, get_user_id())
+        except sqlite3.Error as e:
+            print(f"Could not store request profile: {e}")
+
+
+def list_profiles(database, limit=100):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            'SELECT id, created_at, method, path, endpoint, user_id, duration, reason, format, samples '
+            'FROM request_profiles ORDER BY duration DESC, id DESC LIMIT ?', (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def get_profile(database, profile_id):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute('SELECT id, format, data FROM request_profiles WHERE id = ?', (profile_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
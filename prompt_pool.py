@@ -0,0 +1,184 @@
+# prompt_pool.py
+#
+# Pregenerated agitation prompts for frequently seen concepts. The deconstruct,
+# assumptions and cross-pollinate questions depend on little more than the main term
+# (and, for cross-pollinate, one of the fixed UNRELATED_DOMAINS), and popular terms
+# come up again and again. A batch run mines the most frequent key terms from
+# `sessions`, generates a few questions per term and domain with background priority,
+# and stores them in `prompt_pool`. Interactive requests take from the pool first and
+# only call Ollama for types it has nothing for.
+#
+#   python prompt_pool.py --top 200 --per-key 3                # e.g. nightly from cron
+#   python prompt_pool.py --top 200 --off-peak 1-6             # stops once it's past 06:00
+
+import argparse
+import json
+import random
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+from functools import partial
+
+from agitation import AGITATION_PROFILES, AGITATION_SPECS, UNRELATED_DOMAINS, generate_sequential
+from metrics import record_cache
+
+# Type -> the context field its question also depends on ('' when it's the term alone)
+POOLED_TYPES = {'deconstruct': '', 'assumptions': '', 'cross_pollinate': 'domain'}
+POOL_MAX_AGE_DAYS = 30
+MINING_WINDOW_DAYS = 30
+
+
+def init_prompt_pool_tables(cursor):
+    """
+    Creates the prompt_pool table. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS prompt_pool (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             agitation_type TEXT NOT NULL,
+             main_term TEXT NOT NULL,
+             variant TEXT NOT NULL DEFAULT '',
+             prompt TEXT NOT NULL,
+             model TEXT,
+             created_at REAL NOT NULL
+         )
+     ''')
+    cursor.execute('''
+         CREATE INDEX IF NOT EXISTS idx_prompt_pool_lookup ON prompt_pool (agitation_type, main_term, variant);
+     ''')
+
+
+# --- Interactive lookup ---
+def lookup(database, ctx, specs):
+    """
+    Pooled questions for whichever of `specs` the pool covers for ctx['main_term'], as
+    {type: question}. Cross-pollinate prefers ctx's domain but takes any pooled domain
+    for the term, and then updates ctx['domain'] to match.
+    """
+    found = {}
+    conn = sqlite3.connect(database)
+    try:
+        for spec in specs:
+            if spec.type not in POOLED_TYPES:
+                continue
+            variant_key = POOLED_TYPES[spec.type]
+            rows = conn.execute('SELECT prompt, variant FROM prompt_pool WHERE agitation_type = ? AND main_term = ?',
+                                (spec.type, ctx['main_term'])).fetchall()
+            if variant_key:
+                matching = [row for row in rows if row[1] == ctx[variant_key]]
+                rows = matching or rows
+            record_cache('prompt_pool', bool(rows))
+            if rows:
+                prompt, variant = random.choice(rows)
+                found[spec.type] = prompt
+                if variant_key:
+                    ctx[variant_key] = variant
+    except sqlite3.OperationalError:
+        return {}  # table not created yet
+    finally:
+        conn.close()
+    return found
+
+
+# --- Batch pregeneration ---
+def frequent_terms(database, limit, days=MINING_WINDOW_DAYS):
+    conn = sqlite3.connect(database)
+    try:
+        rows = conn.execute("SELECT key_terms FROM sessions WHERE timestamp >= datetime('now', ?)",
+                            (f'-{days} days',)).fetchall()
+    finally:
+        conn.close()
+    counts = Counter()
+    for (key_terms,) in rows:
+        try:
+            counts.update(set(json.loads(key_terms or '[]')))
+        except (TypeError, ValueError):
+            continue
+    return [term for term, _ in counts.most_common(limit)]
+
+
+def _pool_counts(conn, main_term):
+    rows = conn.execute('SELECT agitation_type, variant, COUNT(*) FROM prompt_pool WHERE main_term = ? '
+                        'GROUP BY agitation_type, variant', (main_term,)).fetchall()
+    return {(agitation_type, variant): count for agitation_type, variant, count in rows}
+
+
+def pregenerate(database, llm, terms, per_key=3, default_model=None, keep_going=lambda: True):
+    """
+    Tops the pool up to `per_key` questions for every (type, term, variant). `llm` has
+    generate_llm_prompt's signature. Returns the number of questions stored; stops
+    early once `keep_going()` is false.
+    """
+    specs = [spec for spec in AGITATION_SPECS if spec.type in POOLED_TYPES]
+    stored = 0
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        conn.execute('DELETE FROM prompt_pool WHERE created_at < ?', (time.time() - POOL_MAX_AGE_DAYS * 86400,))
+        conn.commit()
+        for term in terms:
+            if not keep_going():
+                break
+            have = _pool_counts(conn, term)
+            # Generated with no transaction open: the Ollama calls take minutes, and the main
+            # database would stay write-locked for interactive requests all that time
+            rows = []
+            for spec in specs:
+                variants = UNRELATED_DOMAINS if POOLED_TYPES[spec.type] == 'domain' else ['']
+                for variant in variants:
+                    # The questions must not depend on a particular input, so there is no problem text
+                    ctx = {'main_term': term, 'secondary_term': None, 'domain': variant, 'perspective': None,
+                           'input_text': None}
+                    for _ in range(per_key - have.get((spec.type, variant), 0)):
+                        question = generate_sequential([spec], ctx, llm).get(spec.type)
+                        if question:
+                            rows.append((spec.type, term, variant, question,
+                                         AGITATION_PROFILES[spec.type].model or default_model, time.time()))
+            with conn:
+                conn.executemany('INSERT INTO prompt_pool (agitation_type, main_term, variant, prompt, model, '
+                                 'created_at) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            stored += len(rows)
+    finally:
+        conn.close()
+    return stored
+
+
+def _off_peak_checker(hours):
+    if not hours:
+        return lambda: True
+    start, end = (int(h) for h in hours.split('-'))
+
+    def in_window():
+        hour = datetime.now().hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+    return in_window
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pregenerate agitation prompts for frequent key terms.")
+    parser.add_argument('--top', type=int, default=200, help="How many of the most frequent terms to cover.")
+    parser.add_argument('--per-key', type=int, default=3, help="Questions to keep per type, term and domain.")
+    parser.add_argument('--days', type=int, default=MINING_WINDOW_DAYS, help="Mine sessions from this many days.")
+    parser.add_argument('--off-peak', metavar='START-END', default=None,
+                        help="Only run between these hours (local time, e.g. 1-6); stops when the window ends.")
+    args = parser.parse_args()
+
+    keep_going = _off_peak_checker(args.off_peak)
+    if not keep_going():
+        print(f"Outside the off-peak window {args.off_peak}; nothing to do.")
+        return
+
+    # Imported here: loads the models and sets up the Ollama pool and scheduler
+    from alchemist_core import DATABASE, OLLAMA_MODEL, generate_llm_prompt, init_db
+
+    init_db()
+    terms = frequent_terms(DATABASE, args.top, args.days)
+    print(f"Pregenerating prompts for {len(terms)} terms...")
+    started = time.perf_counter()
+    llm = partial(generate_llm_prompt, priority='background')
+    stored = pregenerate(DATABASE, llm, terms, args.per_key, OLLAMA_MODEL, keep_going)
+    print(f"Stored {stored} prompts in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
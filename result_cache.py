@@ -0,0 +1,256 @@
+# result_cache.py
+#
+# Semantic result cache for run_analysis. Inputs that differ only by punctuation,
+# word order or a small edit embed to nearly the same vector, so every full analysis
+# stores an embedding of its whole input, and a new input is compared with those
+# before the pipeline runs:
+#
+#   similarity >= SERVE_SIMILARITY   the stored key terms, graph and prompts are served as they are
+#   similarity >= ADAPT_SIMILARITY   the concept graph is rebuilt for the new text (cheap), and the
+#                                    stored prompts are kept if their main term is still a key term,
+#                                    so no Ollama calls are made
+#
+# Only analyses run with the same graph options and of a similar length are
+# candidates, and by default only the user's own (stored prompts can quote the input
+# they came from). The embeddings go into an int8 EmbeddingStore next to the database
+# (embedding_store.py), which every gunicorn worker maps instead of holding its own
+# float32 copy; SQLite keeps the rest of each entry and its row in the store, and each
+# process reads only the entries added since its last lookup (all of them again after
+# entries were removed). Entries go when their session is deleted, when they age out
+# or past MAX_ENTRIES; the store is compacted down to the remaining entries once it
+# holds STORE_MAX_ROWS vectors.
+#
+#   ALCHEMIST_RESULT_CACHE=0 gunicorn alchemist_core:app   # cache off
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from concept_stream import chunk_text
+from embedding_store import EmbeddingStore
+from metrics import observe_result_cache
+
+# --- Result Cache Configuration ---
+RESULT_CACHE = os.environ.get('ALCHEMIST_RESULT_CACHE', '1') == '1'
+SERVE_SIMILARITY = float(os.environ.get('ALCHEMIST_RESULT_CACHE_SERVE_SIMILARITY', '0.97'))
+ADAPT_SIMILARITY = float(os.environ.get('ALCHEMIST_RESULT_CACHE_ADAPT_SIMILARITY', '0.92'))
+# Match analyses from every user, not just the requester's own
+SHARED = os.environ.get('ALCHEMIST_RESULT_CACHE_SHARED', '0') == '1'
+# Candidates may differ in length by at most this fraction of the input's
+LENGTH_TOLERANCE = 0.2
+MAX_ENTRIES = int(os.environ.get('ALCHEMIST_RESULT_CACHE_MAX_ENTRIES', '20000'))
+# Vectors of removed entries stay in the store until it is compacted at this size
+STORE_MAX_ROWS = 2 * MAX_ENTRIES
+MAX_AGE_DAYS = 30
+# all-MiniLM-L6-v2 reads about this much text before truncating, so longer inputs are
+# embedded chunk by chunk and the chunk embeddings averaged
+EMBED_CHUNK_CHARS = 1000
+# Neighbours tried in turn when the best one's session has since been deleted
+CANDIDATES = 3
+# Defaults to an 'embeddings' directory next to the database
+EMBEDDING_DIR = os.environ.get('ALCHEMIST_EMBEDDING_DIR')
+
+CachedResult = namedtuple('CachedResult', ['decision', 'similarity', 'session_id', 'key_terms', 'prompts',
+                                           'graph_data'])
+
+
+def init_result_cache_tables(cursor):
+    """
+    Creates the result_cache table. Called from init_db() with an open cursor.
+    """
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(result_cache)').fetchall()]
+    if columns and 'store_generation' not in columns:
+        # Entries from an older layout (vectors inline, or rows without their store
+        # generation); it's only a cache
+        cursor.execute('DROP TABLE result_cache')
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS result_cache (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             session_id INTEGER NOT NULL,
+             user_id INTEGER NOT NULL,
+             input_chars INTEGER NOT NULL,
+             similarity_threshold REAL NOT NULL,
+             top_k INTEGER NOT NULL,
+             store_row INTEGER NOT NULL,
+             store_generation INTEGER NOT NULL,
+             created_at REAL NOT NULL
+         )
+     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_session ON result_cache (session_id)')
+
+
+def embed_input(encoder, text):
+    """One normalised float32 embedding for the whole of `text`."""
+    chunks = list(chunk_text(text, EMBED_CHUNK_CHARS)) or [text]
+    vectors = np.asarray(encoder.encode(chunks, normalize_embeddings=True), dtype=np.float32)
+    weights = np.array([len(chunk) for chunk in chunks], dtype=np.float32)
+    vector = weights @ vectors
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class ResultIndex:
+    """Brute-force nearest-neighbour search over the stored input embeddings."""
+
+    def __init__(self, database, embedding_dir=None):
+        self.database = database
+        embedding_dir = (embedding_dir or EMBEDDING_DIR
+                         or os.path.join(os.path.dirname(os.path.abspath(database)), 'embeddings'))
+        self.store_path = os.path.join(embedding_dir, 'result_cache')
+        self.store = None
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.last_id = 0
+        # The store generation these entries were read for
+        self.loaded_generation = None
+        self.store_rows = np.empty(0, dtype=np.int64)
+        self.store_generations = np.empty(0, dtype=np.int64)
+        self.session_ids = np.empty(0, dtype=np.int64)
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.input_chars = np.empty(0, dtype=np.int64)
+        self.thresholds = np.empty(0, dtype=np.float32)
+        self.top_ks = np.empty(0, dtype=np.int32)
+
+    def _open_store(self, dim=None):
+        # Created by the first add(); until then there is nothing to search
+        if self.store is None and (dim or os.path.exists(os.path.join(self.store_path, 'meta.json'))):
+            self.store = EmbeddingStore(self.store_path, input_dim=dim, quantization='int8')
+        return self.store
+
+    def _sync(self, conn, store):
+        # Entries removed (fewer rows up to last_id than we hold) or renumbered by a
+        # compaction (a new store generation) mean reading them all again
+        kept = conn.execute('SELECT COUNT(*) FROM result_cache WHERE id <= ?', (self.last_id,)).fetchone()[0]
+        if kept != len(self.session_ids) or store.generation != self.loaded_generation:
+            self._clear()
+            self.loaded_generation = store.generation
+        rows = conn.execute('SELECT id, session_id, user_id, input_chars, similarity_threshold, top_k, store_row, '
+                            'store_generation FROM result_cache WHERE id > ? ORDER BY id', (self.last_id,)).fetchall()
+        if not rows:
+            return
+        self.last_id = rows[-1][0]
+        for name, column, dtype in (('session_ids', 1, np.int64), ('user_ids', 2, np.int64),
+                                    ('input_chars', 3, np.int64), ('thresholds', 4, np.float32),
+                                    ('top_ks', 5, np.int32), ('store_rows', 6, np.int64),
+                                    ('store_generations', 7, np.int64)):
+            values = np.array([row[column] for row in rows], dtype=dtype)
+            setattr(self, name, np.concatenate([getattr(self, name), values]))
+
+    def find(self, user_id, embedding, input_chars, similarity_threshold, top_k=None):
+        """
+        The closest earlier analysis as a CachedResult, or None if nothing is above
+        ADAPT_SIMILARITY. Records the hit/miss and the best similarity either way.
+        """
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            with self.lock:
+                store = self._open_store()
+                if store is None:
+                    observe_result_cache(None, 'miss')
+                    return None
+                # The store first: entries are renumbered in SQLite before the store changes generation
+                store.refresh()
+                self._sync(conn, store)
+                if not len(self.store_rows):
+                    observe_result_cache(None, 'miss')
+                    return None
+                mask = ((np.abs(self.input_chars - input_chars) <= LENGTH_TOLERANCE * max(input_chars, 1))
+                        & (self.top_ks == (top_k or 0))
+                        & np.isclose(self.thresholds, similarity_threshold)
+                        # Rows from another generation, or past the end if the store was removed
+                        & (self.store_generations == store.generation)
+                        & (self.store_rows < store.count))
+                if not SHARED:
+                    mask &= self.user_ids == (user_id or 0)
+                candidates = np.flatnonzero(mask)
+                candidate_rows = self.store_rows[candidates]
+                scores, rows = store.search(embedding, CANDIDATES, rows=candidate_rows)
+                matches = [(float(score), int(self.session_ids[candidates[np.argmax(candidate_rows == row)]]))
+                           for score, row in zip(scores[0], rows[0])]
+
+            for similarity, session_id in matches:
+                if similarity < ADAPT_SIMILARITY:
+                    break
+                row = conn.execute('SELECT key_terms, prompts, graph_data FROM sessions WHERE id = ?',
+                                   (session_id,)).fetchone()
+                if row is None:
+                    continue  # deleted since
+                decision = 'serve' if similarity >= SERVE_SIMILARITY else 'adapt'
+                observe_result_cache(similarity, decision)
+                return CachedResult(decision, similarity, session_id, json.loads(row[0] or '[]'),
+                                    json.loads(row[1] or '[]'), row[2])
+        finally:
+            conn.close()
+        observe_result_cache(matches[0][0] if matches else None, 'miss')
+        return None
+
+    def add(self, session_id, user_id, embedding, input_chars, similarity_threshold, top_k=None):
+        """Makes a finished analysis available to later lookups in every process."""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            store = self._open_store(len(embedding))
+            generation, rows = store.append(embedding)
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            now = time.time()
+            conn.execute('INSERT INTO result_cache (session_id, user_id, input_chars, similarity_threshold, top_k, '
+                         'store_row, store_generation, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (session_id, user_id or 0, input_chars, similarity_threshold, top_k or 0, int(rows[0]),
+                          generation, now))
+            conn.execute('DELETE FROM result_cache WHERE created_at < ? OR id <= '
+                         '(SELECT id FROM result_cache ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                         (now - MAX_AGE_DAYS * 86400, MAX_ENTRIES))
+            conn.commit()
+        finally:
+            conn.close()
+        if store.count >= STORE_MAX_ROWS:
+            self.compact()
+
+    def remove_session(self, session_id):
+        """Drops the entries for a deleted session; every process rereads the index on its next lookup."""
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            conn.execute('DELETE FROM result_cache WHERE session_id = ?', (session_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def compact(self):
+        """Rewrites the store with only the vectors of the entries still in the table."""
+        store = self._open_store()
+        if store is None:
+            return
+        conn = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+        entries = []
+
+        def keep(generation, count):
+            entries[:] = conn.execute('SELECT id, store_row FROM result_cache WHERE store_generation = ? '
+                                      'AND store_row < ? ORDER BY id', (generation, count)).fetchall()
+            return [store_row for _, store_row in entries]
+
+        def renumber(generation):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('UPDATE result_cache SET store_row = ?, store_generation = ? WHERE id = ?',
+                                 [(new_row, generation, entry_id) for new_row, (entry_id, _) in enumerate(entries)])
+                # Left over: entries whose vector was appended to an older generation while
+                # it was being compacted, or rows past the end of a store that was removed
+                conn.execute('DELETE FROM result_cache WHERE store_generation != ?', (generation,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+        try:
+            with self.lock:
+                before = store.count
+                store.compact(keep, renumber)
+            print(f"Result cache store compacted from {before} to {store.count} vectors.")
+        finally:
+            conn.close()
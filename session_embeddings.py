@@ -0,0 +1,111 @@
+# session_embeddings.py
+#
+# Term embeddings of each saved session, stored as float16 (768 bytes per term for
+# all-MiniLM-L6-v2, half of float32; similarities move by well under 0.01). With these
+# the edges of a saved graph can be recomputed for any threshold or top-k with one
+# matrix product, which is what the threshold slider does, instead of running spaCy
+# and the encoder again. The candidate edges are computed once per session and kept
+# sorted, strongest first, so each slider move only has to find where the threshold
+# cuts the list.
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from knn_graph import similarity_edges
+
+STORED_DTYPE = np.float16
+# Sessions whose sorted candidate edges each process keeps
+EDGE_CACHE_SIZE = 64
+
+
+def init_session_embedding_tables(cursor):
+    """
+    Creates the session_embeddings table. Called from init_db() with an open cursor.
+    """
+    cursor.execute('''
+         CREATE TABLE IF NOT EXISTS session_embeddings (
+             session_id INTEGER PRIMARY KEY,
+             terms INTEGER NOT NULL,
+             dim INTEGER NOT NULL,
+             data BLOB NOT NULL
+         )
+     ''')
+
+
+def save_embeddings(database, session_id, embeddings):
+    """Stores the session's term embeddings (terms x dim, at least one term)."""
+    embeddings = np.asarray(embeddings, dtype=STORED_DTYPE)
+    if embeddings.ndim != 2 or not embeddings.size:
+        raise ValueError(f"Expected a non-empty terms x dim array of embeddings, got shape {embeddings.shape}.")
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        conn.execute('INSERT OR REPLACE INTO session_embeddings (session_id, terms, dim, data) VALUES (?, ?, ?, ?)',
+                     (session_id, embeddings.shape[0], embeddings.shape[1], embeddings.tobytes()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_embeddings(database, session_id):
+    """The session's term embeddings as float32 (terms x dim), or None if none were stored."""
+    conn = sqlite3.connect(database)
+    try:
+        row = conn.execute('SELECT terms, dim, data FROM session_embeddings WHERE session_id = ?',
+                           (session_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    terms, dim, data = row
+    return np.frombuffer(data, dtype=STORED_DTYPE).reshape(terms, dim).astype(np.float32)
+
+
+def delete_embeddings(database, session_id):
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute('DELETE FROM session_embeddings WHERE session_id = ?', (session_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sorted_candidate_edges(embeddings, top_k=None):
+    """
+    Every edge the graph can have at any threshold, strongest first: all pairs, or
+    each term's top-k neighbours when top-k applies (those don't depend on the threshold).
+    """
+    rows, cols, weights = similarity_edges(embeddings, -1.0, top_k)
+    order = np.argsort(-weights, kind='stable')
+    return rows[order], cols[order], weights[order]
+
+
+class ThresholdEdges:
+    """Per-process cache of sorted candidate edges, keyed by (session_id, top_k)."""
+
+    def __init__(self, capacity=EDGE_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def edges(self, key, load_embeddings, threshold, top_k=None, limit=None):
+        """
+        (rows, cols, weights, total) for the edges above `threshold`, at most `limit` of
+        them (the strongest). `load_embeddings()` is only called on a cache miss.
+        """
+        with self.lock:
+            candidates = self.entries.get((key, top_k))
+            if candidates is not None:
+                self.entries.move_to_end((key, top_k))
+        if candidates is None:
+            candidates = sorted_candidate_edges(load_embeddings(), top_k)
+            with self.lock:
+                self.entries[(key, top_k)] = candidates
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+        rows, cols, weights = candidates
+        total = int(np.searchsorted(-weights, -threshold, side='left'))
+        end = total if limit is None else min(total, limit)
+        return rows[:end], cols[:end], weights[:end], total
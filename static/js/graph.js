@@ -38,7 +38,8 @@ function renderGraph(graphData) {
                 hover: '#2B7CE9'
             }
         },
-        physics: { 
+        // Positions computed on the server: render them as-is, no physics
+        physics: graphData.positioned ? false : { 
             stabilization: false, 
             barnesHut: { 
                 gravitationalConstant: -2000, 
@@ -56,21 +57,27 @@ function renderGraph(graphData) {
             tooltipDelay: 200,
             hideEdgesOnDrag: true
         },
-        manipulation: { enabled: false }
+        manipulation: { enabled: false },
+        layout: { improvedLayout: !graphData.positioned }
     };
     
     // Create new network instance
     network = new vis.Network(container, data, options);
     
     // Fit the network to the container
-    network.once('stabilizationIterationsDone', function() {
-        network.fit({
-            animation: {
-                duration: 1000,
-                easingFunction: 'easeInOutQuad'
-            }
+    if (graphData.positioned) {
+        // No stabilization to wait for
+        network.fit();
+    } else {
+        network.once('stabilizationIterationsDone', function() {
+            network.fit({
+                animation: {
+                    duration: 1000,
+                    easingFunction: 'easeInOutQuad'
+                }
+            });
         });
-    });
+    }
     
     // Handle window resize
     window.addEventListener('resize', function() {
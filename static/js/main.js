@@ -461,7 +461,8 @@ function updateUIWithResponse(data) {
                     forceDirection: 'horizontal'
                 }
             },
-            physics: {
+            // Positions computed on the server: render them as-is, no physics
+            physics: data.graph_data.positioned ? false : {
                 enabled: true,
                 hierarchical: {
                     direction: 'LR',
@@ -469,7 +470,7 @@ function updateUIWithResponse(data) {
                 }
             },
             layout: {
-                improvedLayout: true
+                improvedLayout: !data.graph_data.positioned
             }
         };
         
@@ -0,0 +1,164 @@
+# tests/test_model_access.py
+#
+# model_access.ModelAccess under concurrent load, with stand-in pipelines so neither
+# spaCy nor torch is needed. The stand-ins fail like the Hugging Face tokenizer does
+# ("Already borrowed") when two threads use the same copy at once.
+#
+#   python -m pytest tests/test_model_access.py
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from model_access import InferenceBusy, ModelAccess
+
+REQUEST_THREADS = 16
+TEXTS = [f"text number {i} about concept {i % 7}" for i in range(64)]
+
+
+class _Exclusive:
+    """Raises if two threads are inside this copy at the same time."""
+
+    def __init__(self):
+        self._busy = threading.Lock()
+
+    def _enter(self):
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+
+    def _leave(self):
+        self._busy.release()
+
+
+class StubNlp(_Exclusive):
+    def __call__(self, text):
+        self._enter()
+        try:
+            time.sleep(0.0005)
+            return text.upper().split()
+        finally:
+            self._leave()
+
+    def pipe(self, texts, **kwargs):
+        self._enter()
+        try:
+            time.sleep(0.0005)
+            return [text.upper().split() for text in texts]
+        finally:
+            self._leave()
+
+
+class StubEncoder(_Exclusive):
+    def encode(self, sentences, normalize_embeddings=False):
+        self._enter()
+        try:
+            time.sleep(0.0005)
+            vectors = np.array([[len(s), sum(map(ord, s)) % 101, s.count(' ')] for s in sentences], dtype=np.float32)
+            if normalize_embeddings:
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors
+        finally:
+            self._leave()
+
+
+def _access(threads=2, **kwargs):
+    loads = []
+
+    def load_nlp():
+        loads.append('nlp')
+        return StubNlp()
+
+    def load_encoder():
+        loads.append('encoder')
+        return StubEncoder()
+
+    return ModelAccess(StubNlp(), StubEncoder(), load_nlp, load_encoder, threads=threads, **kwargs), loads
+
+
+def _work(models, text):
+    return (models.nlp(text), models.nlp.pipe([text, text[::-1]]),
+            models.encoder.encode([text], normalize_embeddings=True).tolist(),
+            models.call(lambda nlp, encoder, t: (nlp(t), encoder.encode([t]).tolist()), text))
+
+
+def _run_concurrently(fn, items, threads=REQUEST_THREADS):
+    results, errors = [None] * len(items), []
+    start = threading.Barrier(threads)
+
+    def serve(first):
+        start.wait()
+        for i in range(first, len(items), threads):
+            try:
+                results[i] = fn(items[i])
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=serve, args=(t,)) for t in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return results, errors
+
+
+@pytest.mark.parametrize('inference_threads', [1, 3])
+def test_concurrent_calls_match_sequential(inference_threads):
+    models, _ = _access(threads=inference_threads, max_queued=REQUEST_THREADS * 4)
+    models.start_all()
+    expected = [_work(models, text) for text in TEXTS]
+
+    results, errors = _run_concurrently(lambda text: _work(models, text), TEXTS)
+
+    assert errors == []
+    assert results == expected
+
+
+def test_unguarded_stubs_do_fail_concurrently():
+    # The check above means something only if the stand-ins notice shared use
+    nlp = StubNlp()
+    _, errors = _run_concurrently(nlp, TEXTS * 4)
+    assert any("Already borrowed" in str(e) for e in errors)
+
+
+def test_nested_call_runs_inline():
+    models, _ = _access(threads=1, max_queued=0)
+    assert models.call(lambda nlp, encoder: models.nlp("a b")) == ['A', 'B']
+
+
+def test_full_queue_raises_inference_busy():
+    models, _ = _access(threads=1, max_queued=1, wait_seconds=0.05)
+    release = threading.Event()
+    blocked = []
+
+    def occupy():
+        blocked.append(models.call(lambda nlp, encoder: release.wait(5)))
+
+    # One call running and one queued fill every place
+    holders = [threading.Thread(target=occupy) for _ in range(2)]
+    for t in holders:
+        t.start()
+    deadline = time.monotonic() + 5
+    while models._places._value and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    with pytest.raises(InferenceBusy):
+        models.call(lambda nlp, encoder: None)
+
+    release.set()
+    for t in holders:
+        t.join()
+    assert blocked == [True, True]
+    # The places are given back once the calls finish
+    assert models.call(lambda nlp, encoder: 'free') == 'free'
+
+
+def test_start_all_is_idempotent():
+    models, loads = _access(threads=3)
+    models.start_all()
+    models.start_all()
+    # The first thread uses the models passed in; the other two load one copy each
+    assert sorted(loads) == ['encoder', 'encoder', 'nlp', 'nlp']
+    assert models.nlp("x y") == ['X', 'Y']
+    assert sorted(loads) == ['encoder', 'encoder', 'nlp', 'nlp']
@@ -0,0 +1,136 @@
+# thread_budget.py
+#
+# Splits the machine's cores between worker processes so N gunicorn workers don't each
+# start a PyTorch/BLAS/tokenizers pool sized to every core and oversubscribe the CPU.
+#
+#   ALCHEMIST_CPU_CORES           cores to budget for (default: cores this process may run on)
+#   ALCHEMIST_BUDGET_WORKERS      processes sharing them (default: WEB_CONCURRENCY or 1)
+#   ALCHEMIST_THREADS_PER_WORKER  explicit per-process thread count, overrides the split
+#   ALCHEMIST_INFERENCE_THREADS   model pipelines running at once per process (model_access.py);
+#                                 the process's threads are split between them
+#   ALCHEMIST_CPU_AFFINITY        'none' (default) or 'pin' to give each worker its own cores
+
+import os
+import sys
+
+# Thread pools that read their size from the environment when their library is first imported
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'RAYON_NUM_THREADS')
+
+CPU_AFFINITY = os.environ.get('ALCHEMIST_CPU_AFFINITY', 'none')
+
+
+def available_cores():
+    if os.environ.get('ALCHEMIST_CPU_CORES'):
+        return int(os.environ['ALCHEMIST_CPU_CORES'])
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def budget_workers():
+    return int(os.environ.get('ALCHEMIST_BUDGET_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1)
+
+
+def threads_per_worker(workers=None, cores=None):
+    if os.environ.get('ALCHEMIST_THREADS_PER_WORKER'):
+        return max(1, int(os.environ['ALCHEMIST_THREADS_PER_WORKER']))
+    workers = workers or budget_workers()
+    cores = cores or available_cores()
+    return max(1, cores // max(1, workers))
+
+
+def inference_threads():
+    return max(1, int(os.environ.get('ALCHEMIST_INFERENCE_THREADS') or 1))
+
+
+def threads_per_pipeline(pipelines=None):
+    """Threads for each concurrently running model pipeline: the worker's share split between them."""
+    return max(1, threads_per_worker() // (pipelines or inference_threads()))
+
+
+def apply_env_budget(threads=None):
+    """
+    Sets the thread-pool environment variables. Must run before numpy, torch or
+    tokenizers are imported; values already present in the environment win.
+    """
+    threads = threads or threads_per_pipeline()
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    # The Rust tokenizers pool would otherwise fan out across all cores per call
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false' if threads == 1 else 'true')
+    return threads
+
+
+def apply_runtime_budget(threads=None):
+    """Caps pools that were already created (torch, BLAS via threadpoolctl). Safe to call after imports."""
+    threads = threads or threads_per_pipeline()
+    if 'torch' in sys.modules:
+        torch = sys.modules['torch']
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # can only be set once, before any inter-op work has started
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+    return threads
+
+
+def pin_to_cores(slot, threads=None):
+    """
+    Restricts this process to its own slice of cores: slot 0 gets the first `threads`
+    cores, slot 1 the next ones, wrapping around when there are more slots than fit.
+    """
+    if CPU_AFFINITY != 'pin' or not hasattr(os, 'sched_setaffinity'):
+        return None
+    threads = threads or threads_per_worker()
+    cores = sorted(os.sched_getaffinity(0))
+    start = (slot * threads) % len(cores)
+    chosen = {cores[(start + i) % len(cores)] for i in range(min(threads, len(cores)))}
+    os.sched_setaffinity(0, chosen)
+    return sorted(chosen)
+
+
+def effective_settings():
+    settings = {
+        'pid': os.getpid(),
+        'cores_budgeted': available_cores(),
+        'workers': budget_workers(),
+        'threads_per_worker': threads_per_worker(),
+        'inference_threads': inference_threads(),
+        'threads_per_pipeline': threads_per_pipeline(),
+        'cpu_affinity_mode': CPU_AFFINITY,
+        'env': {name: os.environ.get(name) for name in THREAD_ENV_VARS + ('TOKENIZERS_PARALLELISM',)},
+    }
+    if hasattr(os, 'sched_getaffinity'):
+        settings['affinity'] = sorted(os.sched_getaffinity(0))
+    if 'torch' in sys.modules:
+        torch = sys.modules['torch']
+        settings['torch_threads'] = torch.get_num_threads()
+        settings['torch_interop_threads'] = torch.get_num_interop_threads()
+    try:
+        from threadpoolctl import threadpool_info
+        settings['blas_pools'] = [{'library': p['internal_api'], 'threads': p['num_threads']}
+                                  for p in threadpool_info()]
+    except ImportError:
+        pass
+    return settings
+
+
+def format_report(settings=None):
+    s = settings or effective_settings()
+    lines = [f"CPU thread budget (pid {s['pid']}): {s['cores_budgeted']} core(s) / {s['workers']} worker(s) "
+             f"-> {s['threads_per_worker']} thread(s) per worker, {s['threads_per_pipeline']} for each of "
+             f"{s['inference_threads']} inference thread(s), affinity={s['cpu_affinity_mode']}"]
+    if 'affinity' in s:
+        lines.append(f"  allowed CPUs: {s['affinity']}")
+    if 'torch_threads' in s:
+        lines.append(f"  torch intra-op threads: {s['torch_threads']}, inter-op: {s['torch_interop_threads']}")
+    for pool in s.get('blas_pools', []):
+        lines.append(f"  {pool['library']}: {pool['threads']} thread(s)")
+    lines.append("  env: " + ', '.join(f"{k}={v}" for k, v in s['env'].items() if v is not None))
+    return '\n'.join(lines)
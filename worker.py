@@ -0,0 +1,103 @@
+# worker.py
+#
+# Background worker for the durable job queue. Claims analysis jobs enqueued by
+# the web process, runs the full pipeline and writes the result into `sessions`.
+#
+#   python worker.py                  # one worker process
+#   python worker.py --processes 4    # four worker processes sharing the queue
+
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+
+from deadlines import Deadline, cancel_checker
+from job_queue import claim_job, complete_job, fail_job, renew_lease, JOB_LEASE_SECONDS
+
+POLL_INTERVAL = float(os.environ.get('ALCHEMIST_WORKER_POLL_INTERVAL', '1.0'))
+
+
+def _keep_lease_alive(database, job_id, worker_id, stop_event):
+    # Renew well before the lease runs out so a slow Ollama call doesn't get the job reclaimed.
+    while not stop_event.wait(JOB_LEASE_SECONDS / 3):
+        if not renew_lease(database, job_id, worker_id):
+            print(f"[{worker_id}] Lost lease on job {job_id}; it has been reclaimed.")
+            return
+
+
+def run_worker(worker_id, max_jobs=None, slot=0):
+    import thread_budget
+
+    thread_budget.pin_to_cores(slot)
+    # Imported here so each worker process loads spaCy and the encoder itself after forking.
+    from alchemist_core import DATABASE, init_db, run_analysis
+
+    init_db()
+    print(f"[{worker_id}] Worker ready, polling '{DATABASE}' for jobs.")
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_job(DATABASE, worker_id)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        queued_for = job['started_at'] - job['enqueued_at']
+        print(f"[{worker_id}] Claimed job {job['id']} (attempt {job['attempts']}/{job['max_attempts']}, "
+              f"queued {queued_for:.2f}s).")
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=_keep_lease_alive,
+                                     args=(DATABASE, job['id'], worker_id, stop_event), daemon=True)
+        heartbeat.start()
+        try:
+            payload = dict(job['payload'])
+            # No time limit for queued work, but the page that submitted it can still cancel it
+            check = cancel_checker(DATABASE, job['user_id'], payload.pop('request_id', None))
+            deadline = Deadline(None, check) if check else None
+            # job_id: a retry of this job rewrites the session an earlier attempt saved
+            result = run_analysis(job['user_id'], payload.pop('user_input'), deadline=deadline, job_id=job['id'],
+                                  **payload)
+        except Exception as e:
+            traceback.print_exc()
+            status = fail_job(DATABASE, job['id'], worker_id, f"{type(e).__name__}: {e}")
+            print(f"[{worker_id}] Job {job['id']} failed; now '{status}'.")
+        else:
+            if complete_job(DATABASE, job['id'], worker_id, result['new_session_id'], result):
+                print(f"[{worker_id}] Job {job['id']} done in {time.time() - job['started_at']:.2f}s.")
+            else:
+                print(f"[{worker_id}] Job {job['id']} finished after its lease was reclaimed; result discarded.")
+        finally:
+            stop_event.set()
+            heartbeat.join()
+        processed += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="The Idea Forge background analysis worker.")
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('ALCHEMIST_WORKER_PROCESSES', '1')),
+                        help="Number of worker processes to run.")
+    parser.add_argument('--max-jobs', type=int, default=None,
+                        help="Exit after processing this many jobs (per process).")
+    args = parser.parse_args()
+
+    base_id = f"{socket.gethostname()}-{os.getpid()}"
+    # Worker processes share the cores, see thread_budget.py
+    os.environ.setdefault('ALCHEMIST_BUDGET_WORKERS', str(max(1, args.processes)))
+    if args.processes <= 1:
+        run_worker(base_id, args.max_jobs)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(f"{base_id}-{i}", args.max_jobs, i))
+        for i in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()